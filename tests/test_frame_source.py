@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import os
+import threading
+import importlib.util
+import unittest
+
+import numpy as np
+
+# frame_source only needs cv2 and numpy, it is loaded by path so the test does
+# not import the vilib package (and with it the camera and detector modules)
+_path = os.path.join(os.path.dirname(__file__), '..', 'vilib', 'frame_source.py')
+_spec = importlib.util.spec_from_file_location('frame_source', _path)
+frame_source = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(frame_source)
+
+
+class FailingStillSource():
+    '''Video frames forever, every still capture raises.'''
+    def __init__(self):
+        self.frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        self.stills = 0
+
+    def read(self):
+        return self.frame
+
+    def capture_still(self):
+        self.stills += 1
+        raise IOError('still port busy')
+
+
+class CaptureThreadStillTest(unittest.TestCase):
+    def setUp(self):
+        self.source = FailingStillSource()
+        self.capture = frame_source.CaptureThread(self.source).start()
+
+    def tearDown(self):
+        self.capture.stop()
+
+    def request_still(self):
+        done = threading.Event()
+        stills = []
+        def callback(still):
+            stills.append(still)
+            done.set()
+        self.capture.request_still(callback)
+        self.assertTrue(done.wait(2), 'the requester was not called back')
+        return stills[0]
+
+    def test_failed_still_is_passed_on_as_none(self):
+        self.assertIsNone(self.request_still())
+        self.assertEqual(self.source.stills, 1)
+
+    def test_video_keeps_running_after_failed_stills(self):
+        self.request_still()
+        self.request_still()
+        frame, frame_id, _ = self.capture.read(0)
+        frame, next_id, _ = self.capture.read(frame_id)
+        self.assertIsNotNone(frame)
+        self.assertGreater(next_id, frame_id)
+        self.assertTrue(self.capture.is_alive())
+        self.assertIsNone(self.capture.error)
+
+    def test_failing_callback_does_not_stop_the_capture(self):
+        done = threading.Event()
+        def callback(still):
+            done.set()
+            raise RuntimeError('save failed')
+        self.capture.request_still(callback)
+        self.assertTrue(done.wait(2))
+        self.request_still()
+        self.assertTrue(self.capture.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
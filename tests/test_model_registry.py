@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+import os
+import sys
+import importlib.util
+import unittest
+
+# model_registry is loaded by path, with vilib/ on the path for its "run as a
+# script" import of tflite_model, so the test does not import the vilib package
+_dir = os.path.join(os.path.dirname(__file__), '..', 'vilib')
+sys.path.insert(0, _dir)
+_spec = importlib.util.spec_from_file_location('model_registry', os.path.join(_dir, 'model_registry.py'))
+model_registry = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(model_registry)
+
+
+class FakeInterpreter():
+    def invoke(self):
+        pass
+
+
+class ModelRegistryConfigureTest(unittest.TestCase):
+    def setUp(self):
+        self.created = []
+        def create_interpreter(path, num_threads=None, delegate=None):
+            self.created.append((path, num_threads, delegate))
+            return FakeInterpreter(), None
+        self._create_interpreter = model_registry.create_interpreter
+        self._model = model_registry.TfliteModel
+        model_registry.create_interpreter = create_interpreter
+        model_registry.TfliteModel = lambda interpreter, scale=None, offset=0.0: object()
+        self.registry = model_registry.ModelRegistry()
+
+    def tearDown(self):
+        model_registry.create_interpreter = self._create_interpreter
+        model_registry.TfliteModel = self._model
+
+    def test_configure_rebuilds_a_loaded_model(self):
+        first = self.registry.load('gesture', 'a.tflite')
+        self.registry.configure('gesture', num_threads=2)
+        second = self.registry.load('gesture', 'a.tflite')
+        self.assertIsNot(first, second)
+        self.assertEqual(self.created[-1], ('a.tflite', 2, None))
+
+    def test_unchanged_options_keep_the_model(self):
+        self.registry.configure('gesture', num_threads=2)
+        first = self.registry.load('gesture', 'a.tflite')
+        self.registry.configure('gesture', num_threads=2, warmup=3)
+        self.assertIs(self.registry.load('gesture', 'a.tflite'), first)
+        self.assertEqual(len(self.created), 1)
+
+    def test_load_options_apply_to_a_loaded_model(self):
+        self.registry.load('gesture', 'a.tflite')
+        self.registry.load('gesture', 'a.tflite', delegate='xnnpack')
+        self.assertEqual(self.created[-1], ('a.tflite', None, 'xnnpack'))
+
+    def test_unknown_option_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.registry.configure('gesture', threads=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
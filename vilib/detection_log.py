@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+import os
+import glob
+import json
+import time
+import queue
+import threading
+
+import numpy as np
+
+# Append-only binary log of the detection results, one fixed-width record per
+# frame and detector. Each detector has its own files in the session directory:
+#
+#   session.json             record dtypes of the detectors
+#   color.000000.bin         color records, the next segment starts once
+#   color.000001.bin         a file reaches max_bytes
+#   objects.000000.bin
+#
+# The files are plain little-endian numpy records, load_session() reads a
+# session back into structured arrays (memory-mapped if asked).
+
+MAX_OBJECTS = 10    # detections kept per frame, by score
+MAX_HANDS = 2
+
+RECORD_HEAD = [('frame_id', '<u8'), ('timestamp', '<f8')]
+
+BOX_FIELDS = [('x', '<i4'), ('y', '<i4'), ('w', '<i4'), ('h', '<i4')]
+
+# name: (switch flag in detect_obj_parameter, key prefix, fields after the head)
+DETECTORS = {
+    'color': ('cdf_flag', 'color', BOX_FIELDS + [('n', '<i4')]),
+    'human': ('hdf_flag', 'human', BOX_FIELDS + [('n', '<i4')]),
+    'traffic_sign': ('ts_flag', 'traffic_sign', BOX_FIELDS + [('t', 'S16'), ('acc', '<f4')]),
+    'gesture': ('gs_flag', 'gesture', BOX_FIELDS + [('t', 'S16'), ('acc', '<f4')]),
+    'qrcode': ('qr_flag', 'qr', BOX_FIELDS + [('data', 'S128')]),
+    'objects': ('odf_flag', 'object', [('n', '<i4'), ('boxes', '<f4', (MAX_OBJECTS, 4)),
+                                       ('classes', '<i4', (MAX_OBJECTS,)), ('scores', '<f4', (MAX_OBJECTS,))]),
+    'hands': ('gdf_flag', 'hands', [('n', '<i4'), ('joints', '<f4', (MAX_HANDS, 21, 3))]),
+    'pose': ('pdf_flag', 'body', [('n', '<i4'), ('joints', '<f4', (33, 4))]),
+    'classification': ('icf_flag', 'image_classify', [('t', 'S32'), ('acc', '<f4')]),
+}
+
+
+def record_dtype(name):
+    return np.dtype(RECORD_HEAD + DETECTORS[name][2])
+
+
+def _fill(name, record, params):
+    prefix = DETECTORS[name][1]
+    if name == 'objects':
+        n = min(len(params['object_scores']), MAX_OBJECTS)
+        record['n'] = n
+        record['boxes'][:n] = params['object_boxes'][:n]
+        record['classes'][:n] = params['object_classes'][:n]
+        record['scores'][:n] = params['object_scores'][:n]
+    elif name in ('hands', 'pose'):
+        joints = params[prefix + '_joints']
+        if joints is not None:
+            if name == 'hands':
+                n = min(len(joints), MAX_HANDS)
+                record['joints'][:n] = joints[:n]
+            else:
+                n = 1
+                record['joints'] = joints
+            record['n'] = n
+    else:
+        for field in DETECTORS[name][2]:
+            key = field[0]
+            value = params.get('%s_%s'%(prefix, key))
+            if field[1].startswith('S'):
+                value = str(value).encode('utf-8')
+            record[key] = value
+
+
+class DetectionLog():
+    '''
+    Writes the results of the switched-on detectors of every logged frame.
+
+    log() only packs the records and queues them, a background thread writes
+    them. At most max_queue frames wait to be written, frames logged while
+    the queue is full are dropped and counted in dropped.
+    '''
+    def __init__(self, path, detectors=None, max_bytes=64*1024*1024, max_queue=256, max_segments=None):
+        """
+        path: session directory, created if missing
+        detectors: names of DETECTORS to log, None for all of them
+        max_bytes: size of a segment file before the next one is started
+        max_segments: segments kept per detector, the oldest are deleted, None keeps all
+        """
+        self.path = path
+        self.detectors = list(DETECTORS if detectors is None else detectors)
+        self.dtypes = {name: record_dtype(name) for name in self.detectors}
+        self.max_bytes = max_bytes
+        self.max_segments = max_segments
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.written = 0    # records
+        self.files = {}
+        self.segments = {}
+
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'session.json'), 'w') as f:
+            json.dump({'version': 1,
+                       'created': time.time(),
+                       'detectors': {name: dtype.descr for name, dtype in self.dtypes.items()}}, f)
+
+        self.thread = threading.Thread(name='detection_log', target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def log(self, frame_id, timestamp, params):
+        """Queues the records of the detectors switched on in params (a detect_obj_parameter)."""
+        records = []
+        for name in self.detectors:
+            if params.get(DETECTORS[name][0]) != True:
+                continue
+            record = np.zeros((), dtype=self.dtypes[name])
+            record['frame_id'] = frame_id
+            record['timestamp'] = timestamp
+            _fill(name, record, params)
+            records.append((name, record))
+        if len(records) == 0:
+            return
+        try:
+            self.queue.put_nowait(records)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            items = [self.queue.get()]
+            # write everything that is waiting in one go
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in items
+            batches = {}
+            for records in items:
+                if records is None:
+                    continue
+                for name, record in records:
+                    batches.setdefault(name, []).append(record)
+            for name, records in batches.items():
+                self._write(name, np.stack(records).tobytes())
+                self.written += len(records)
+            if stop:
+                break
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+    def _write(self, name, data):
+        f = self.files.get(name)
+        if f is None or f.tell() >= self.max_bytes:
+            if f is not None:
+                f.close()
+            segment = self.segments.get(name, -1) + 1
+            self.segments[name] = segment
+            f = self.files[name] = open(os.path.join(self.path, '%s.%06d.bin'%(name, segment)), 'ab')
+            if self.max_segments is not None and segment >= self.max_segments:
+                old = os.path.join(self.path, '%s.%06d.bin'%(name, segment - self.max_segments))
+                if os.path.exists(old):
+                    os.remove(old)
+        f.write(data)
+
+    def close(self, timeout=5):
+        """Writes what is queued and closes the files."""
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+
+def load_session(path, mmap=False):
+    """Returns {detector: structured array of its records} of a session directory.
+
+    mmap=True memory-maps the segment files instead of reading them, a detector
+    with several segments is then a list of arrays, one per segment.
+    """
+    with open(os.path.join(path, 'session.json')) as f:
+        session = json.load(f)
+    data = {}
+    for name, descr in session['detectors'].items():
+        dtype = np.dtype([(field[0], field[1]) + ((tuple(field[2]),) if len(field) > 2 else ()) for field in descr])
+        arrays = []
+        for segment in sorted(glob.glob(os.path.join(path, '%s.*.bin'%name))):
+            if os.path.getsize(segment) < dtype.itemsize:
+                continue
+            if mmap:
+                count = os.path.getsize(segment) // dtype.itemsize
+                arrays.append(np.memmap(segment, dtype=dtype, mode='r', shape=(count,)))
+            else:
+                arrays.append(np.fromfile(segment, dtype=dtype))
+        if len(arrays) == 0:
+            data[name] = np.zeros(0, dtype=dtype)
+        elif mmap:
+            data[name] = arrays[0] if len(arrays) == 1 else arrays
+        else:
+            data[name] = np.concatenate(arrays)
+    return data
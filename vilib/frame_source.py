@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+import time
+import queue
+import threading
+
+import cv2
+
+
+class PiCameraSource():
+    '''
+    Frames from the PiCamera video port, plus still captures from the still
+    port that do not stop the video stream.
+
+    still_resolution=None takes stills at the video resolution. Otherwise the
+    sensor runs at still_resolution and the GPU resizer scales the video port
+    down to resolution, so a still only costs the mode switch of a single
+    still port capture (the video port drops a frame or two meanwhile).
+    Large still resolutions limit the video frame rate to what that sensor
+    mode supports.
+    '''
+    def __init__(self, resolution=(640,480), framerate=24, still_resolution=None,
+                 vflip=False, hflip=False, effect='none'):
+        self.resolution = tuple(resolution)
+        self.still_resolution = tuple(still_resolution) if still_resolution != None else self.resolution
+
+        from picamera import PiCamera
+        camera = PiCamera()
+        camera.resolution = self.still_resolution
+        camera.image_effect = effect
+        camera.framerate = framerate
+        camera.rotation = 0
+        camera.brightness = 50    #(0 to 100)
+        camera.sharpness = 0      #(-100 to 100)
+        camera.contrast = 0       #(-100 to 100)
+        camera.saturation = 0     #(-100 to 100)
+        camera.iso = 0            #(automatic)(100 to 800)
+        camera.exposure_compensation = 0   #(-25 to 25)
+        camera.exposure_mode = 'auto'
+        camera.meter_mode = 'average'
+        camera.awb_mode = 'auto'
+        camera.hflip = hflip
+        camera.vflip = vflip
+        camera.crop = (0.0, 0.0, 1.0, 1.0)
+        self.camera = camera
+
+        resize = self.resolution if self.still_resolution != self.resolution else None
+        from picamera.array import PiRGBArray
+        self.raw_capture = PiRGBArray(camera, size=self.resolution)
+        self.stream = camera.capture_continuous(self.raw_capture, format="bgr", use_video_port=True, resize=resize)
+
+    def read(self):
+        """Returns the next BGR video frame."""
+        self.raw_capture.truncate(0)
+        frame = next(self.stream)
+        return frame.array
+
+    def capture_still(self):
+        """Returns a BGR still at still_resolution, the video stream carries on afterwards."""
+        from picamera.array import PiRGBArray
+        output = PiRGBArray(self.camera, size=self.still_resolution)
+        self.camera.capture(output, format="bgr", use_video_port=False)
+        return output.array
+
+    def close(self):
+        self.stream.close()
+        self.camera.close()
+
+
+class VideoCaptureSource():
+    '''
+    Frames from cv2.VideoCapture: a USB camera (device index), a video file or
+    a stream url. There is no separate still port, a still is the next frame.
+    camera is None, the PiCamera settings and effects do not apply.
+    '''
+    def __init__(self, device=0, resolution=(640,480), framerate=24, vflip=False, hflip=False):
+        self.device = device
+        self.capture = cv2.VideoCapture(device)
+        if not self.capture.isOpened():
+            raise IOError('cannot open video source %s'%device)
+        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+        self.capture.set(cv2.CAP_PROP_FPS, framerate)
+        self.resolution = tuple(resolution)
+        self.camera = None
+        if vflip and hflip:
+            self.flip_code = -1
+        elif vflip:
+            self.flip_code = 0
+        elif hflip:
+            self.flip_code = 1
+        else:
+            self.flip_code = None
+
+    def read(self):
+        """Returns the next BGR frame."""
+        ok, frame = self.capture.read()
+        if not ok:
+            raise IOError('video source %s stopped'%self.device)
+        if self.flip_code is not None:
+            frame = cv2.flip(frame, self.flip_code)
+        return frame
+
+    def capture_still(self):
+        return self.read()
+
+    def close(self):
+        self.capture.release()
+
+
+class LatestFrame():
+    '''Single slot holding the newest frame, a frame not taken in time is overwritten.'''
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.frame = None
+        self.frame_id = 0
+        self.taken_id = 0
+        self.timestamp = None
+        self.closed = False
+
+    def put(self, frame, timestamp, wait_taken=False):
+        """wait_taken=True blocks until the previous frame was taken, no frame is overwritten."""
+        with self.cond:
+            if wait_taken:
+                self.cond.wait_for(lambda: self.taken_id >= self.frame_id or self.closed)
+            self.frame = frame
+            self.frame_id += 1
+            self.timestamp = timestamp
+            self.cond.notify_all()
+
+    def get(self, last_id, timeout=None):
+        """Waits for a frame newer than last_id, returns (frame, frame_id, timestamp).
+
+        frame is None on timeout or once the slot is closed.
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.frame_id > last_id or self.closed, timeout):
+                return None, last_id, None
+            if self.frame_id <= last_id:
+                return None, last_id, None
+            self.taken_id = self.frame_id
+            self.cond.notify_all()
+            return self.frame, self.frame_id, self.timestamp
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class CaptureThread():
+    '''
+    Reads a frame source on its own thread into a LatestFrame slot, so the
+    sensor is drained at its own rate while detectors run. The processing side
+    always gets the newest frame; frames it had no time for are counted in
+    dropped.
+
+    Stills are taken on the capture thread as well (the source is only used
+    from one thread), request_still() queues one and returns immediately. A
+    still that fails is handed over as None, the video frames keep coming.
+
+    A source with lossless = True (a replay) is read no faster than the frames
+    are taken, and one with a frame_timestamp attribute gives its own capture
+    times.
+    '''
+    def __init__(self, source, tracer=None, name='capture'):
+        self.source = source
+        self.tracer = tracer
+        self.slot = LatestFrame()
+        self.lossless = getattr(source, 'lossless', False)
+        self.still_requests = queue.Queue()
+        self.running = False
+        self.error = None
+        self.dropped = 0
+        self.thread = threading.Thread(name=name, target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        return self
+
+    def _run(self):
+        try:
+            while self.running:
+                while not self.still_requests.empty():
+                    self._take_still(self.still_requests.get())
+                start = time.perf_counter()
+                frame = self.source.read()
+                timestamp = getattr(self.source, 'frame_timestamp', None)
+                if timestamp is None:
+                    timestamp = time.time()
+                self.slot.put(frame, timestamp, self.lossless)
+                if self.tracer != None:
+                    self.tracer.record('capture', start, time.perf_counter(), self.slot.frame_id)
+        except EOFError:
+            # a video or replay ran out of frames
+            pass
+        except Exception as e:
+            self.error = e
+            print('capture failed: %s'%e)
+        finally:
+            self.slot.close()
+
+    def _take_still(self, callback):
+        start = time.perf_counter()
+        try:
+            still = self.source.capture_still()
+        except Exception as e:
+            print('still capture failed: %s'%e)
+            still = None
+        if self.tracer != None:
+            self.tracer.record('capture_still', start, time.perf_counter(), self.slot.frame_id)
+        try:
+            callback(still)
+        except Exception as e:
+            print('still callback failed: %s'%e)
+
+    def read(self, last_id, timeout=1.0):
+        """Returns (frame, frame_id, capture timestamp) of the newest frame after last_id."""
+        frame, frame_id, timestamp = self.slot.get(last_id, timeout)
+        if frame is not None and last_id > 0:
+            self.dropped += frame_id - last_id - 1
+        return frame, frame_id, timestamp
+
+    def is_alive(self):
+        return self.thread.is_alive()
+
+    def request_still(self, callback):
+        """callback(still) is called on the capture thread once the still is taken, still is None if it failed."""
+        self.still_requests.put(callback)
+
+    def stop(self, timeout=2):
+        self.running = False
+        self.slot.close()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
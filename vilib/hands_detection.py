@@ -1,43 +1,96 @@
 #!/usr/bin/env python3
 import cv2
+import numpy as np
 import mediapipe as mp
-from ast import literal_eval
 
 mp_drawing = mp.solutions.drawing_utils
 # mp_drawing_styles = mp.solutions.drawing_styles
 mp_hands = mp.solutions.hands
 
+HAND_LANDMARKS_NUM = 21
+
 class DetectHands():
-    def __init__(self):
-        self.hands = mp_hands.Hands(max_num_hands = 1,
+    def __init__(self, max_num_hands=1, model_complexity=None, process_size=None):
+        """
+        model_complexity: 0 or 1, None keeps the mediapipe default
+        process_size: (width, height) the frame is scaled to before processing, None for full size
+        """
+        kwargs = {}
+        if model_complexity != None:
+            kwargs['model_complexity'] = model_complexity
+        self.hands = mp_hands.Hands(max_num_hands = max_num_hands,
                                     min_detection_confidence=0.5,
-                                    min_tracking_confidence=0.5)
-    
+                                    min_tracking_confidence=0.5,
+                                    **kwargs)
+        self.process_size = process_size
+        self.results = None
+        self._rgb = None
+        # joints buffer (hands x 21 x [x,y,z]), reused every frame
+        self.joints = np.zeros((max_num_hands, HAND_LANDMARKS_NUM, 3), dtype=np.float32)
+
     def work(self,image):
-        joints = []
+        joints = None
         if len(image) != 0:
-            # To improve performance, optionally mark the image as not writeable to
-            # pass by reference.
-            image.flags.writeable = False
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            results = self.hands.process(image)
-
-            # Draw the hand annotations on the image.
-            image.flags.writeable = True
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-            if results.multi_hand_landmarks:
-                for hand_landmarks in results.multi_hand_landmarks:
+            joints = self.detect(image)
+            # Draw the hand annotations on the original image,
+            # landmarks are normalized so the processing size does not matter
+            if joints is not None:
+                for hand_landmarks in self.results.multi_hand_landmarks:
                     mp_drawing.draw_landmarks(
                         image,
                         hand_landmarks,
                         mp_hands.HAND_CONNECTIONS,)
                         # mp_drawing_styles.get_default_hand_landmarks_style(),
                         # mp_drawing_styles.get_default_hand_connections_style())
-            joints = str(results.multi_hand_landmarks).replace('\n','').replace(' ','').replace('landmark',',').replace(',','',1)
-            joints = joints.replace('{x:','[').replace('y:',',').replace('z:',',').replace('}',']')
-            try:
-                joints = literal_eval(joints)
-            except Exception as e:
-                raise(e)
             return image,joints
 
+    def detect(self,image):
+        """Run the hands graph only, returns the joints array or None.
+
+        The array is a view of the joints buffer, the next detect() overwrites
+        it: copy it to keep the joints of a frame.
+        """
+        if self.process_size != None and (image.shape[1], image.shape[0]) != tuple(self.process_size):
+            image = cv2.resize(image, tuple(self.process_size), interpolation=cv2.INTER_AREA)
+        # the only color conversion, into a buffer reused between frames
+        if self._rgb is None or self._rgb.shape != image.shape:
+            self._rgb = np.empty_like(image)
+        cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=self._rgb)
+        self.results = self.hands.process(self._rgb)
+        if self.results.multi_hand_landmarks:
+            return self.landmarks_to_array(self.results.multi_hand_landmarks)
+        return None
+
+    def landmarks_to_array(self, multi_hand_landmarks):
+        """Copy the landmarks into the joints buffer, returns a (n, 21, 3) view."""
+        n = min(len(multi_hand_landmarks), len(self.joints))
+        for i in range(n):
+            hand = self.joints[i]
+            for j, lm in enumerate(multi_hand_landmarks[i].landmark):
+                hand[j, 0] = lm.x
+                hand[j, 1] = lm.y
+                hand[j, 2] = lm.z
+        return self.joints[:n]
+
+
+def joints_to_list(joints):
+    """Convert joints array to the old list form [[x,y,z], ...], None stays None."""
+    if joints is None:
+        return None
+    return joints.reshape(-1, 3).tolist()
+
+
+def draw_joints(image, joints, overlay=None):
+    """Draw a joints array (normalized coordinates) on a BGR image in place, or into overlay if given."""
+    if joints is None:
+        return image
+    height, width = image.shape[:2]
+    line = overlay.line if overlay != None else lambda *args: cv2.line(image, *args)
+    circle = overlay.circle if overlay != None else lambda *args: cv2.circle(image, *args)
+    for hand in joints:
+        points = (hand[:, :2] * (width, height)).astype(np.int32).tolist()
+        for start, end in mp_hands.HAND_CONNECTIONS:
+            line(tuple(points[start]), tuple(points[end]), (224,224,224), 2)
+        for point in points:
+            circle(tuple(point), 2, (0,0,255), 2)
+    return image
@@ -11,8 +11,16 @@ import numpy as np
 import cv2
 
 from PIL import Image
-from tflite_runtime.interpreter import Interpreter
 import threading
+from functools import lru_cache
+
+try:
+  from .model_registry import model_registry
+  from .inference_pool import inference_pool
+except ImportError:
+  # run as a script
+  from model_registry import model_registry
+  from inference_pool import inference_pool
 
 CAMERA_WIDTH = 640
 CAMERA_HEIGHT = 480
@@ -24,28 +32,28 @@ def load_labels(path):
   with open(path, 'r') as f:
     return {i: line.strip() for i, line in enumerate(f.readlines())}
 
-def set_input_tensor(interpreter, image):
-  tensor_index = interpreter.get_input_details()[0]['index']
-  input_tensor = interpreter.tensor(tensor_index)()[0]
-  input_tensor[:, :] = image
+@lru_cache(maxsize=None)
+def load_labels_cached(path):
+  """Loads a labels file once per path."""
+  return load_labels(path)
 
 
-def __classify_image(interpreter, image,labels_map):
+def __classify_image(model, image,labels_map):
   """Returns a sorted array of classification results."""
-  set_input_tensor(interpreter, image)
-  interpreter.invoke()
-  output_details = interpreter.get_output_details()[0]
-  output = np.squeeze(interpreter.get_tensor(output_details['index']))
-
+  model.set_image(image)
+  model.invoke()
   # If the model is quantized (uint8 data), then dequantize the results
-  if output_details['dtype'] == np.uint8:
-    scale, zero_point = output_details['quantization']
-    output = scale * (output - zero_point)
+  output = model.output(0, dequantize=True)
   
   # for i,out in enumerate(output):
   #   print(labels_map[i],round(out,3))
   # print('> ',end=' ')
 
+  return __top_result(output)
+
+
+def __top_result(output):
+  """Returns [(label_id, score)] of the highest score."""
   # Sort the results
   ordered = np.argpartition(-output, 1)
   # Return the person with the highest score
@@ -130,9 +138,8 @@ def main():
 
   # loading model and corresponding label
   labels = load_labels(args.labels)
-  interpreter = Interpreter(args.model)
-  interpreter.allocate_tensors()
-  _, input_height, input_width, _ = interpreter.get_input_details()[0]['shape']
+  model = model_registry.load('image_classification', args.model)
+  input_width, input_height = model.input_size
 
   imgshow_t = threading.Thread(target=imgshow_fuc,args=(input_height, input_width,labels))
   imgshow_t.start()
@@ -145,7 +152,7 @@ def main():
 
     if len(image) != 0:
       start_time = time.monotonic()
-      results = __classify_image(interpreter, image,labels)
+      results = __classify_image(model, image,labels)
       elapsed_ms = (time.monotonic() - start_time) * 1000
       label_id, prob = results[0]
       print(labels[label_id], prob)
@@ -158,7 +165,7 @@ def main():
     time.sleep(0.01)
 
 
-def classify_image(image, model=model_path,labels=labels_path):
+def classify_image(image, model=model_path,labels=labels_path,overlay=None,cache=None,params=None,timestamp=None):
   # loading model and corresponding label
   if not os.path.exists(model):
     print('incorrect model path ')
@@ -166,20 +173,26 @@ def classify_image(image, model=model_path,labels=labels_path):
   if not os.path.exists(labels):
     print('incorrect labels path ')
     return image
-  labels = load_labels(labels)
-  interpreter = Interpreter(model)
-  interpreter.allocate_tensors()
-  _, input_height, input_width, _ = interpreter.get_input_details()[0]['shape']  
+  labels = load_labels_cached(labels)
 
   if len(image) != 0:
-    # resize
-    img = cv2.resize(image,(input_width,input_height))
-    # classify
-    results = __classify_image(interpreter,img,labels)
+    # resize into the input tensor and classify, on the model's worker of inference_pool
+    # cache: a PerceptualCache, a similar image seen shortly before reuses its scores,
+    # aged by timestamp (the capture time of the frame) if given
+    run = lambda: inference_pool.run('image_classification', model, image, dequantize=True)[0]
+    output = cache.get(image, run, timestamp) if cache != None else run()
+    results = __top_result(output)
     label_id, prob = results[0]
     print(labels[label_id], prob)
-    # putText
-    cv2.putText(image,labels[label_id] + " " + str(round(prob,3)), (5,30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,255,255), 1, cv2.LINE_AA)
+    # params: a detect_obj_parameter, keeps the label and the score of the image
+    if params != None:
+      params['image_classify_t'] = labels[label_id]
+      params['image_classify_acc'] = float(prob)
+    # putText, into overlay (an Overlay) if given
+    if overlay != None:
+      overlay.putText(labels[label_id] + " " + str(round(prob,3)), (5,30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,255,255), 1, cv2.LINE_AA)
+    else:
+      cv2.putText(image,labels[label_id] + " " + str(round(prob,3)), (5,30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,255,255), 1, cv2.LINE_AA)
 
   return image
   
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+import time
+import queue
+import threading
+
+try:
+    from .model_registry import model_registry
+except ImportError:
+    # run as a script
+    from model_registry import model_registry
+
+# Runs the tflite models of every camera pipeline. Each model gets a worker
+# thread, the only thread that uses its interpreter, so pipelines running on
+# different threads share one loaded model. Requests that queue up while the
+# model is busy are taken together: one invoke over a batched input tensor if
+# the model accepts a resized batch dimension, otherwise back to back.
+
+
+class InferenceRequest():
+    __slots__ = ('path', 'scale', 'offset', 'image', 'outputs', 'dequantize', 'result', 'error', 'done')
+
+    def __init__(self, path, scale, offset, image, outputs, dequantize):
+        self.path = path
+        self.scale = scale
+        self.offset = offset
+        self.image = image
+        self.outputs = outputs
+        self.dequantize = dequantize
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def same_model(self, other):
+        return (self.path, self.scale, self.offset) == (other.path, other.scale, other.offset)
+
+
+class InferencePool():
+    '''
+    max_batch: most requests run in one invoke
+    max_wait: seconds a request waits for others to join its batch, 0 only
+        batches the requests that are already queued, adding no latency
+    '''
+    def __init__(self, registry=model_registry, max_batch=4, max_wait=0.0):
+        self.registry = registry
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.threads = {}
+        self.requests = {}  # name: requests served
+        self.batches = {}   # name: batches run
+
+    def configure(self, max_batch=None, max_wait=None):
+        if max_batch != None:
+            self.max_batch = max(1, int(max_batch))
+        if max_wait != None:
+            self.max_wait = max_wait
+
+    def run(self, name, path, image, outputs=(0,), dequantize=False, scale=None, offset=0.0, timeout=None):
+        """Runs the model name on image, returns the list of the output tensors asked for.
+
+        path, scale and offset are passed on to model_registry.load() by the worker.
+        """
+        request = InferenceRequest(path, scale, offset, image, outputs, dequantize)
+        self._queue(name).put(request)
+        if not request.done.wait(timeout):
+            raise TimeoutError('inference of %s timed out'%name)
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _queue(self, name):
+        q = self.queues.get(name)
+        if q is not None:
+            return q
+        with self.lock:
+            if name not in self.queues:
+                self.requests[name] = 0
+                self.batches[name] = 0
+                self.queues[name] = queue.Queue()
+                thread = threading.Thread(name='inference_%s'%name, target=self._worker, args=(name, self.queues[name]))
+                thread.daemon = True
+                thread.start()
+                self.threads[name] = thread
+            return self.queues[name]
+
+    def _worker(self, name, q):
+        pending = None
+        while True:
+            first = pending if pending is not None else q.get()
+            pending = None
+            batch = [first]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    remaining = deadline - time.perf_counter()
+                    request = q.get(timeout=remaining) if remaining > 0 else q.get_nowait()
+                except queue.Empty:
+                    break
+                if not request.same_model(first):
+                    # the model is being switched, the request starts the next batch
+                    pending = request
+                    break
+                batch.append(request)
+            self._run_batch(name, batch)
+
+    def _run_batch(self, name, batch):
+        first = batch[0]
+        try:
+            model = self.registry.load(name, first.path, first.scale, first.offset)
+            # a batch smaller than the allocated input leaves the last slots unused
+            if model.resize_batch(len(batch)) and model.batch_size > 1:
+                for i, request in enumerate(batch):
+                    model.set_image(request.image, i)
+                model.invoke()
+                for i, request in enumerate(batch):
+                    request.result = [model.output(index, request.dequantize, i) for index in request.outputs]
+                self.batches[name] += 1
+            else:
+                for request in batch:
+                    model.set_image(request.image)
+                    model.invoke()
+                    request.result = [model.output(index, request.dequantize) for index in request.outputs]
+                    self.batches[name] += 1
+        except Exception as e:
+            for request in batch:
+                if request.result is None:
+                    request.error = e
+        finally:
+            self.requests[name] += len(batch)
+            for request in batch:
+                request.done.set()
+
+    def queue_depths(self):
+        return {name: q.qsize() for name, q in list(self.queues.items())}
+
+    def batch_stats(self):
+        """Returns {name: (requests, batches)}."""
+        return {name: (self.requests[name], self.batches[name]) for name in list(self.queues)}
+
+
+inference_pool = InferencePool()
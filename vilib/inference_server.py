@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+import os
+import time
+import argparse
+import threading
+from multiprocessing.connection import Listener, Client, AuthenticationError
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # python 3.7, the server and its clients need 3.8 or newer
+    shared_memory = None
+
+import numpy as np
+
+try:
+    from .model_registry import model_registry, DEFAULT_MODELS
+    from .inference_pool import inference_pool
+except ImportError:
+    # run as a script
+    from model_registry import model_registry, DEFAULT_MODELS
+    from inference_pool import inference_pool
+
+# Inference daemon shared by several processes over a Unix domain socket, so
+# the models are loaded once per machine instead of once per process:
+#
+#   python3 -m vilib.inference_server
+#
+# Every client writes its frames into a shared memory segment of its own, the
+# socket only carries small messages:
+#   ('hello', client_name)                              -> ('ok', model names)
+#   ('segment', shm_name)                               -> ('ok',)
+#   ('infer', model, shm_name, shape, outputs, dequantize) -> ('ok', outputs, server seconds)
+#   ('stats',)                                          -> ('ok', {client: latency stats})
+# Requests of all clients go through inference_pool, requests of a model that
+# queue up while it is busy run as one batch.
+#
+# The messages are pickled, so only processes that know the key of the server
+# may connect: the server writes a random key to <socket>.key, readable by its
+# user and group like the socket itself. A connection only reads frames from
+# the segment it announced.
+
+DEFAULT_SOCKET = '/tmp/vilib_inference.sock'
+SOCKET_MODE = 0o660
+
+
+def _check_shared_memory():
+    if shared_memory is None:
+        raise RuntimeError('the inference server needs python 3.8 or newer')
+
+
+def key_path(socket_path):
+    return socket_path + '.key'
+
+
+def create_authkey(socket_path):
+    """Writes a new random key of the server at socket_path, returns it."""
+    authkey = os.urandom(32)
+    path = key_path(socket_path)
+    if os.path.exists(path):
+        os.unlink(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, SOCKET_MODE)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(authkey)
+    os.chmod(path, SOCKET_MODE)    # whatever the umask
+    return authkey
+
+
+def read_authkey(socket_path):
+    with open(key_path(socket_path), 'rb') as f:
+        return f.read()
+
+
+def _attach(name):
+    """Opens a segment created by another process without taking over its cleanup."""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        # before python 3.13 the resource tracker unlinks attached segments at exit
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    return shm
+
+
+class ClientStats():
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds):
+        self.requests += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def as_dict(self):
+        mean = self.total / self.requests if self.requests > 0 else 0.0
+        return {'requests': self.requests, 'errors': self.errors, 'mean_ms': round(mean * 1000, 2),
+                'max_ms': round(self.max * 1000, 2), 'last_ms': round(self.last * 1000, 2)}
+
+
+class InferenceServer():
+    def __init__(self, socket_path=DEFAULT_SOCKET, models=None, pool=inference_pool, authkey=None):
+        """authkey: key of the clients, None for a random one written to <socket_path>.key"""
+        _check_shared_memory()
+        self.socket_path = socket_path
+        self.authkey = authkey
+        self.models = dict(DEFAULT_MODELS if models is None else models)
+        self.pool = pool
+        self.listener = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.stats = {}     # client name: ClientStats
+
+    def preload(self):
+        """Loads every model that exists, so the first requests do not wait for it."""
+        for name, (path, scale, offset) in self.models.items():
+            if os.path.exists(path):
+                model_registry.load(name, path, scale, offset)
+            else:
+                print('%s: %s not found, skipped'%(name, path))
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        if self.authkey is None:
+            self.authkey = create_authkey(self.socket_path)
+        self.listener = Listener(self.socket_path, family='AF_UNIX', authkey=self.authkey)
+        os.chmod(self.socket_path, SOCKET_MODE)
+        self.running = True
+        print('vilib inference server on %s'%self.socket_path)
+        try:
+            while self.running:
+                try:
+                    conn = self.listener.accept()
+                except AuthenticationError:
+                    print('inference server: connection with a wrong key refused')
+                    continue
+                except (OSError, EOFError):
+                    if not self.running:
+                        break
+                    continue
+                thread = threading.Thread(name='inference_client', target=self._serve_client, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self.close()
+
+    def close(self):
+        self.running = False
+        if self.listener != None:
+            self.listener.close()
+            self.listener = None
+        for path in (self.socket_path, key_path(self.socket_path)):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def _serve_client(self, conn):
+        client = 'client_%d'%id(conn)
+        segments = {}
+        try:
+            while True:
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    break
+                kind = msg[0]
+                if kind == 'hello':
+                    client = msg[1]
+                    conn.send(('ok', sorted(self.models)))
+                elif kind == 'segment':
+                    conn.send(self._segment(segments, msg[1]))
+                elif kind == 'infer':
+                    conn.send(self._infer(client, segments, *msg[1:]))
+                elif kind == 'stats':
+                    conn.send(('ok', self.client_stats()))
+                else:
+                    conn.send(('error', 'unknown request %s'%kind))
+        finally:
+            for shm in segments.values():
+                shm.close()
+            conn.close()
+
+    def _segment(self, segments, shm_name):
+        # the client moved to a new segment
+        for old in segments.values():
+            old.close()
+        segments.clear()
+        try:
+            segments[shm_name] = _attach(shm_name)
+        except Exception as e:
+            return ('error', '%s: %s'%(type(e).__name__, e))
+        return ('ok',)
+
+    def _infer(self, client, segments, name, shm_name, shape, outputs, dequantize):
+        start = time.perf_counter()
+        with self.lock:
+            stats = self.stats.setdefault(client, ClientStats())
+        try:
+            path, scale, offset = self.models[name]
+            shm = segments.get(shm_name)
+            if shm is None:
+                raise ValueError('segment %s was not announced by this connection'%shm_name)
+            image = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+            result = self.pool.run(name, path, image, outputs, dequantize, scale, offset)
+            del image
+        except Exception as e:
+            stats.errors += 1
+            return ('error', '%s: %s'%(type(e).__name__, e))
+        seconds = time.perf_counter() - start
+        stats.add(seconds)
+        return ('ok', result, seconds)
+
+    def client_stats(self):
+        """Returns {client: {requests, errors, mean_ms, max_ms, last_ms}} of the time spent in the server."""
+        with self.lock:
+            return {client: stats.as_dict() for client, stats in self.stats.items()}
+
+
+class InferenceClient():
+    '''
+    Connection of one process to the inference server, usable from several threads.
+
+        client = InferenceClient('logger')
+        boxes, class_ids, scores, count = client.run('objects_detection', img, outputs=(0,1,2,3))
+    '''
+    def __init__(self, name=None, socket_path=DEFAULT_SOCKET, authkey=None):
+        """authkey: key of the server, None reads it from <socket_path>.key"""
+        _check_shared_memory()
+        self.name = name if name != None else 'pid_%d'%os.getpid()
+        if authkey is None:
+            authkey = read_authkey(socket_path)
+        self.conn = Client(socket_path, family='AF_UNIX', authkey=authkey)
+        self.lock = threading.Lock()
+        self.shm = None
+        self.stats = ClientStats()  # round trips seen by this client
+        with self.lock:
+            self.conn.send(('hello', self.name))
+            self.models = self._reply()[1]
+
+    def _reply(self):
+        reply = self.conn.recv()
+        if reply[0] == 'error':
+            raise RuntimeError(reply[1])
+        return reply
+
+    def _frame_memory(self, nbytes):
+        if self.shm is None or self.shm.size < nbytes:
+            if self.shm != None:
+                self.shm.close()
+                self.shm.unlink()
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self.conn.send(('segment', self.shm.name))
+            self._reply()
+        return self.shm
+
+    def run(self, name, image, outputs=(0,), dequantize=False):
+        """Runs the model name of the server on a uint8 image, returns the list of output tensors."""
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        with self.lock:
+            start = time.perf_counter()
+            shm = self._frame_memory(image.nbytes)
+            np.ndarray(image.shape, dtype=np.uint8, buffer=shm.buf)[...] = image
+            self.conn.send(('infer', name, shm.name, image.shape, tuple(outputs), dequantize))
+            try:
+                result = self._reply()[1]
+            except RuntimeError:
+                self.stats.errors += 1
+                raise
+            self.stats.add(time.perf_counter() - start)
+            return result
+
+    def detect_objects(self, image, labels=None, threshold=0.4, classes=None, max_detections=None, nms_iou=None):
+        """Returns (boxes, class_ids, scores) like objects_detection.detect(), classes needs labels if it holds names."""
+        from .objects_detection import filter_detections, class_ids_of
+        boxes, class_ids, scores, count = self.run('objects_detection', image, outputs=(0, 1, 2, 3))
+        count = int(count)
+        return filter_detections(boxes[:count], class_ids[:count], scores[:count], threshold,
+                                 class_ids_of(classes, labels), max_detections, nms_iou)
+
+    def classify(self, image):
+        """Returns (label_id, score) of the highest score."""
+        output, = self.run('image_classification', image, dequantize=True)
+        label_id = int(np.argmax(output))
+        return label_id, float(output[label_id])
+
+    def server_stats(self):
+        with self.lock:
+            self.conn.send(('stats',))
+            return self._reply()[1]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+            if self.shm != None:
+                self.shm.close()
+                self.shm.unlink()
+                self.shm = None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '--socket',
+        help='Path of the Unix domain socket.',
+        default=DEFAULT_SOCKET)
+    parser.add_argument(
+        '--model',
+        help='Extra model as name=path, may be repeated.',
+        action='append',
+        default=[])
+    parser.add_argument(
+        '--num_threads',
+        help='Threads of each tflite interpreter.',
+        type=int,
+        default=None)
+    parser.add_argument(
+        '--max_batch',
+        help='Most queued requests of a model run in one invoke.',
+        type=int,
+        default=4)
+    args = parser.parse_args()
+
+    models = dict(DEFAULT_MODELS)
+    for item in args.model:
+        name, path = item.split('=', 1)
+        models[name] = (path, None, 0.0)
+    for name in models:
+        model_registry.configure(name, num_threads=args.num_threads)
+    inference_pool.configure(max_batch=args.max_batch)
+
+    server = InferenceServer(args.socket, models)
+    server.preload()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    for client, stats in server.client_stats().items():
+        print(client, stats)
+
+
+if __name__ == '__main__':
+    main()
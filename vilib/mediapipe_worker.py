@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+import time
+import numpy as np
+from multiprocessing import Process, Pipe, RawArray
+
+from .hands_detection import HAND_LANDMARKS_NUM
+from .pose_detection import POSE_LANDMARKS_NUM
+
+# Runs DetectHands / DetectPose in a child process so the camera loop does not
+# wait for the mediapipe graph.
+# The frame and the landmarks are passed through shared memory, the pipe only
+# carries (frame_id, shape) and (frame_id, count) messages. There is at most one
+# frame in flight, so neither buffer is written while the other side reads it.
+#
+# The process starts with the first frame, its frame buffer sized for it. A
+# larger frame, or a process that died, starts a new one.
+
+RESTART_DELAY = 1.0     # seconds between the starts of a worker that keeps dying
+
+def _worker_loop(kind, kwargs, frame_buf, result_buf, result_shape, conn):
+    if kind == 'hands':
+        from .hands_detection import DetectHands
+        detector = DetectHands(**kwargs)
+    else:
+        from .pose_detection import DetectPose
+        detector = DetectPose(**kwargs)
+
+    frame_mem = np.frombuffer(frame_buf, dtype=np.uint8)
+    result_mem = np.frombuffer(result_buf, dtype=np.float32).reshape(result_shape)
+
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if msg is None:
+            break
+        frame_id, shape = msg
+        frame = frame_mem[:int(np.prod(shape))].reshape(shape)
+        joints = detector.detect(frame)
+        if joints is None:
+            count = 0
+        else:
+            result_mem.reshape(-1)[:joints.size] = joints.reshape(-1)
+            count = len(joints) if kind == 'hands' else 1
+        conn.send((frame_id, count))
+
+
+class MediapipeWorker():
+    def __init__(self, kind, **kwargs):
+        if kind == 'hands':
+            result_shape = (kwargs.get('max_num_hands', 1), HAND_LANDMARKS_NUM, 3)
+        elif kind == 'pose':
+            result_shape = (POSE_LANDMARKS_NUM, 4)
+        else:
+            raise ValueError("kind should be 'hands' or 'pose'")
+        self.kind = kind
+        self.kwargs = kwargs
+        self.result_shape = result_shape
+
+        self.process = None
+        self.conn = None
+        self.frame_mem = np.zeros(0, dtype=np.uint8)
+        self.died = None            # time.monotonic() the worker was found dead
+        self.restarts = 0
+
+        self.busy = False
+        self.frame_id = 0
+        self.pending_time = None
+        self.joints = None          # latest joints array or None
+        self.joints_time = None     # capture time of the frame the joints came from
+
+    def _start(self, frame_size):
+        self._stop()
+        self.frame_buf = RawArray('B', int(frame_size))
+        self.result_buf = RawArray('f', int(np.prod(self.result_shape)))
+        self.frame_mem = np.frombuffer(self.frame_buf, dtype=np.uint8)
+        self.result_mem = np.frombuffer(self.result_buf, dtype=np.float32).reshape(self.result_shape)
+
+        self.conn, child_conn = Pipe()
+        self.process = Process(name='%s_worker'%self.kind, target=_worker_loop,
+                            args=(self.kind, self.kwargs, self.frame_buf, self.result_buf, self.result_shape, child_conn))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.busy = False
+
+    def _stop(self):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+        self.process = None
+
+    def _check_alive(self):
+        """Reports a worker that died and drops its results, the next submit() starts a new one."""
+        if self.process is None or self.process.is_alive():
+            return
+        print('%s worker stopped (exit code %s), restarting it'%(self.kind, self.process.exitcode))
+        self.conn.close()
+        self.process = None
+        self.died = time.monotonic()
+        self.busy = False
+        self.joints = None
+        self.joints_time = None
+
+    def submit(self, image, timestamp=None):
+        """Send a frame to the worker, skipped (returns False) while the last one is in flight.
+
+        timestamp: capture time of the frame (time.time()), the age of the results counts from it
+        """
+        self._check_alive()
+        if self.busy:
+            return False
+        size = image.size
+        if self.process is None:
+            if self.died != None:
+                # a worker that keeps dying is not restarted every frame
+                if time.monotonic() - self.died < RESTART_DELAY:
+                    return False
+                self.died = None
+                self.restarts += 1
+            self._start(size)
+        elif size > len(self.frame_mem):
+            self._start(size)
+        np.copyto(self.frame_mem[:size].reshape(image.shape), image)
+        self.frame_id += 1
+        self.pending_time = time.time() if timestamp is None else timestamp
+        self.conn.send((self.frame_id, image.shape))
+        self.busy = True
+        return True
+
+    def poll(self):
+        """Collect the in-flight result if it is done, returns True when a new one arrived."""
+        self._check_alive()
+        if not self.busy or not self.conn.poll():
+            return False
+        try:
+            _, count = self.conn.recv()
+        except (EOFError, OSError):
+            # died before it answered
+            self.process.join(timeout=1)
+            self._check_alive()
+            return False
+        if count == 0:
+            self.joints = None
+        # a new array per result copied out of shared memory, the joints handed
+        # out before (e.g. stored in detect_obj_parameter) are never overwritten
+        elif self.kind == 'hands':
+            self.joints = self.result_mem[:count].copy()
+        else:
+            self.joints = self.result_mem.copy()
+        self.joints_time = self.pending_time
+        self.busy = False
+        return True
+
+    @property
+    def age(self):
+        """Seconds since the frame of the latest result was captured, None before the first result."""
+        if self.joints_time is None:
+            return None
+        return time.time() - self.joints_time
+
+    def close(self):
+        self._stop()
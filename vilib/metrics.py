@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+import time
+from bisect import bisect_left
+
+# Minimal Prometheus-style metrics, rendered in the plain text exposition format.
+# Updates are a few attribute operations without locks. They are made almost
+# only from the camera thread; an increment racing with another thread may get
+# lost, which is fine for monitoring numbers.
+
+# seconds, from 1 ms to 1 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 1.0)
+
+
+def _format_labels(labelnames, labelvalues):
+    pairs = list(zip(labelnames, labelvalues))
+    if len(pairs) == 0:
+        return ''
+    return '{' + ','.join('%s="%s"'%(k, str(v).replace('"', '\\"')) for k, v in pairs) + '}'
+
+
+class Counter():
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name + '_total' + labels, self.value
+
+
+class Gauge():
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self, name, labels):
+        yield name + labels, self.value
+
+
+class Histogram():
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        # labels is the rendered label set, the le label has to be merged into it
+        inner = labels[1:-1] + ',' if labels else ''
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield '%s_bucket{%sle="%s"}'%(name, inner, le), cumulative
+        yield name + '_sum' + labels, self.sum
+        yield name + '_count' + labels, self.count
+
+
+class MetricFamily():
+    def __init__(self, name, documentation, kind, labelnames=(), **kwargs):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.kwargs = kwargs
+        self.children = {}
+        if len(self.labelnames) == 0:
+            self._default = self.labels()
+
+    def labels(self, *labelvalues):
+        child = self.children.get(labelvalues)
+        if child is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError('%s expects labels %s'%(self.name, self.labelnames))
+            child = {'counter': Counter, 'gauge': Gauge, 'histogram': Histogram}[self.kind](**self.kwargs)
+            self.children[labelvalues] = child
+        return child
+
+    # shortcuts of metrics without labels
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def set(self, value):
+        self._default.set(value)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def render(self):
+        # the HELP and TYPE lines name the samples, counter samples end in _total
+        name = self.name + '_total' if self.kind == 'counter' else self.name
+        lines = ['# HELP %s %s'%(name, self.documentation), '# TYPE %s %s'%(name, self.kind)]
+        for labelvalues, child in list(self.children.items()):
+            labels = _format_labels(self.labelnames, labelvalues)
+            for sample, value in child.samples(self.name, labels):
+                lines.append('%s %s'%(sample, value))
+        return lines
+
+
+class MetricsRegistry():
+    def __init__(self):
+        self.families = {}
+        self.collectors = []
+
+    def _family(self, name, documentation, kind, labelnames, **kwargs):
+        family = self.families.get(name)
+        if family is None:
+            family = MetricFamily(name, documentation, kind, labelnames, **kwargs)
+            self.families[name] = family
+        return family
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._family(name, documentation, 'counter', labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._family(name, documentation, 'gauge', labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._family(name, documentation, 'histogram', labelnames, buckets=buckets)
+
+    def add_collector(self, collector):
+        """collector() is called on every scrape and returns lines in the exposition format."""
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for family in list(self.families.values()):
+            lines.extend(family.render())
+        for collector in self.collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                lines.append('# collector %s failed: %s'%(getattr(collector, '__name__', collector), e))
+        return '\n'.join(lines) + '\n'
+
+
+class FpsMeter():
+    '''Frames per second over a sliding window of frames.'''
+    def __init__(self, window=24):
+        self.window = window
+        self.frames = 0
+        self.start = time.perf_counter()
+        self.fps = 0.0
+
+    def tick(self):
+        self.frames += 1
+        if self.frames >= self.window:
+            now = time.perf_counter()
+            self.fps = self.frames / (now - self.start)
+            self.frames = 0
+            self.start = now
+        return self.fps
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+import time
+import threading
+
+try:
+    from .tflite_model import TfliteModel
+except ImportError:
+    # run as a script
+    from tflite_model import TfliteModel
+
+# shared library of the standalone XNNPACK delegate, recent tflite_runtime
+# builds also apply a built-in XNNPACK to float models without it
+XNNPACK_DELEGATE_LIB = 'libxnnpack_delegate.so'
+
+# name: (path, scale, offset) of the input normalization of the models vilib
+# ships, see ModelRegistry.load()
+DEFAULT_MODELS = {
+    'objects_detection': ('/opt/vilib/detect.tflite', None, 0.0),
+    'image_classification': ('/opt/vilib/mobilenet_v1_0.25_224_quant.tflite', None, 0.0),
+    'traffic_sign': ('/opt/vilib/tf_150_dr0.2.tflite', 2/255.0, -1.0),
+    'gesture': ('/opt/vilib/3bak_ges_200_dr0.2.tflite', 2/255.0, -1.0),
+}
+
+DEFAULT_OPTIONS = {
+    'num_threads': None,    # None keeps the tflite default
+    'delegate': None,       # None, 'xnnpack' or the path of a delegate library
+    'warmup': 1,            # invokes run at load time
+}
+
+
+def create_interpreter(path, num_threads=None, delegate=None):
+    """Creates and allocates an interpreter, returns (interpreter, name of the delegate in use)."""
+    from tflite_runtime.interpreter import Interpreter, load_delegate
+
+    delegates = []
+    if delegate != None:
+        library = XNNPACK_DELEGATE_LIB if delegate == 'xnnpack' else delegate
+        try:
+            delegates.append(load_delegate(library))
+        except (ValueError, OSError) as e:
+            print('delegate %s is not available, using the default kernels: %s'%(delegate, e))
+            delegate = None
+
+    kwargs = {}
+    if len(delegates) > 0:
+        kwargs['experimental_delegates'] = delegates
+    if num_threads != None:
+        kwargs['num_threads'] = num_threads
+    try:
+        interpreter = Interpreter(model_path=path, **kwargs)
+    except TypeError:
+        # tflite_runtime older than 2.3 has no num_threads
+        kwargs.pop('num_threads', None)
+        interpreter = Interpreter(model_path=path, **kwargs)
+    interpreter.allocate_tensors()
+    return interpreter, delegate
+
+
+class ModelRegistry():
+    '''
+    Owns every tflite interpreter of vilib, keyed by a model name.
+
+    Options (num_threads, delegate, warmup) are set per name with configure(),
+    or passed to load() directly. A loaded model whose num_threads or delegate
+    change is dropped, the next load() builds it again with the new options.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.models = {}
+        self.paths = {}
+        self.options = {}
+        self.load_times = {}
+        self.delegates = {}
+
+    def configure(self, name, **options):
+        """Sets the load options of a model, a loaded model is rebuilt with them on its next load()."""
+        with self.lock:
+            self._configure(name, options)
+
+    def _configure(self, name, options):
+        # called with the lock held
+        for key in options:
+            if key not in DEFAULT_OPTIONS:
+                raise ValueError('unknown model option: %s'%key)
+        current = self.options.setdefault(name, {})
+        # warmup only runs at load time, it is no reason to load again
+        changed = any(current.get(key, DEFAULT_OPTIONS[key]) != value
+                      for key, value in options.items() if key != 'warmup')
+        current.update(options)
+        if changed:
+            self.models.pop(name, None)
+            self.paths.pop(name, None)
+
+    def load(self, name, path, scale=None, offset=0.0, **options):
+        """Returns the model loaded under name, (re)loading it if it is missing, path or its options changed."""
+        if not options:
+            model = self.models.get(name)
+            # paths.get(), unload() may run meanwhile
+            if model != None and self.paths.get(name) == path:
+                return model
+        with self.lock:
+            if options:
+                self._configure(name, options)
+            if name in self.models and self.paths[name] == path:
+                return self.models[name]
+            opts = dict(DEFAULT_OPTIONS)
+            opts.update(self.options.get(name, {}))
+
+            start = time.perf_counter()
+            interpreter, delegate = create_interpreter(path, opts['num_threads'], opts['delegate'])
+            model = TfliteModel(interpreter, scale=scale, offset=offset)
+            self.load_times[name] = time.perf_counter() - start
+
+            # warm up, the first invokes are much slower than the following ones
+            for _ in range(opts['warmup']):
+                interpreter.invoke()
+
+            self.models[name] = model
+            self.paths[name] = path
+            self.delegates[name] = delegate
+            return model
+
+    def get(self, name):
+        return self.models.get(name)
+
+    def unload(self, name):
+        with self.lock:
+            self.models.pop(name, None)
+            self.paths.pop(name, None)
+
+    def stats(self):
+        """Returns {name: {path, load_ms, arena_bytes, invokes, mean_invoke_ms, num_threads, delegate}}."""
+        stats = {}
+        with self.lock:
+            loaded = [(name, model, self.paths[name]) for name, model in self.models.items()]
+        for name, model, path in loaded:
+            options = self.options.get(name, {})
+            stats[name] = {
+                'path': path,
+                'load_ms': round(self.load_times[name] * 1000, 1),
+                'arena_bytes': model.arena_bytes,
+                'invokes': model.invoke_count,
+                'mean_invoke_ms': round(model.mean_invoke_ms, 2),
+                'num_threads': options.get('num_threads'),
+                'delegate': self.delegates[name],
+            }
+        return stats
+
+    def report(self):
+        print('%-22s %9s %12s %8s %10s'%('model', 'load ms', 'arena bytes', 'invokes', 'invoke ms'))
+        for name, s in self.stats().items():
+            print('%-22s %9.1f %12d %8d %10.2f'%(name, s['load_ms'], s['arena_bytes'], s['invokes'], s['mean_invoke_ms']))
+
+
+model_registry = ModelRegistry()
@@ -11,8 +11,16 @@ import os
 import numpy as np
 import cv2
 from PIL import Image
-from tflite_runtime.interpreter import Interpreter
 import threading
+from functools import lru_cache
+
+try:
+  from .model_registry import model_registry
+  from .inference_pool import inference_pool
+except ImportError:
+  # run as a script
+  from model_registry import model_registry
+  from inference_pool import inference_pool
 
 CAMERA_WIDTH = 640
 CAMERA_HEIGHT = 480
@@ -34,82 +42,143 @@ def load_labels(path):
   return labels
 
 
-def set_input_tensor(interpreter, image):
-  """Sets the input tensor."""
-  tensor_index = interpreter.get_input_details()[0]['index']
-  input_tensor = interpreter.tensor(tensor_index)()[0]
-  input_tensor[:, :] = image
-
+@lru_cache(maxsize=None)
+def load_labels_cached(path):
+  """Loads a labels file once per path."""
+  return load_labels(path)
 
-def get_output_tensor(interpreter, index):
-  """Returns the output tensor at the given index."""
-  output_details = interpreter.get_output_details()[index]
-  tensor = np.squeeze(interpreter.get_tensor(output_details['index']))
-  return tensor
 
-
-def __detect_objects(interpreter, image, threshold):
-  """Returns a list of detection results, each a dictionary of object info."""
-  set_input_tensor(interpreter, image)
-  interpreter.invoke()
+def __detect_objects(model, image, threshold, classes=None, max_detections=None, nms_iou=None):
+  """Returns (boxes, class_ids, scores) arrays of the detections, ordered by score."""
+  model.set_image(image)
+  model.invoke()
 
   # Get all output details
-  boxes = get_output_tensor(interpreter, 0)
-  classes = get_output_tensor(interpreter, 1)
-  scores = get_output_tensor(interpreter, 2)
-  count = int(get_output_tensor(interpreter, 3))
-
-  results = []
-  for i in range(count):
-    if scores[i] >= threshold:
-      result = {
-          'bounding_box': boxes[i],
-          'class_id': classes[i],
-          'score': scores[i]
-      }
-      results.append(result)
-  return results
-
+  outputs = [model.output(i) for i in range(4)]
+  return __filter_outputs(outputs, threshold, classes, max_detections, nms_iou)
+
+
+def __filter_outputs(outputs, threshold, classes=None, max_detections=None, nms_iou=None):
+  """(boxes, class_ids, scores) of the four SSD output tensors."""
+  boxes, class_ids, scores, count = outputs
+  count = int(count)
+  return filter_detections(boxes[:count], class_ids[:count], scores[:count],
+                           threshold, classes, max_detections, nms_iou)
+
+
+def filter_detections(boxes, class_ids, scores, threshold=0.4, classes=None, max_detections=None, nms_iou=None):
+  """Filters the raw output tensors with numpy masks.
+
+  classes: allow-list of class ids, None keeps all classes
+  max_detections: keep at most this many of the highest scores
+  nms_iou: IoU threshold of the cross-class NMS, None to skip it
+  """
+  mask = scores >= threshold
+  if classes is not None:
+    mask &= np.isin(class_ids, classes)
+  boxes = boxes[mask]
+  class_ids = class_ids[mask].astype(np.int32)
+  scores = scores[mask]
+
+  order = np.argsort(-scores, kind='stable')
+  if nms_iou is not None:
+    order = order[nms(boxes[order], nms_iou)]
+  if max_detections is not None:
+    order = order[:max_detections]
+  return boxes[order], class_ids[order], scores[order]
+
+
+def nms(boxes, iou_threshold):
+  """Greedy non-maximum suppression over boxes sorted by score, returns the kept indices."""
+  ymin, xmin, ymax, xmax = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+  areas = (ymax - ymin) * (xmax - xmin)
+  order = np.arange(len(boxes))
+  keep = []
+  while order.size > 0:
+    i = order[0]
+    keep.append(i)
+    rest = order[1:]
+    h = np.clip(np.minimum(ymax[i], ymax[rest]) - np.maximum(ymin[i], ymin[rest]), 0, None)
+    w = np.clip(np.minimum(xmax[i], xmax[rest]) - np.maximum(xmin[i], xmin[rest]), 0, None)
+    inter = h * w
+    iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+    order = rest[iou <= iou_threshold]
+  return np.array(keep, dtype=np.int64)
+
+
+def class_ids_of(classes, labels_map):
+  """Maps an allow-list of label names and/or class ids to an array of class ids.
+
+  Raises ValueError for a name or id not in labels_map. An array of class ids,
+  as returned here, is passed through, resolve a filter once and reuse it.
+  """
+  if classes is None or isinstance(classes, np.ndarray):
+    return classes
+  if isinstance(classes, (str, int)):
+    classes = [classes]
+  labels_map = labels_map or {}
+  ids = {name: i for i, name in labels_map.items()} if any(isinstance(c, str) for c in classes) else {}
+  class_ids = []
+  for c in classes:
+    if isinstance(c, str):
+      if c not in ids:
+        raise ValueError('unknown label %r'%c)
+      class_ids.append(ids[c])
+    else:
+      if labels_map and int(c) not in labels_map:
+        raise ValueError('unknown class id %r'%c)
+      class_ids.append(int(c))
+  return np.array(class_ids, dtype=np.int32)
+
+
+EMPTY_RESULTS = (np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
 
 colors = [(0,255,255),(255,0,0),(0,255,64),(255,255,0),
         (255,128,64),(128,128,255),(255,128,255),(255,128,128)]
 
-def put_text(img,results,labels_map,width=CAMERA_WIDTH,height=CAMERA_HEIGHT):
-    for i,obj in enumerate(results):
-        # Convert the bounding box figures from relative coordinates
-        # to absolute coordinates based on the original resolution
-        ymin, xmin, ymax, xmax = obj['bounding_box']
-        xmin = int(xmin * width)
-        xmax = int(xmax * width)
-        ymin = int(ymin * height)
-        ymax = int(ymax * height)
-
-        cv2.rectangle(img,(xmin, ymin), (xmax, ymax),colors[i%7],2)
-        cv2.putText(img, '%s %.2f' % (labels_map[obj['class_id']], obj['score']), (xmin+6, ymin+24),cv2.FONT_HERSHEY_PLAIN,1, colors[i%7], 1) #FONT_HERSHEY_DUPLEX
-    #     print('%s %.2f' % (labels_map[obj['class_id']], obj['score']))
-    # print('\n')
+def put_text(img,results,labels_map,width=CAMERA_WIDTH,height=CAMERA_HEIGHT,overlay=None):
+    """Draws the boxes and labels on img, or adds them to overlay (an Overlay) if given."""
+    boxes, class_ids, scores = results
+    # Convert the bounding box figures from relative coordinates
+    # to absolute coordinates based on the original resolution
+    coords = (boxes * (height, width, height, width)).astype(np.int32).tolist()
+    for i, (ymin, xmin, ymax, xmax) in enumerate(coords):
+        if overlay != None:
+            overlay.rectangle((xmin, ymin), (xmax, ymax),colors[i%7],2)
+            overlay.putText('%s %.2f' % (labels_map[int(class_ids[i])], scores[i]), (xmin+6, ymin+24),cv2.FONT_HERSHEY_PLAIN,1, colors[i%7], 1)
+        else:
+            cv2.rectangle(img,(xmin, ymin), (xmax, ymax),colors[i%7],2)
+            cv2.putText(img, '%s %.2f' % (labels_map[int(class_ids[i])], scores[i]), (xmin+6, ymin+24),cv2.FONT_HERSHEY_PLAIN,1, colors[i%7], 1) #FONT_HERSHEY_DUPLEX
 
     return img
 
 # For static images:
-def detect_objects(image,model=model_path,labels=labels_path,width=CAMERA_WIDTH,height=CAMERA_HEIGHT,threshold=0.4):
+def detect(image,model=model_path,labels=labels_path,threshold=0.4,classes=None,max_detections=None,nms_iou=None):
+  """Returns ((boxes, class_ids, scores), labels_map), boxes are relative [ymin, xmin, ymax, xmax].
+
+  classes may be label names, class ids or an array of class_ids_of().
+  """
   # loading model and corresponding label
   if not os.path.exists(model):
     print('incorrect model path ')
-    return image
+    return EMPTY_RESULTS, {}
   if not os.path.exists(labels):
     print('incorrect labels path ')
-    return image
-  labels = load_labels(labels)
-  interpreter = Interpreter(model)
-  interpreter.allocate_tensors()
-  _, input_height, input_width, _ = interpreter.get_input_details()[0]['shape']  
-
-  if len(image) != 0:
-    # resize
-    img = cv2.resize(image,(input_width,input_height))
-    # classify
-    results = __detect_objects(interpreter,img,threshold)
+    return EMPTY_RESULTS, {}
+  labels = load_labels_cached(labels)
+
+  if len(image) == 0:
+    return EMPTY_RESULTS, labels
+  # resize into the input tensor and detect, on the model's worker of inference_pool
+  outputs = inference_pool.run('objects_detection', model, image, outputs=(0, 1, 2, 3))
+  results = __filter_outputs(outputs,threshold,class_ids_of(classes, labels),max_detections,nms_iou)
+  return results, labels
+
+
+def detect_objects(image,model=model_path,labels=labels_path,width=CAMERA_WIDTH,height=CAMERA_HEIGHT,threshold=0.4,
+                   classes=None,max_detections=None,nms_iou=None):
+  results, labels = detect(image,model,labels,threshold,classes,max_detections,nms_iou)
+  if len(results[0]) > 0:
     # putText
     image = put_text(image,results,labels,width,height)
     
@@ -117,7 +186,7 @@ def detect_objects(image,model=model_path,labels=labels_path,width=CAMERA_WIDTH,
 
 
 # For webcam:
-results = []
+results = EMPTY_RESULTS
 image = []
 elapsed_ms = 0
 run_flag = False
@@ -193,9 +262,8 @@ def main():
 
   # loading model and corresponding label
   labels = load_labels(args.labels)
-  interpreter = Interpreter(args.model)
-  interpreter.allocate_tensors()
-  _, input_height, input_width, _ = interpreter.get_input_details()[0]['shape']
+  model = model_registry.load('objects_detection', args.model)
+  input_width, input_height = model.input_size
 
   imgshow_t = threading.Thread(target=imgshow_fuc,args=(input_height, input_width,labels))
   imgshow_t.start()
@@ -208,7 +276,7 @@ def main():
 
     if len(image) != 0:
       start_time = time.monotonic()
-      results = __detect_objects(interpreter, image,args.threshold)
+      results = __detect_objects(model, image,args.threshold)
       elapsed_ms = (time.monotonic() - start_time) * 1000
       # print(results)
 
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import os
+import time
+import threading
+
+import cv2
+
+from .tracing import tracer
+
+# The outputs of a camera pipeline. The camera loop publishes every processed
+# frame together with its Overlay; the consumers (web stream, photos, video
+# recording, local display) ask for the output they need:
+#
+#   raw         the frame as the detectors analysed it
+#   annotated   the frame with the overlay drawn on a copy of it
+#
+# The annotated frame is only rendered when somebody asks for it, once per
+# frame however many consumers ask. The same holds for the encoded outputs:
+# encoded() keeps the jpg / png bytes of the current frame per output, format
+# and quality, shared by the web stream, snapshots and photos, together with
+# an ETag that changes with every published frame.
+
+
+class FrameOutputs():
+    def __init__(self, img, renders=None, encodes=None, encode_hits=None):
+        """
+        img: frame served before the first one is published
+        renders: counter incremented with every annotated frame rendered, or None
+        encodes, encode_hits: counters labelled by format of the frames encoded
+            and of the encoded frames served from the cache, or None
+        """
+        self.lock = threading.Lock()
+        self.encode_locks = {}  # (format, raw, quality): lock of the requests encoding that output
+        self.renders = renders
+        self.encodes = encodes
+        self.encode_hits = encode_hits
+        self.frame_id = 0
+        self.img = img
+        self.overlay = None
+        self._annotated = img
+        # version counts the published frames, epoch tells apart the processes and instances
+        self.version = 0
+        self.epoch = '%x%x'%(os.getpid(), int(time.time() * 1000) & 0xffffff)
+        self._encoded = {}      # (format, raw, quality): bytes of the current version
+
+    def publish(self, frame_id, img, overlay=None):
+        with self.lock:
+            self.frame_id = frame_id
+            self.img = img
+            self.overlay = overlay
+            self._annotated = None
+            self.version += 1
+            self._encoded = {}
+
+    def raw(self):
+        return self.img
+
+    def annotated(self):
+        with self.lock:
+            return self._render()
+
+    def _render(self):
+        # called with the lock held
+        if self._annotated is None:
+            if self.overlay is None or len(self.overlay) == 0:
+                self._annotated = self.img
+            else:
+                self._annotated = self.overlay.render(self.img.copy())
+                if self.renders != None:
+                    self.renders.inc()
+        return self._annotated
+
+    def get(self, raw=False):
+        return self.raw() if raw else self.annotated()
+
+    def etag(self, ext='.jpg', raw=False, quality=None, version=None):
+        version = self.version if version is None else version
+        return '"%s-%d-%s%s%s"'%(self.epoch, version, ext.lstrip('.'), '-raw' if raw else '',
+                                 '' if quality is None else '-q%d'%quality)
+
+    def encoded(self, ext='.jpg', raw=False, quality=None):
+        """Returns (bytes, etag) of the current frame encoded as ext ('.jpg' or '.png').
+
+        quality: jpg quality 0-100 or png compression 0-9, None for the OpenCV default
+        """
+        key = (ext, raw, quality)
+        fmt = ext.lstrip('.')
+        with self.lock:
+            encode_lock = self.encode_locks.get(key)
+            if encode_lock is None:
+                encode_lock = self.encode_locks[key] = threading.Lock()
+        # requests of the same output wait for the first one to encode it,
+        # the other outputs are encoded meanwhile
+        with encode_lock:
+            with self.lock:
+                version, frame_id, cache = self.version, self.frame_id, self._encoded
+                data = cache.get(key)
+                if data is None:
+                    img = self.img if raw else self._render()
+            if data is not None:
+                if self.encode_hits != None:
+                    self.encode_hits.labels(fmt).inc()
+                return data, self.etag(ext, raw, quality, version)
+            params = []
+            if quality != None:
+                params = [cv2.IMWRITE_JPEG_QUALITY if ext == '.jpg' else cv2.IMWRITE_PNG_COMPRESSION, int(quality)]
+            with tracer.span('encode_%s'%fmt, frame_id):
+                data = cv2.imencode(ext, img, params)[1].tobytes()
+            if self.encodes != None:
+                self.encodes.labels(fmt).inc()
+            # kept for the frame it was encoded from, unless a newer one came meanwhile
+            with self.lock:
+                if self.version == version:
+                    cache[key] = data
+            return data, self.etag(ext, raw, quality, version)
+
+
+class ImageArray():
+    '''
+    img_array of the API before FrameOutputs: [0] is the annotated frame,
+    rendered on access, [1] the qrcode picture.
+    '''
+    def __init__(self, outputs, img):
+        self.outputs = outputs
+        self.items = [img, img]
+
+    def __getitem__(self, index):
+        if index == 0:
+            return self.outputs.annotated()
+        return self.items[index]
+
+    def __setitem__(self, index, img):
+        if index == 0:
+            self.outputs.publish(self.outputs.frame_id, img)
+        else:
+            self.items[index] = img
+
+    def __len__(self):
+        return len(self.items)
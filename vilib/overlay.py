@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+# Annotations of a frame, kept apart from its pixels. The detectors add their
+# boxes and labels to the Overlay of the frame instead of drawing into it, so
+# every detector analyses the camera image as captured. The camera loop draws
+# the overlay once, onto the frame it publishes.
+#
+#   overlay = Overlay()
+#   overlay.rectangle((x, y), (x+w, y+h), (0,255,0), 2)
+#   overlay.putText('red', (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,0,255), 2)
+#   img = overlay.render(img)
+#
+# The methods take the arguments of the cv2 function of the same name, less the image.
+# text() draws a cached TextSprite instead of putText: the glyphs of a string are
+# rasterized once per text, scale, color and thickness, every frame only blends
+# the sprite into the image.
+
+
+class TextSprite():
+    '''Anti-aliased text rasterized once, alpha-blended into the frames.'''
+    def __init__(self, text, scale=1.0, color=(255,255,255), thickness=2, font=cv2.FONT_HERSHEY_SIMPLEX):
+        (width, height), baseline = cv2.getTextSize(text, font, scale, thickness)
+        pad = thickness
+        mask = np.zeros((height + baseline + 2*pad, width + 2*pad), np.uint8)
+        cv2.putText(mask, text, (pad, height + pad), font, scale, 255, thickness, cv2.LINE_AA)
+        # crop to the pixels the text covers
+        rows, cols = np.nonzero(mask.any(axis=1))[0], np.nonzero(mask.any(axis=0))[0]
+        if len(rows) == 0:
+            mask = mask[:0, :0]
+            rows = cols = np.zeros(1, np.int64)
+        else:
+            mask = mask[rows[0]:rows[-1]+1, cols[0]:cols[-1]+1]
+        # top left corner relative to the putText origin (left end of the baseline)
+        self.offset = (int(cols[0]) - pad, int(rows[0]) - height - pad)
+        # blended as img * (255 - alpha) / 255 + color * alpha / 255, both terms precomputed as uint8
+        self.inverse = np.repeat((255 - mask)[..., None], 3, axis=2)
+        self.colored = (mask.astype(np.uint16)[..., None] * np.array(color[:3], np.uint16) // 255).astype(np.uint8)
+        self.shape = mask.shape
+
+    def draw(self, img, org):
+        """Blends the sprite into the BGR img in place, org as in cv2.putText."""
+        x, y = int(org[0]) + self.offset[0], int(org[1]) + self.offset[1]
+        height, width = self.shape
+        # clip to the image
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, img.shape[1]), min(y + height, img.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return img
+        roi = img[y0:y1, x0:x1]
+        sx, sy = x0 - x, y0 - y
+        inverse = self.inverse[sy:sy + y1 - y0, sx:sx + x1 - x0]
+        colored = self.colored[sy:sy + y1 - y0, sx:sx + x1 - x0]
+        cv2.add(cv2.multiply(roi, inverse, scale=1/255.0), colored, dst=roi)
+        return img
+
+
+@lru_cache(maxsize=256)
+def text_sprite(text, scale=1.0, color=(255,255,255), thickness=2, font=cv2.FONT_HERSHEY_SIMPLEX):
+    """TextSprite of text, the same arguments return the same sprite."""
+    return TextSprite(text, scale, color, thickness, font)
+
+
+def _draw_sprite(img, sprite, org):
+    return sprite.draw(img, org)
+
+
+class Overlay():
+    __slots__ = ('items',)
+
+    def __init__(self):
+        self.items = []     # (cv2 drawing function, arguments)
+
+    def rectangle(self, *args, **kwargs):
+        self.items.append((cv2.rectangle, args, kwargs))
+
+    def putText(self, *args, **kwargs):
+        self.items.append((cv2.putText, args, kwargs))
+
+    def circle(self, *args, **kwargs):
+        self.items.append((cv2.circle, args, kwargs))
+
+    def line(self, *args, **kwargs):
+        self.items.append((cv2.line, args, kwargs))
+
+    def text(self, text, org, scale=1.0, color=(255,255,255), thickness=2, font=cv2.FONT_HERSHEY_SIMPLEX):
+        """Like putText, with the cached sprite of the text."""
+        sprite = text_sprite(str(text), float(scale), tuple(int(c) for c in color), int(thickness), font)
+        self.items.append((_draw_sprite, (sprite, org), {}))
+
+    def clear(self):
+        del self.items[:]
+
+    def __len__(self):
+        return len(self.items)
+
+    def render(self, img):
+        """Draws the annotations into img, returns img."""
+        for draw, args, kwargs in self.items:
+            draw(img, *args, **kwargs)
+        return img
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# Classifier results keyed by a perceptual hash of the input image. A steady
+# camera shows the classifiers the same content frame after frame; images whose
+# hashes differ in at most max_distance bits get the cached scores instead of
+# another interpreter run.
+#
+#   cache = PerceptualCache(max_distance=4, ttl=2.0)
+#   scores = cache.get(crop, lambda: classify(crop), timestamp)
+#
+# The camera pipelines age the entries by the capture timestamps of the frames,
+# so a replay of a recording reuses the same results as the original run.
+
+_BIT_WEIGHTS = (1 << np.arange(64, dtype=np.uint64)).astype(np.uint64)
+
+
+def dhash(image):
+    """64 bit difference hash of a BGR or gray image: brightness gradients of a 9x8 thumbnail."""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).reshape(-1)
+    return int(np.dot(bits.astype(np.uint64), _BIT_WEIGHTS))
+
+
+class PerceptualCache():
+    '''
+    LRU cache of max_entries results. An image hits an entry whose hash is at
+    most max_distance bits (Hamming distance) away from its own and that is
+    younger than ttl seconds; max_distance=0 only reuses identical hashes.
+    The age is measured on the clock of the now passed in, time.monotonic()
+    if none is.
+    '''
+    def __init__(self, max_entries=64, max_distance=4, ttl=2.0):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.entries = OrderedDict()    # hash: (value, time)
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key, now=None):
+        """Returns (hash of the matching entry, value) or None."""
+        now = time.monotonic() if now is None else now
+        entry = self.entries.get(key)
+        # entries stored at a later time (an earlier replay or live run) are not reused
+        if entry is not None and 0 <= now - entry[1] <= self.ttl:
+            return key, entry[0]
+        if self.max_distance > 0:
+            for other, (value, stored) in self.entries.items():
+                if 0 <= now - stored <= self.ttl and bin(other ^ key).count('1') <= self.max_distance:
+                    return other, value
+        return None
+
+    def get(self, image, compute, now=None):
+        """Returns the cached value of image, or compute() stored under its hash.
+
+        now: time of the image in seconds, e.g. the capture timestamp of the frame
+        """
+        key = dhash(image)
+        now = time.monotonic() if now is None else now
+        found = self.lookup(key, now)
+        if found is not None:
+            self.entries.move_to_end(found[0])
+            self.hits += 1
+            return found[1]
+        self.misses += 1
+        value = compute()
+        self.entries[key] = (value, now)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.entries.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hit_rate, 3),
+                'entries': len(self.entries)}
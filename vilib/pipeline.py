@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import threading
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
+
+from .tracing import tracer
+
+# Declarative configuration of the camera loop: which detector stages it may
+# run, in which order and how often, plus the capture resolution and rate.
+#
+#   resolution: [640, 480]
+#   framerate: 24
+#   stages:
+#     - name: color_detect_func
+#     - name: object_detect_fuc
+#       every: 3            # every 3rd frame
+#     - name: traffic_detect
+#       enabled: false      # never runs, whatever its switch says
+#
+# A stage runs while its switch (its flag in detect_obj_parameter) is on.
+# StagePlan compiles the configuration into the list of the stages that are
+# switched on and only rebuilds it when a switch changes.
+#
+# Next to the built-in detectors, which take the frame and return it, a
+# pipeline can run PluginStages of user code, see Vilib.stage_register():
+#
+#   def red_pixels(frame, context):
+#       return int((frame[..., 2] > 200).sum())
+#
+#   Vilib.stage_register('red_pixels', red_pixels, parallel=True)
+#   Vilib.detect_obj_parameter['red_pixels_result']
+#
+# A plugin gets a read-only view of the camera frame (never a copy) and a
+# StageContext, and returns its result; it annotates through context.overlay.
+# Plugins marked parallel that follow each other in the configuration run at
+# the same time on worker threads.
+
+
+def load_config(config, known_stages):
+    """Returns the normalized configuration of a dict, a .yaml / .yml or a .json file.
+
+    known_stages: ((stage name, switch flag), ...) in the default order
+    """
+    if isinstance(config, str):
+        with open(config) as f:
+            if config.endswith(('.yaml', '.yml')):
+                import yaml     # PyYAML, only needed for yaml files
+                config = yaml.safe_load(f)
+            else:
+                config = json.load(f)
+    flags = dict(known_stages)
+    stages = config.get('stages')
+    if stages is None:
+        stages = [{'name': name} for name, _ in known_stages]
+    normalized = []
+    for stage in stages:
+        if isinstance(stage, str):
+            stage = {'name': stage}
+        name = stage['name']
+        if name not in flags:
+            raise ValueError('unknown pipeline stage: %s'%name)
+        every = int(stage.get('every', 1))
+        if every < 1:
+            raise ValueError('every of %s should be 1 or more'%name)
+        if stage.get('enabled', True):
+            normalized.append({'name': name, 'flag': stage.get('flag', flags[name]), 'every': every})
+    return {
+        'resolution': tuple(config.get('resolution', (640, 480))),
+        'framerate': config.get('framerate', 24),
+        'stages': normalized,
+    }
+
+
+class StageContext():
+    '''
+    What a plugin stage gets to know of the frame next to its pixels.
+
+    camera: name of the Vilib pipeline
+    frame_id, timestamp: id and capture time of the frame
+    params: detect_obj_parameter of the pipeline, the results of the built-in detectors
+    results: {stage name: result} of the plugin stages that already ran on this frame
+    overlay: Overlay of the frame, for annotations of the stage
+    '''
+    __slots__ = ('camera', 'frame_id', 'timestamp', 'params', 'results', 'overlay')
+
+    def __init__(self, camera, frame_id, timestamp, params, overlay=None):
+        self.camera = camera
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.params = params
+        self.results = {}
+        self.overlay = overlay
+
+
+class PluginStage():
+    '''
+    Stage of user code, function(frame, context) returns its result.
+
+    The result is kept as params['<name>_result'] and context.results[name],
+    it is None while the stage is switched off or when the function raised.
+    '''
+    def __init__(self, name, function, flag=None, parallel=False):
+        self.name = name
+        self.function = function
+        self.flag = flag if flag != None else '%s_flag'%name
+        self.result_key = '%s_result'%name
+        self.parallel = parallel
+
+    def run(self, frame, context):
+        """Returns (result, start, end), the times are time.perf_counter() values."""
+        start = time.perf_counter()
+        try:
+            result = self.function(frame, context)
+        except Exception as e:
+            print('stage %s failed: %s: %s'%(self.name, type(e).__name__, e))
+            result = None
+        end = time.perf_counter()
+        tracer.record(self.name, start, end, context.frame_id)
+        return result, start, end
+
+
+def read_only(img):
+    """A view of img that cannot be written to, the pixels are not copied."""
+    view = img.view()
+    view.flags.writeable = False
+    return view
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def stage_executor():
+    """Worker threads of the parallel plugin stages, shared by all the pipelines."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix='vilib_stage')
+        return _executor
+
+
+class StagePlan():
+    '''
+    Flat list of the stages to run, compiled from a normalized configuration.
+
+    update() costs one itemgetter call over the switch flags per frame; only
+    when a switch changed is the list rebuilt, and the stages switched off
+    since the last build are called once more so they reset their results.
+    '''
+    def __init__(self, config, functions, histograms):
+        """
+        functions: {stage name: function(img) -> img or PluginStage}
+        histograms: {stage name: latency histogram}
+        """
+        self.config = config
+        self.stages = [(s['name'], s['flag'], functions[s['name']], histograms[s['name']], s['every'])
+                       for s in config['stages']]
+        flags = [flag for _, flag, _, _, _ in self.stages]
+        getter = itemgetter(*flags) if flags else (lambda params: ())
+        # itemgetter of a single key returns the bare value
+        self.switches = getter if len(flags) != 1 else (lambda params: (getter(params),))
+        self.state = None
+        self.active = []
+
+    def update(self, params, img):
+        """Returns [(name, function, histogram, every)] of the stages switched on in params."""
+        state = self.switches(params)
+        if state == self.state:
+            return self.active
+        previous = self.state
+        self.state = state
+        self.active = []
+        for i, (name, flag, function, histogram, every) in enumerate(self.stages):
+            if state[i] == True:
+                self.active.append((name, function, histogram, every))
+            elif previous is None or previous[i] == True:
+                if isinstance(function, PluginStage):
+                    params[function.result_key] = None
+                else:
+                    # switched off: the stage resets its results when called with its flag off
+                    function(img)
+        return self.active
+
+    def run(self, img, context, count):
+        """Runs the active stages due at the count-th frame, returns img as the built-in stages left it."""
+        view = None
+        pending = []    # parallel plugins in flight
+        for name, function, histogram, every in self.update(context.params, img):
+            if every > 1 and count % every != 0:
+                continue
+            if isinstance(function, PluginStage):
+                if view is None:
+                    view = read_only(img)
+                if function.parallel:
+                    pending.append((function, histogram, stage_executor().submit(function.run, view, context)))
+                    continue
+            # the next stage may depend on the results of the parallel ones, or write to img
+            self._collect(pending, context)
+            if isinstance(function, PluginStage):
+                result, start, end = function.run(view, context)
+                self._store(function, result, context)
+            else:
+                start = time.perf_counter()
+                img = function(img)
+                end = time.perf_counter()
+                tracer.record(name, start, end, context.frame_id)
+                view = None
+            histogram.observe(end - start)
+        self._collect(pending, context)
+        return img
+
+    def _collect(self, pending, context):
+        for function, histogram, future in pending:
+            result, start, end = future.result()
+            histogram.observe(end - start)
+            self._store(function, result, context)
+        del pending[:]
+
+    def _store(self, function, result, context):
+        context.results[function.name] = result
+        context.params[function.result_key] = result
@@ -1,39 +1,94 @@
 #!/usr/bin/env python3
 import cv2
+import numpy as np
 import mediapipe as mp
-from ast import literal_eval
 
 mp_drawing = mp.solutions.drawing_utils
 # mp_drawing_styles = mp.solutions.drawing_styles
 mp_pose = mp.solutions.pose
 
+POSE_LANDMARKS_NUM = 33
+
 class DetectPose():
-    def __init__(self):
+    def __init__(self, model_complexity=None, process_size=None):
+        """
+        model_complexity: 0, 1 or 2, None keeps the mediapipe default
+        process_size: (width, height) the frame is scaled to before processing, None for full size
+        """
+        kwargs = {}
+        if model_complexity != None:
+            kwargs['model_complexity'] = model_complexity
         self.pose = mp_pose.Pose(min_detection_confidence=0.5,
-                                min_tracking_confidence=0.5)
-            
+                                min_tracking_confidence=0.5,
+                                **kwargs)
+        self.process_size = process_size
+        self.results = None
+        self._rgb = None
+        # joints buffer (33 x [x,y,z,visibility]), reused every frame
+        self.joints = np.zeros((POSE_LANDMARKS_NUM, 4), dtype=np.float32)
+
     def work(self,image):
-        joints = []
+        joints = None
         if len(image) != 0:
-            # To improve performance, optionally mark the image as not writeable to
-            # pass by reference.
-            image.flags.writeable = False
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            results = self.pose.process(image)
-            
-            # Draw the pose annotation on the image.
-            image.flags.writeable = True
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-            mp_drawing.draw_landmarks(
-                image,
-                results.pose_landmarks,
-                mp_pose.POSE_CONNECTIONS,)
-                # landmark_drawing_spec=mp_drawing_styles.get_default_pose_landmarks_style())
-        
-            joints = str(results.pose_landmarks).replace('\n','').replace(' ','').replace('landmark',',').replace(',','',1)
-            joints = '['+joints.replace('{x:','[').replace('y:',',').replace('z:',',').replace('visibilit','').replace('}',']')+']'
-            try:
-                joints = literal_eval(joints)
-            except Exception as e:
-                raise(e)           
+            joints = self.detect(image)
+            # Draw the pose annotation on the original image,
+            # landmarks are normalized so the processing size does not matter
+            if joints is not None:
+                mp_drawing.draw_landmarks(
+                    image,
+                    self.results.pose_landmarks,
+                    mp_pose.POSE_CONNECTIONS,)
+                    # landmark_drawing_spec=mp_drawing_styles.get_default_pose_landmarks_style())
             return image,joints
+
+    def detect(self,image):
+        """Run the pose graph only, returns the joints array or None.
+
+        The array is the joints buffer, the next detect() overwrites it: copy
+        it to keep the joints of a frame.
+        """
+        if self.process_size != None and (image.shape[1], image.shape[0]) != tuple(self.process_size):
+            image = cv2.resize(image, tuple(self.process_size), interpolation=cv2.INTER_AREA)
+        # the only color conversion, into a buffer reused between frames
+        if self._rgb is None or self._rgb.shape != image.shape:
+            self._rgb = np.empty_like(image)
+        cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=self._rgb)
+        self.results = self.pose.process(self._rgb)
+        if self.results.pose_landmarks:
+            return self.landmarks_to_array(self.results.pose_landmarks)
+        return None
+
+    def landmarks_to_array(self, pose_landmarks):
+        """Copy the landmarks into the joints buffer, returns a (33, 4) array."""
+        joints = self.joints
+        for i, lm in enumerate(pose_landmarks.landmark):
+            joints[i, 0] = lm.x
+            joints[i, 1] = lm.y
+            joints[i, 2] = lm.z
+            joints[i, 3] = lm.visibility
+        return joints
+
+
+def joints_to_list(joints):
+    """Convert joints array to the old list form [[x,y,z,visibility], ...], None stays None."""
+    if joints is None:
+        return None
+    return joints.tolist()
+
+
+def draw_joints(image, joints, visibility_threshold=0.5, overlay=None):
+    """Draw a joints array (normalized coordinates) on a BGR image in place, or into overlay if given."""
+    if joints is None:
+        return image
+    height, width = image.shape[:2]
+    line = overlay.line if overlay != None else lambda *args: cv2.line(image, *args)
+    circle = overlay.circle if overlay != None else lambda *args: cv2.circle(image, *args)
+    points = (joints[:, :2] * (width, height)).astype(np.int32).tolist()
+    visible = (joints[:, 3] >= visibility_threshold).tolist()
+    for start, end in mp_pose.POSE_CONNECTIONS:
+        if visible[start] and visible[end]:
+            line(tuple(points[start]), tuple(points[end]), (224,224,224), 2)
+    for point, is_visible in zip(points, visible):
+        if is_visible:
+            circle(tuple(point), 2, (0,0,255), 2)
+    return image
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+import cv2
+import numpy as np
+
+# Results of image regions reused across frames. A sign in front of a steady
+# camera is found in the same place frame after frame; instead of running the
+# model on it every time, the result of the last classification is reused
+# while the region stays in place and looks the same.
+#
+#   cache = RegionCache()
+#   result = cache.get((x, y, w, h), img[y:y+h, x:x+w], frame_id, lambda: classify(...))
+
+
+class _Entry():
+    __slots__ = ('box', 'thumbnail', 'value', 'frame')
+
+    def __init__(self, box, thumbnail, value, frame):
+        self.box = box
+        self.thumbnail = thumbnail
+        self.value = value
+        self.frame = frame
+
+
+class RegionCache():
+    '''
+    A region matches an entry when its center moved by at most
+    position_tolerance and its width and height changed by at most
+    size_tolerance, both relative to the size of the entry, and the mean
+    absolute difference of their 16x16 gray thumbnails is at most
+    max_difference. Entries expire max_age frames after the region was
+    computed, so results are refreshed regularly; max_age=0 turns the cache off.
+    '''
+    def __init__(self, max_age=15, position_tolerance=0.15, size_tolerance=0.15, max_difference=8.0, max_entries=32):
+        self.max_age = max_age
+        self.position_tolerance = position_tolerance
+        self.size_tolerance = size_tolerance
+        self.max_difference = max_difference
+        self.max_entries = max_entries
+        self.entries = []
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def thumbnail(crop):
+        if crop.ndim == 3:
+            crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(crop, (16, 16), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def _near(self, a, b):
+        ax, ay, aw, ah = a
+        bx, by, bw, bh = b
+        size = max(aw, ah)
+        return (abs((ax + aw / 2) - (bx + bw / 2)) <= self.position_tolerance * size
+                and abs((ay + ah / 2) - (by + bh / 2)) <= self.position_tolerance * size
+                and abs(aw - bw) <= self.size_tolerance * aw
+                and abs(ah - bh) <= self.size_tolerance * ah)
+
+    def get(self, box, crop, frame, compute):
+        """Returns the value of the region box (x, y, w, h) of pixels crop, compute() on a miss.
+
+        frame: id of the current frame, entries older than max_age frames are dropped,
+            so are entries of later frame ids (an earlier session, ids start over)
+        """
+        if self.max_age <= 0:
+            return compute()
+        self.entries = [entry for entry in self.entries if 0 <= frame - entry.frame <= self.max_age]
+        thumbnail = self.thumbnail(crop)
+        for entry in self.entries:
+            if self._near(entry.box, box) and np.abs(entry.thumbnail - thumbnail).mean() <= self.max_difference:
+                self.hits += 1
+                return entry.value
+        self.misses += 1
+        value = compute()
+        self.entries.append(_Entry(tuple(box), thumbnail, value, frame))
+        if len(self.entries) > self.max_entries:
+            del self.entries[0]
+        return value
+
+    def clear(self):
+        del self.entries[:]
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+
+import numpy as np
+import cv2
+
+try:
+    from . import vilib as vilib_module
+    from .vilib import Vilib
+    from .results_stream import frame_results
+except ImportError:
+    # run as a script, the package is imported from the directory above
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from vilib import vilib as vilib_module
+    from vilib.vilib import Vilib
+    from vilib.results_stream import frame_results
+
+# Accuracy plus speed regression check of the vilib detectors. The fixture
+# images are fed as frames to a Vilib pipeline, one detector switched on at a
+# time, through Vilib.process_frame() like the frames of the camera loop: the
+# same stage functions, crops, shape pruning, region and perceptual caches.
+# Their results, as published in detect_obj_parameter, are compared with
+# golden results recorded from a trusted build:
+#
+#   python3 -m vilib.regression --update     # record golden.json
+#   python3 -m vilib.regression              # compare, exit 1 on changes
+#
+# The fixtures default to /opt/vilib/regression, installed from
+# workspace/regression. Every image is the first frame of a steady camera; the
+# --repeat timed frames that follow it are recorded and compared as well (the
+# trackers of hands and pose refine their answer over the frames), so a cache
+# that answers differently from the detector shows up as a difference.
+#
+# Boxes are matched by IoU (objects also by label), labels must match, scores
+# and landmarks agree within the tolerance. Latencies are reported next to the
+# agreement, so an optimization shows both what it gained and whether it
+# changed any answer.
+
+IMAGE_PATTERNS = ('*.jpg', '*.jpeg', '*.png', '*.bmp')
+DEFAULT_FIXTURES = '/opt/vilib/regression'
+FRAME_SIZE = (640, 480)     # the detectors expect frames of the default camera resolution
+
+# allowed differences to the golden results
+DEFAULT_TOLERANCE = {
+    'min_iou': 0.9,           # of matched boxes
+    'max_score_diff': 0.02,   # scores 0-1
+    'max_acc_diff': 2.0,      # accuracies in percent
+    'max_landmark_error': 0.01,    # normalized coordinates
+}
+
+
+def iou(a, b):
+    """IoU of two [ymin, xmin, ymax, xmax] boxes."""
+    h = min(a[2], b[2]) - max(a[0], b[0])
+    w = min(a[3], b[3]) - max(a[1], b[1])
+    if h <= 0 or w <= 0:
+        return 0.0
+    inter = h * w
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+# region detectors
+
+# name, as in detection_log.DETECTORS: switches the detector on
+SWITCHES = {
+    'color': lambda pipeline: pipeline.detect_color_name('red'),
+    'human': lambda pipeline: pipeline.human_detect_switch(True),
+    'traffic_sign': lambda pipeline: pipeline.traffic_sign_detect_switch(True),
+    'gesture': lambda pipeline: pipeline.gesture_detect_switch(True),
+    'qrcode': lambda pipeline: pipeline.qrcode_detect_switch(True),
+    'objects': lambda pipeline: pipeline.object_detect_switch(True),
+    'hands': lambda pipeline: pipeline.hands_detect_switch(True, max_num_hands=2),
+    'pose': lambda pipeline: pipeline.pose_detect_switch(True),
+    'classification': lambda pipeline: pipeline.image_classify_switch(True),
+}
+
+# model files of the detectors, attributes of the vilib module holding their paths
+MODEL_FILES = {
+    'traffic_sign': ('traffic_sign_model_path',),
+    'gesture': ('gesture_model_path',),
+    'objects': ('objects_detection_model', 'objects_detection_labels'),
+    'classification': ('image_classification_model', 'image_classification_labels'),
+}
+
+
+def use_models(pipeline, models_dir):
+    """Points the detectors at the files of models_dir instead of /opt/vilib."""
+    for attributes in MODEL_FILES.values():
+        for attribute in attributes:
+            path = os.path.join(models_dir, os.path.basename(getattr(vilib_module, attribute)))
+            setattr(vilib_module, attribute, path)
+    pipeline.face_cascade = cv2.CascadeClassifier(os.path.join(models_dir, 'haarcascade_frontalface_default.xml'))
+    roi = cv2.imread(os.path.join(models_dir, 'cali.jpg'))
+    if roi is not None:
+        pipeline.roi_hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
+
+
+def missing(pipeline, name):
+    """What detector name needs to run and is missing, None if nothing."""
+    for attribute in MODEL_FILES.get(name, ()):
+        path = getattr(vilib_module, attribute)
+        if not os.path.exists(path):
+            return '%s not found'%path
+    if name in ('human', 'gesture') and pipeline.face_cascade.empty():
+        return 'no face cascade'
+    if name == 'gesture' and getattr(pipeline, 'roi_hsv', None) is None:
+        return 'no cali.jpg'
+    return None
+
+
+class Runner():
+    '''
+    Feeds the fixtures as frames to a Vilib pipeline of its own, with one
+    detector switched on at a time.
+    '''
+    def __init__(self, models_dir=None):
+        self.pipeline = Vilib('regression')
+        if models_dir != None:
+            use_models(self.pipeline, models_dir)
+        self.framerate = self.pipeline.pipeline['framerate']
+        self.frame_id = 0
+        self.name = None
+        self.plan = None
+        self.count = 0
+
+    def switch(self, name):
+        """Switches detector name on and the others off, returns why it cannot run or None."""
+        params = self.pipeline.detect_obj_parameter
+        for _, flag in vilib_module.PIPELINE_STAGES:
+            params[flag] = False
+        self.pipeline.hands_detect_switch(False)
+        self.pipeline.pose_detect_switch(False)
+        self.name = None
+        if name is None:
+            return None
+        reason = missing(self.pipeline, name)
+        if reason != None:
+            return reason
+        try:
+            SWITCHES[name](self.pipeline)
+        except ImportError as e:
+            return str(e)
+        self.name = name
+        # switched off stages reset their results on the first frame of the plan
+        self.plan = self.pipeline.stage_plan()
+        self.count = 0
+        return None
+
+    def run(self, image):
+        """Processes image as the next frame, returns (result of the detector, seconds)."""
+        self.frame_id += 1
+        self.count += 1
+        # capture times of a steady frame rate, the results do not depend on the wall clock
+        timestamp = self.frame_id / float(self.framerate)
+        start = time.perf_counter()
+        self.pipeline.process_frame(self.plan, image.copy(), self.frame_id, timestamp, self.count)
+        seconds = time.perf_counter() - start
+        result = frame_results(self.pipeline.detect_obj_parameter)[self.name]
+        if self.name in ('hands', 'pose'):
+            result = {'joints': result['joints']}
+        return result, seconds
+
+# endregion detectors
+
+
+# region comparison
+
+BOX_DETECTORS = ('color', 'human', 'traffic_sign', 'gesture', 'qrcode')
+
+
+def center_boxes(result):
+    """{'boxes': [[ymin, xmin, ymax, xmax]]} of the box of a box detector, no boxes when it found nothing."""
+    if not result['w']:
+        return {'boxes': []}
+    x, y, w, h = result['x'], result['y'], result['w'], result['h']
+    return {'boxes': [[y - h / 2, x - w / 2, y + h / 2, x + w / 2]]}
+
+
+def match_boxes(golden, result, classes=False):
+    """Greedily matches golden boxes to result boxes, returns (ious of the matches, unmatched golden, extra results)."""
+    used = set()
+    ious = []
+    for i, box in enumerate(golden['boxes']):
+        best, best_j = 0.0, None
+        for j, other in enumerate(result['boxes']):
+            if j in used or (classes and result['classes'][j] != golden['classes'][i]):
+                continue
+            value = iou(box, other)
+            if value > best:
+                best, best_j = value, j
+        if best_j is not None and best > 0:
+            used.add(best_j)
+            ious.append(best)
+    missed = len(golden['boxes']) - len(ious)
+    extra = len(result['boxes']) - len(used)
+    return ious, missed, extra
+
+
+def compare(name, golden, result, tolerance):
+    """Returns (agreement numbers, list of problems) of one image."""
+    problems = []
+    if name == 'objects' or name in BOX_DETECTORS:
+        if name == 'objects':
+            ious, missed, extra = match_boxes(golden, result, classes=True)
+        else:
+            ious, missed, extra = match_boxes(center_boxes(golden), center_boxes(result))
+        low = [v for v in ious if v < tolerance['min_iou']]
+        if missed or extra:
+            problems.append('%d missed, %d extra boxes'%(missed, extra))
+        if low:
+            problems.append('IoU %.3f below %.2f'%(min(low), tolerance['min_iou']))
+        for key in ('n', 't', 'data'):
+            if key in golden and golden[key] != result[key]:
+                problems.append('%s %r instead of %r'%(key, result[key], golden[key]))
+        if 'acc' in golden and abs(golden['acc'] - result['acc']) > tolerance['max_acc_diff']:
+            problems.append('accuracy differs by %.1f'%abs(golden['acc'] - result['acc']))
+        return {'boxes': len(ious) + missed, 'matched': len(ious), 'iou_sum': float(sum(ious))}, problems
+    if name in ('hands', 'pose'):
+        if (golden['joints'] is None) != (result['joints'] is None):
+            problems.append('detection changed')
+            return {'landmark_error': None}, problems
+        if golden['joints'] is None:
+            return {'landmark_error': 0.0}, problems
+        a, b = np.array(golden['joints']), np.array(result['joints'])
+        if a.shape != b.shape:
+            problems.append('%d detected instead of %d'%(len(b), len(a)))
+            return {'landmark_error': None}, problems
+        # x, y, z distance, pose visibility is left out
+        error = float(np.linalg.norm(a[..., :3] - b[..., :3], axis=-1).mean())
+        if error > tolerance['max_landmark_error']:
+            problems.append('landmark error %.4f'%error)
+        return {'landmark_error': error}, problems
+    # classification
+    same = golden['t'] == result['t']
+    diff = abs(golden['acc'] - result['acc'])
+    if not same:
+        problems.append('label %r instead of %r'%(result['t'], golden['t']))
+    elif diff > tolerance['max_score_diff']:
+        problems.append('score differs by %.3f'%diff)
+    return {'label_match': same, 'score_diff': diff}, problems
+
+
+def detected(name, result):
+    """Whether a detector found something in result."""
+    if name == 'objects':
+        return result['n'] > 0
+    if name in BOX_DETECTORS:
+        return bool(result['w'])
+    if name in ('hands', 'pose'):
+        return result['joints'] is not None
+    return True
+
+
+def summarize(name, rows):
+    if name == 'objects' or name in BOX_DETECTORS:
+        boxes = sum(r['boxes'] for r in rows)
+        matched = sum(r['matched'] for r in rows)
+        mean_iou = sum(r['iou_sum'] for r in rows) / matched if matched else 1.0
+        return 'boxes matched %d/%d, mean IoU %.3f'%(matched, boxes, mean_iou)
+    if name in ('hands', 'pose'):
+        errors = [r['landmark_error'] for r in rows if r['landmark_error'] is not None]
+        return 'mean landmark error %.4f'%(np.mean(errors) if errors else 0.0)
+    matches = sum(r['label_match'] for r in rows)
+    return 'labels matched %d/%d, max score diff %.3f'%(matches, len(rows), max(r['score_diff'] for r in rows))
+
+# endregion comparison
+
+
+def percentiles(seconds):
+    """p50 and p90 in ms of the latencies, 0 without any."""
+    if len(seconds) == 0:
+        return 0.0, 0.0
+    ms = np.array(seconds) * 1000
+    return np.percentile(ms, 50), np.percentile(ms, 90)
+
+
+def load_fixtures(images):
+    """Returns [(file name, BGR frame of FRAME_SIZE)]."""
+    frames = []
+    for path in images:
+        image = cv2.imread(path)
+        if image is None:
+            print('cannot read %s'%path)
+            continue
+        if (image.shape[1], image.shape[0]) != FRAME_SIZE:
+            image = cv2.resize(image, FRAME_SIZE, interpolation=cv2.INTER_AREA)
+        frames.append((os.path.basename(path), image))
+    return frames
+
+
+def run_fixtures(runner, names, frames, repeat=3):
+    """Returns {detector: {image: [result of every frame]}}, {detector: latencies in seconds}
+    and {detector: why it was skipped}.
+    """
+    results = {}
+    latencies = {}
+    skipped = {}
+    for name in names:
+        reason = runner.switch(name)
+        if reason != None:
+            print('%s: skipped, %s'%(name, reason))
+            skipped[name] = reason
+            continue
+        results[name] = {}
+        latencies[name] = []
+        for key, image in frames:
+            # the first frame of an image also warms up, the following ones are timed
+            outputs = [runner.run(image)[0]]
+            for _ in range(repeat):
+                result, seconds = runner.run(image)
+                outputs.append(result)
+                latencies[name].append(seconds)
+            results[name][key] = outputs
+    runner.switch(None)
+    return results, latencies, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        'fixtures',
+        help='Directory of the fixture images.',
+        nargs='?',
+        default=DEFAULT_FIXTURES)
+    parser.add_argument(
+        '--golden',
+        help='Golden results file, default: golden.json in the fixtures directory.',
+        default=None)
+    parser.add_argument(
+        '--models',
+        help='Directory of the models, e.g. the workspace directory of the repository.',
+        default=None)
+    parser.add_argument(
+        '--detectors',
+        help='Comma separated detectors to run, default: all of them.',
+        default=None)
+    parser.add_argument(
+        '--repeat',
+        help='Timed frames per image and detector.',
+        type=int,
+        default=3)
+    parser.add_argument(
+        '--update',
+        help='Record the golden results instead of comparing.',
+        action='store_true')
+    args = parser.parse_args()
+
+    images = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(args.fixtures, pattern)))
+    frames = load_fixtures(images)
+    if len(frames) == 0:
+        print('no images in %s'%args.fixtures)
+        return 2
+    golden_path = args.golden if args.golden != None else os.path.join(args.fixtures, 'golden.json')
+    names = args.detectors.split(',') if args.detectors != None else list(SWITCHES)
+    for name in names:
+        if name not in SWITCHES:
+            print('unknown detector %s, one of %s'%(name, ', '.join(SWITCHES)))
+            return 2
+    runner = Runner(args.models)
+    results, latencies, skipped = run_fixtures(runner, names, frames, args.repeat)
+
+    print('%-22s %9s %9s  %s'%('detector', 'p50 ms', 'p90 ms', 'agreement'))
+    if args.update:
+        golden = {'tolerance': DEFAULT_TOLERANCE, 'size': FRAME_SIZE,
+                  'results': results}
+        with open(golden_path, 'w') as f:
+            json.dump(golden, f, indent=1, sort_keys=True)
+        # golden results of a detector that finds nothing in any fixture would not guard it
+        idle = [name for name, images in results.items()
+                if not any(detected(name, result) for outputs in images.values() for result in outputs)]
+        for name in results:
+            print('%-22s %9.2f %9.2f  golden recorded%s'%((name,) + percentiles(latencies[name]) +
+                                                         (', but it detects nothing in the fixtures' if name in idle else '',)))
+        print('golden results of %d images written to %s'%(len(frames), golden_path))
+        return 1 if skipped or idle else 0
+
+    with open(golden_path) as f:
+        golden = json.load(f)
+    tolerance = dict(DEFAULT_TOLERANCE)
+    tolerance.update(golden.get('tolerance', {}))
+    failures = []
+    for name in names:
+        expected = golden['results'].get(name)
+        if name in skipped:
+            if expected is not None:
+                # a detector that stopped running is a change as well
+                failures.append('%s: not run, %s'%(name, skipped[name]))
+            continue
+        if expected is None:
+            # a detector asked for must be guarded, record its golden results with --update
+            failures.append('%s: no golden results'%name)
+            continue
+        rows = []
+        for key, outputs in results[name].items():
+            if key not in expected:
+                failures.append('%s %s: no golden results'%(name, key))
+                continue
+            # the frames recorded in both, --repeat may differ from the one of the golden results
+            for frame, (golden_result, result) in enumerate(zip(expected[key], outputs)):
+                row, problems = compare(name, golden_result, result, tolerance)
+                if frame == 0:
+                    rows.append(row)
+                    failures.extend('%s %s: %s'%(name, key, p) for p in problems)
+                else:
+                    failures.extend('%s %s, frame %d of the steady camera: %s'%(name, key, frame + 1, p) for p in problems)
+        print('%-22s %9.2f %9.2f  %s'%((name,) + percentiles(latencies[name]) +
+                                       (summarize(name, rows) if rows else 'no images in common',)))
+    if failures:
+        print('\n%d differences to the golden results:'%len(failures))
+        for failure in failures:
+            print('  ' + failure)
+        return 1
+    print('\nall outputs agree with the golden results')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import queue
+import threading
+
+import numpy as np
+import cv2
+
+# Recording and deterministic replay of camera sessions. A session directory holds
+#
+#   video.avi        the frames the camera loop processed, before any drawing,
+#                    lossless (FFV1) so that a replay sees the same pixels
+#   frames.bin       (index, frame_id, timestamp) records of those frames
+#   changes.jsonl    {"index": i, "changes": {key: value}} of the switches,
+#                    the first line holds all of them
+#   results/         detection log of the original run (optional)
+#
+# replay_session() runs the session through a Vilib pipeline again: every
+# recorded frame is processed (none is dropped), with the original frame ids and
+# timestamps and the switches changed at the same frames. compare_results() then diffs the
+# detection logs of two runs.
+
+FRAME_DTYPE = np.dtype([('index', '<u8'), ('frame_id', '<u8'), ('timestamp', '<f8')])
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+class SessionRecorder():
+    '''
+    Records the frames and switch changes of a camera loop, add() is called
+    with every frame before the detectors draw on it. Video encoding runs on a
+    background thread, at most max_queue frames wait for it; frames coming
+    while the queue is full are not recorded and counted in dropped.
+
+    fourcc is a lossless codec ('FFV1', 'HFYU') by default: the replay then
+    sees exactly the pixels of the original run, and compare_results() only
+    reports real differences. A lossy codec such as 'MJPG' is cheaper to
+    store but every replay sees slightly different pixels. A codec the OpenCV
+    build cannot write raises ValueError.
+    '''
+    def __init__(self, path, control_keys, fps=24.0, fourcc='FFV1', max_queue=64):
+        self.path = path
+        self.control_keys = tuple(control_keys)
+        self.fps = fps
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.index = 0
+        self.dropped = 0
+        self.error = None
+        self.last = {}
+
+        os.makedirs(path, exist_ok=True)
+        # the frame size is only known with the first frame, try the codec on a small one
+        probe_path = os.path.join(path, 'codec_probe.avi')
+        probe = cv2.VideoWriter(probe_path, self.fourcc, fps, (64, 48))
+        opened = probe.isOpened()
+        probe.release()
+        if os.path.exists(probe_path):
+            os.remove(probe_path)
+        if not opened:
+            raise ValueError('cannot record video with codec %s'%fourcc)
+        self.video = None
+        self.frames_file = open(os.path.join(path, 'frames.bin'), 'wb')
+        self.changes_file = open(os.path.join(path, 'changes.jsonl'), 'w')
+
+        self.thread = threading.Thread(name='session_recorder', target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, frame_id, timestamp, img, params):
+        changes = {}
+        for key in self.control_keys:
+            value = _jsonable(params.get(key))
+            if key not in self.last or self.last[key] != value:
+                changes[key] = value
+        try:
+            self.queue.put_nowait((self.index, frame_id, timestamp, img.copy(), changes))
+        except queue.Full:
+            # the changes are picked up again with the next recorded frame
+            self.dropped += 1
+            return
+        self.last.update(changes)
+        self.index += 1
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            index, frame_id, timestamp, img, changes = item
+            if self.error is not None:
+                continue
+            if self.video is None:
+                height, width = img.shape[:2]
+                self.video = cv2.VideoWriter(os.path.join(self.path, 'video.avi'), self.fourcc, self.fps, (width, height))
+                if not self.video.isOpened():
+                    # frames.bin stays empty, the session cannot be replayed
+                    self.error = IOError('cannot open the video writer of %s for %dx%d frames'%(self.path, width, height))
+                    print('session recording failed: %s'%self.error)
+                    continue
+            self.video.write(img)
+            self.frames_file.write(np.array((index, frame_id, timestamp), dtype=FRAME_DTYPE).tobytes())
+            if changes:
+                self.changes_file.write(json.dumps({'index': index, 'changes': changes}) + '\n')
+        if self.video is not None:
+            self.video.release()
+        self.frames_file.close()
+        self.changes_file.close()
+
+    def close(self, timeout=10):
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+
+class ReplaySource():
+    '''
+    Frame source playing a recorded session, as fast as the pipeline takes the
+    frames or, with realtime=True, at the recorded pace.
+    '''
+    lossless = True     # CaptureThread hands over every frame
+    camera = None
+
+    def __init__(self, path, realtime=False):
+        self.path = path
+        self.realtime = realtime
+        self.capture = cv2.VideoCapture(os.path.join(path, 'video.avi'))
+        self.frames = np.fromfile(os.path.join(path, 'frames.bin'), dtype=FRAME_DTYPE)
+        self.changes = {}
+        with open(os.path.join(path, 'changes.jsonl')) as f:
+            for line in f:
+                entry = json.loads(line)
+                self.changes[entry['index']] = entry['changes']
+        self.frames_read = 0
+        self.frame_timestamp = None
+        self.last_frame = None
+        self.records = {}   # timestamp: (index, frame_id) of the frames handed out
+        self.pace = None
+
+    def read(self):
+        if self.frames_read >= len(self.frames):
+            raise EOFError('end of the session')
+        ok, frame = self.capture.read()
+        if not ok:
+            raise EOFError('end of the session video')
+        record = self.frames[self.frames_read]
+        timestamp = float(record['timestamp'])
+        if self.realtime:
+            if self.pace is None:
+                self.pace = (time.time(), timestamp)
+            delay = (timestamp - self.pace[1]) - (time.time() - self.pace[0])
+            if delay > 0:
+                time.sleep(delay)
+        self.records[timestamp] = (int(record['index']), int(record['frame_id']))
+        self.frame_timestamp = timestamp
+        self.frames_read += 1
+        self.last_frame = frame
+        return frame
+
+    def capture_still(self):
+        return self.last_frame.copy()
+
+    def apply_changes(self, pipeline, timestamp):
+        """Called by the camera loop before the frame of timestamp is processed, returns its recorded frame_id."""
+        index, frame_id = self.records.pop(timestamp)
+        for key, value in self.changes.get(index, {}).items():
+            pipeline.replay_set(key, value)
+        return frame_id
+
+    def close(self):
+        self.capture.release()
+
+
+def replay_session(path, realtime=False, results_path=None, name='replay'):
+    """Processes a recorded session with the Vilib pipeline name, returns {frames, seconds, fps}.
+
+    results_path: directory of a detection log of the replay, for compare_results()
+    """
+    from .vilib import Vilib
+    source = ReplaySource(path, realtime)
+    pipeline = Vilib(name)
+    pipeline.source = source
+    if results_path != None:
+        pipeline.detection_log_start(results_path)
+    pipeline.detect_obj_parameter['camera_start_flag'] = True
+    start = time.perf_counter()
+    try:
+        pipeline.camera()
+    finally:
+        seconds = time.perf_counter() - start
+        pipeline.detect_obj_parameter['camera_start_flag'] = False
+        pipeline.detection_log_stop()
+    frames = source.frames_read
+    return {'frames': frames, 'seconds': round(seconds, 3), 'fps': round(frames / seconds, 2) if seconds > 0 else 0.0}
+
+
+def compare_results(original_path, replay_path, atol=1e-4, max_listed=10):
+    """Diffs two detection logs frame by frame, matched by capture timestamp.
+
+    Returns {detector: {frames, differing, fields, timestamps}}: the number of
+    matched frames, how many differ, which fields differ and the timestamps of
+    the first differing frames.
+    """
+    from .detection_log import load_session
+    original = load_session(original_path)
+    replay = load_session(replay_path)
+    report = {}
+    for name in original:
+        if name not in replay:
+            continue
+        a, b = original[name], replay[name]
+        _, ia, ib = np.intersect1d(a['timestamp'], b['timestamp'], return_indices=True)
+        a, b = a[ia], b[ib]
+        if len(a) == 0:
+            report[name] = {'frames': 0, 'differing': 0, 'fields': [], 'timestamps': []}
+            continue
+        differing = np.zeros(len(a), dtype=bool)
+        fields = []
+        for field in a.dtype.names:
+            if field in ('frame_id', 'timestamp'):
+                continue
+            x, y = a[field].reshape(len(a), -1), b[field].reshape(len(b), -1)
+            if np.issubdtype(x.dtype, np.floating):
+                diff = ~np.isclose(x, y, atol=atol).all(axis=1)
+            else:
+                diff = (x != y).any(axis=1)
+            if diff.any():
+                fields.append(field)
+            differing |= diff
+        report[name] = {'frames': len(a), 'differing': int(differing.sum()), 'fields': fields,
+                        'timestamps': a['timestamp'][differing][:max_listed].tolist()}
+    return report
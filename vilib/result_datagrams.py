@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+import socket
+
+import numpy as np
+
+from .detection_log import DETECTORS, _fill
+
+# Detection results of every frame sent as one datagram to local endpoints, UDP
+# ('127.0.0.1', 5005) or a Unix datagram socket path, for controllers that need
+# the results within a millisecond of the frame instead of polling Python objects.
+#
+# A packet is the header followed by the records of the switched-on detectors,
+# in the order of detection_log.DETECTORS, all little-endian with fixed layouts:
+#
+#   magic 'VLRD', version u2, detectors u2 (bit i: i-th detector of DETECTORS),
+#   sequence u4, frame_id u8, timestamp f8 (seconds since the epoch)
+#   records, the fields of DETECTORS[name] (box, class, score, landmarks)
+#
+# The sequence number counts the packets of a publisher, a gap tells the
+# receiver it missed packets. parse_packet() unpacks a packet:
+#
+#   sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+#   sock.bind(('127.0.0.1', 5005))
+#   header, records = parse_packet(sock.recv(65536))
+#   records['color']['x']
+
+MAGIC = b'VLRD'
+VERSION = 1
+
+HEADER = np.dtype([('magic', 'S4'), ('version', '<u2'), ('detectors', '<u2'), ('sequence', '<u4'),
+                   ('frame_id', '<u8'), ('timestamp', '<f8')])
+
+NAMES = list(DETECTORS)
+RECORDS = {name: np.dtype(DETECTORS[name][2]) for name in NAMES}
+
+
+def parse_packet(data):
+    """Returns (header, {detector: record}) of a packet, numpy structured scalars."""
+    header = np.frombuffer(data, HEADER, count=1)[0]
+    if header['magic'] != MAGIC or header['version'] != VERSION:
+        raise ValueError('not a vilib result packet')
+    records = {}
+    offset = HEADER.itemsize
+    for i, name in enumerate(NAMES):
+        if header['detectors'] & (1 << i):
+            records[name] = np.frombuffer(data, RECORDS[name], count=1, offset=offset)[0]
+            offset += RECORDS[name].itemsize
+    return header, records
+
+
+class ResultPublisher():
+    '''
+    Sends a packet of the results of the switched-on detectors per frame to
+    every endpoint. The sockets never block the camera loop: packets a
+    receiver is not ready for (no socket bound, buffer full) are dropped and
+    counted in dropped, the receiver sees the gap in the sequence numbers.
+    '''
+    def __init__(self, endpoints, detectors=None):
+        """
+        endpoints: (host, port) of UDP receivers and paths of Unix datagram sockets
+        detectors: names of DETECTORS to send, None for all of them
+        """
+        self.endpoints = [endpoint if isinstance(endpoint, str) else tuple(endpoint) for endpoint in endpoints]
+        self.detectors = [(i, name) for i, name in enumerate(NAMES) if detectors is None or name in detectors]
+        self.sockets = {}
+        for endpoint in self.endpoints:
+            family = socket.AF_UNIX if isinstance(endpoint, str) else socket.AF_INET
+            if family not in self.sockets:
+                sock = socket.socket(family, socket.SOCK_DGRAM)
+                sock.setblocking(False)
+                self.sockets[family] = sock
+        self.header = np.zeros((), dtype=HEADER)
+        self.header['magic'] = MAGIC
+        self.header['version'] = VERSION
+        self.sequence = 0
+        self.sent = 0       # packets, per endpoint
+        self.dropped = 0
+
+    def pack(self, frame_id, timestamp, params):
+        """Returns the packet of the detectors switched on in params (a detect_obj_parameter)."""
+        mask = 0
+        records = []
+        for i, name in self.detectors:
+            if params.get(DETECTORS[name][0]) != True:
+                continue
+            record = np.zeros((), dtype=RECORDS[name])
+            _fill(name, record, params)
+            records.append(record.tobytes())
+            mask |= 1 << i
+        self.sequence = (self.sequence + 1) & 0xffffffff
+        header = self.header
+        header['detectors'] = mask
+        header['sequence'] = self.sequence
+        header['frame_id'] = frame_id
+        header['timestamp'] = timestamp
+        return header.tobytes() + b''.join(records)
+
+    def publish(self, frame_id, timestamp, params):
+        packet = self.pack(frame_id, timestamp, params)
+        for endpoint in self.endpoints:
+            sock = self.sockets[socket.AF_UNIX if isinstance(endpoint, str) else socket.AF_INET]
+            try:
+                sock.sendto(packet, endpoint)
+                self.sent += 1
+            except OSError:
+                # BlockingIOError, nobody bound to the path or port, ...
+                self.dropped += 1
+
+    def close(self):
+        for sock in self.sockets.values():
+            sock.close()
+        self.sockets.clear()
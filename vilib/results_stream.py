@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import json
+import time
+import threading
+
+import numpy as np
+
+from .detection_log import DETECTORS
+
+# Detection results of a camera pipeline for remote dashboards, which draw the
+# boxes themselves instead of scraping the video. The camera loop publishes the
+# results of every frame to the ResultsChannel of its pipeline; the clients of
+# the /results stream (server-sent events) get them as compact JSON:
+#
+#   {"frame_id":812,"timestamp":1760860000.12,"size":[640,480],
+#    "results":{"color":{"x":320,"y":240,"w":60,"h":40,"n":1}}}
+#
+# Only the switched-on detectors (and plugin stages) are in results. Each client
+# picks the detectors and fields it wants, a maximum rate, and whether it only
+# wants the frames whose results changed:
+#
+#   /results?camera=front&fields=color,objects.boxes&max_rate=5&on_change=1
+#
+#   const source = new EventSource('http://<ip>:9000/results?fields=color');
+#   source.onmessage = (e) => draw(JSON.parse(e.data));
+#
+# Nothing is collected while no client is connected.
+
+HEARTBEAT = 15  # seconds, comment sent to idle clients so proxies keep the connection
+
+
+def _value(value):
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == 'f':
+            value = np.round(value.astype(np.float64), 4)
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def frame_results(params, plugins=()):
+    """{detector: {field: value}} of the detectors switched on in params (a detect_obj_parameter).
+
+    plugins: PluginStages whose results are added under their names while switched on
+    """
+    results = {}
+    for name, (flag, prefix, fields) in DETECTORS.items():
+        if params.get(flag) != True:
+            continue
+        if name == 'objects':
+            results[name] = {'n': int(len(params['object_scores'])),
+                             'boxes': _value(params['object_boxes']),
+                             'classes': _value(params['object_classes']),
+                             'scores': _value(params['object_scores'])}
+        elif name in ('hands', 'pose'):
+            results[name] = {'joints': _value(params[prefix + '_joints']),
+                             'age': params[prefix + '_joints_age']}
+        else:
+            results[name] = {field[0]: _value(params.get('%s_%s'%(prefix, field[0]))) for field in fields}
+    for plugin in plugins:
+        if params.get(plugin.flag) == True:
+            results[plugin.name] = _value(params.get(plugin.result_key))
+    return results
+
+
+def parse_fields(fields):
+    """'color,objects.boxes' -> {'color': None, 'objects': {'boxes'}}, None selects everything."""
+    if not fields:
+        return None
+    selection = {}
+    for item in fields.split(','):
+        name, _, field = item.strip().partition('.')
+        if not name:
+            continue
+        if field:
+            if name not in selection:
+                selection[name] = set()
+            if selection[name] is not None:
+                selection[name].add(field)
+        else:
+            selection[name] = None
+    return selection
+
+
+def select(results, selection):
+    if selection is None:
+        return results
+    selected = {}
+    for name, fields in selection.items():
+        if name not in results:
+            continue
+        value = results[name]
+        if fields is not None and isinstance(value, dict):
+            value = {key: value[key] for key in fields if key in value}
+        selected[name] = value
+    return selected
+
+
+class ResultsChannel():
+    '''
+    The results of the last published frame of a pipeline, clients wait() for the next one.
+    '''
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.clients = 0
+        self.frame_id = 0
+        self.timestamp = 0.0
+        self.size = (0, 0)
+        self.results = {}
+
+    def publish(self, frame_id, timestamp, size, params, plugins=()):
+        if self.clients == 0:
+            return
+        results = frame_results(params, plugins)
+        with self.condition:
+            self.frame_id = frame_id
+            self.timestamp = timestamp
+            self.size = size
+            self.results = results
+            self.condition.notify_all()
+
+    def wait(self, frame_id, timeout=None):
+        """Returns (frame_id, timestamp, size, results) of a frame newer than frame_id, None on timeout."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.frame_id != frame_id, timeout):
+                return None
+            return self.frame_id, self.timestamp, self.size, self.results
+
+    def events(self, fields=None, max_rate=None, on_change=False):
+        """Generator of the server-sent events of a client.
+
+        fields: detectors and detector.field to send, comma separated, None for all
+        max_rate: most frames per second sent, None for every frame
+        on_change: only send the frames whose selected results differ from the last sent
+        """
+        selection = parse_fields(fields)
+        interval = 1.0 / max_rate if max_rate else 0.0
+        with self.condition:
+            self.clients += 1
+            # results are only collected while clients are connected, start with the next frame
+            frame_id = self.frame_id
+        try:
+            last_results = None
+            last_sent = 0.0
+            idle = time.monotonic()
+            while True:
+                delay = last_sent + interval - time.monotonic()
+                if delay > 0:
+                    # the frames in between are skipped, the latest one is sent next
+                    time.sleep(delay)
+                frame = self.wait(frame_id, HEARTBEAT)
+                if frame is None:
+                    yield ': keepalive\n\n'
+                    continue
+                frame_id, timestamp, size, results = frame
+                selected = json.dumps(select(results, selection), separators=(',', ':'), default=str)
+                if on_change and selected == last_results:
+                    if time.monotonic() - idle >= HEARTBEAT:
+                        idle = time.monotonic()
+                        yield ': keepalive\n\n'
+                    continue
+                last_results = selected
+                last_sent = idle = time.monotonic()
+                yield 'id: %d\ndata: {"frame_id":%d,"timestamp":%.3f,"size":[%d,%d],"results":%s}\n\n'%(
+                    frame_id, frame_id, timestamp, size[0], size[1], selected)
+        finally:
+            with self.condition:
+                self.clients -= 1
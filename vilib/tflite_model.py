@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+import time
+import numpy as np
+import cv2
+
+class TfliteModel():
+    '''
+    Wraps an allocated tflite interpreter with the tensor details looked up once.
+
+    set_image() resizes (and normalizes) a BGR/RGB uint8 image straight into
+    the interpreter's input tensor, no temporary arrays are created per call:
+      - uint8 models without normalization: cv2.resize writes into the tensor
+      - otherwise the image is resized into a small uint8 scratch buffer and
+        mapped into the tensor through a 256 entry lookup table, which already
+        holds the normalization and the input quantization
+
+    interpreter.tensor() only returns a function, the numpy view it gives back
+    must not be alive during invoke(), so the view is fetched per call and
+    dropped before invoking.
+
+    resize_batch() makes the input hold several images for one invoke, set_image()
+    and output() then take the index of the image in the batch. The batch only
+    grows, reallocating the tensors is far slower than invoking over a few
+    unused slots: a smaller batch fills the first slots, the others keep their
+    earlier images and their outputs are ignored.
+    '''
+    def __init__(self, interpreter, scale=None, offset=0.0, interpolation=cv2.INTER_LINEAR):
+        """
+        scale, offset: the model input is pixel * scale + offset, scale=None feeds raw pixels
+        """
+        self.interpreter = interpreter
+        self.interpolation = interpolation
+
+        details = interpreter.get_input_details()[0]
+        self.input_index = details['index']
+        self.input_shape = tuple(details['shape'])
+        _, self.input_height, self.input_width, self.input_channels = self.input_shape
+        self.input_size = (int(self.input_width), int(self.input_height))
+        self.input_dtype = details['dtype']
+        self.input_quantization = details['quantization']
+        self._input_tensor = interpreter.tensor(self.input_index)
+
+        self.output_details = interpreter.get_output_details()
+        self.output_indexes = [d['index'] for d in self.output_details]
+        self.output_quantization = [d['quantization'] if d['dtype'] == np.uint8 else None for d in self.output_details]
+
+        self.batch_size = 1
+        self.batchable = None   # unknown until a batch is tried
+
+        # invoke statistics
+        self.invoke_count = 0
+        self.invoke_time = 0.0
+
+        self.lut = None
+        self._scratch = None
+        if scale is not None or self.input_dtype != np.uint8:
+            pixels = np.arange(256, dtype=np.float64)
+            values = pixels if scale is None else pixels * scale + offset
+            quant_scale, zero_point = self.input_quantization
+            if quant_scale != 0 and self.input_dtype != np.float32:
+                info = np.iinfo(self.input_dtype)
+                values = np.clip(np.round(values / quant_scale + zero_point), info.min, info.max)
+            self.lut = values.astype(self.input_dtype)
+            self._scratch = np.empty((self.input_height, self.input_width, self.input_channels), dtype=np.uint8)
+
+    def resize_batch(self, batch_size):
+        """Makes the input hold at least batch_size images, returns False if the model only takes one."""
+        if batch_size <= self.batch_size:
+            return True
+        if self.batchable == False:
+            return False
+        try:
+            self.interpreter.resize_tensor_input(self.input_index, [batch_size, self.input_height, self.input_width, self.input_channels])
+            self.interpreter.allocate_tensors()
+            # e.g. the SSD detection post-processing has a fixed output shape
+            ok = all(d['shape'][0] == batch_size for d in self.interpreter.get_output_details())
+        except (ValueError, RuntimeError):
+            ok = False
+        if not ok:
+            # back to the allocation that worked
+            self.interpreter.resize_tensor_input(self.input_index, [self.batch_size, self.input_height, self.input_width, self.input_channels])
+            self.interpreter.allocate_tensors()
+            if self.batchable is None:
+                self.batchable = False
+            return False
+        self.batchable = True
+        self.batch_size = batch_size
+        return True
+
+    def set_image(self, image, batch_index=0):
+        """Resizes image into the input tensor."""
+        if self.lut is None:
+            cv2.resize(image, self.input_size, dst=self._input_tensor()[batch_index], interpolation=self.interpolation)
+        else:
+            cv2.resize(image, self.input_size, dst=self._scratch, interpolation=self.interpolation)
+            np.take(self.lut, self._scratch, out=self._input_tensor()[batch_index], mode='clip')
+
+    def invoke(self):
+        start = time.perf_counter()
+        self.interpreter.invoke()
+        self.invoke_time += time.perf_counter() - start
+        self.invoke_count += 1
+
+    @property
+    def mean_invoke_ms(self):
+        if self.invoke_count == 0:
+            return 0.0
+        return self.invoke_time / self.invoke_count * 1000
+
+    @property
+    def arena_bytes(self):
+        """Approximate tensor arena size, the sum of all tensor buffers."""
+        total = 0
+        for details in self.interpreter.get_tensor_details():
+            total += int(np.prod(details['shape'])) * np.dtype(details['dtype']).itemsize
+        return total
+
+    def output(self, index=0, dequantize=False, batch_index=0):
+        """Returns the squeezed output tensor, dequantized to float if asked and the tensor is uint8."""
+        tensor = self.interpreter.get_tensor(self.output_indexes[index])
+        if self.batch_size > 1:
+            tensor = tensor[batch_index]
+        tensor = np.squeeze(tensor)
+        quantization = self.output_quantization[index]
+        if dequantize and quantization is not None:
+            scale, zero_point = quantization
+            tensor = scale * (tensor.astype(np.float32) - zero_point)
+        return tensor
+
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import threading
+from collections import deque
+
+# Opt-in per-frame span tracer. Spans are kept in a bounded ring in memory and
+# dumped as Chrome trace JSON, which chrome://tracing and ui.perfetto.dev open.
+# While disabled, span() and record() return after a single attribute check.
+
+
+class _Span():
+    __slots__ = ('tracer', 'name', 'frame_id', 'args', 'start')
+
+    def __init__(self, tracer, name, frame_id, args):
+        self.tracer = tracer
+        self.name = name
+        self.frame_id = frame_id
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, time.perf_counter(), self.frame_id, self.args)
+        return False
+
+
+class _NullSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer():
+    def __init__(self, capacity=20000):
+        self.enabled = False
+        self.events = deque(maxlen=capacity)
+        self.thread_names = {}
+
+    def start(self, capacity=None):
+        if capacity != None and capacity != self.events.maxlen:
+            self.events = deque(maxlen=capacity)
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def clear(self):
+        self.events.clear()
+        self.thread_names.clear()
+
+    def span(self, name, frame_id=None, **args):
+        """with tracer.span('encode', frame_id): ..."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, frame_id, args)
+
+    def record(self, name, start, end, frame_id=None, args=None):
+        """Records a span from two time.perf_counter() values."""
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        if thread.ident not in self.thread_names:
+            # a new thread (idents are reused), forget the ones whose spans have left the ring
+            live = set(event[3] for event in list(self.events))
+            self.thread_names = {tid: thread_name for tid, thread_name in list(self.thread_names.items())
+                                 if tid in live}
+            self.thread_names[thread.ident] = thread.name
+        # deque.append is atomic, no lock needed between threads
+        self.events.append((name, start, end - start, thread.ident, frame_id, args))
+
+    def chrome_trace(self):
+        """Returns the recorded spans as a Chrome trace dict."""
+        pid = os.getpid()
+        events = list(self.events)
+        live = set(event[3] for event in events)
+        trace_events = []
+        for tid, thread_name in list(self.thread_names.items()):
+            if tid not in live:
+                continue
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                                 'args': {'name': thread_name}})
+        for name, start, duration, tid, frame_id, args in events:
+            event = {'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': round(start * 1e6, 1), 'dur': round(duration * 1e6, 1)}
+            event_args = dict(args) if args else {}
+            if frame_id != None:
+                event_args['frame_id'] = frame_id
+            if event_args:
+                event['args'] = event_args
+            trace_events.append(event)
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path):
+        """Writes the Chrome trace JSON to path."""
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        return path
+
+
+tracer = Tracer()
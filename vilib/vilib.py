@@ -1,22 +1,34 @@
 #!/usr/bin/env python3
 import os
+import copy
 import time
+import json
+import types
 import datetime
 
 print('Launching ...')
 import cv2
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
-from picamera.array import PiRGBArray
-from picamera import PiCamera
 
-import tflite_runtime.interpreter as tflite
 from pyzbar import pyzbar
+from .model_registry import model_registry
+from .inference_pool import inference_pool
+from .frame_source import PiCameraSource, VideoCaptureSource, CaptureThread
+from .pipeline import load_config, StagePlan, StageContext, PluginStage
+from .overlay import Overlay
+from .outputs import FrameOutputs, ImageArray
+from .results_stream import ResultsChannel
+from .region_cache import RegionCache
+from .phash_cache import PerceptualCache
+from .metrics import metrics, FpsMeter
+from .tracing import tracer
 
 import threading
+import queue
 from multiprocessing import Process, Manager
 
-from flask import Flask, render_template, Response
+from flask import Flask, render_template, Response, request, abort
 
 # user and user home directory
 user = os.getlogin()
@@ -27,6 +39,7 @@ user_home = os.popen('getent passwd %s | cut -d: -f 6'%user).readline().strip()
 # Default path for pictures and videos
 Default_Pictures_Path = '%s/Pictures/vilib/'%user_home
 Default_Videos_Path = '%s/Videos/vilib/'%user_home
+Default_Logs_Path = '%s/vilib_logs/'%user_home
 
 # utils
 def run_command(cmd):
@@ -72,32 +85,106 @@ ges_dict = dict(zip(ges_num_list,gesture_list))
 traffic_sign_model_path = "/opt/vilib/tf_150_dr0.2.tflite"    # 模型路径
 gesture_model_path = "/opt/vilib/3bak_ges_200_dr0.2.tflite"
 
-interpreter_1 = tflite.Interpreter(model_path=traffic_sign_model_path)    # tflite读取模型
-interpreter_1.allocate_tensors()
+# traffic sign candidates of other shapes are not classified
+traffic_sign_filter = {'min_aspect': 0.5, 'max_aspect': 2.0, 'min_fill': 0.5}
+# classified candidates reused while they stay in place, see RegionCache
+traffic_sign_cache = {'max_age': 15, 'position_tolerance': 0.15, 'size_tolerance': 0.15, 'max_difference': 8.0}
+# scores of image classification and gesture inputs reused for similar images, see PerceptualCache
+classification_cache = {'max_entries': 64, 'max_distance': 4, 'ttl': 2.0}
 
-interpreter_2 = tflite.Interpreter(model_path=gesture_model_path)
-interpreter_2.allocate_tensors()
-
-# Get input and output tensors.
-input_details_1 = interpreter_1.get_input_details()
-# print(str(input_details_1))
-output_details_1 = interpreter_1.get_output_details()
-# print(str(output_details_1))
-
-# Get input and output tensors.
-input_details_2 = interpreter_2.get_input_details()
-# print(str(input_details_2))
-output_details_2 = interpreter_2.get_output_details()
-# print(str(output_details_2))
+# Every tflite interpreter is owned by model_registry, models are loaded on first
+# use so that model_registry.configure() can set threads / delegate before that.
+# They are invoked through inference_pool, shared by all the camera pipelines.
+# Crops are resized and normalized ((x/255 - 0.5) * 2) straight into the input tensors
+traffic_sign_normalize = {'scale': 2/255.0, 'offset': -1.0}
+gesture_normalize = {'scale': 2/255.0, 'offset': -1.0}
 
 image_classification_model = '/opt/vilib/mobilenet_v1_0.25_224_quant.tflite'
 image_classification_labels = '/opt/vilib/labels_mobilenet_quant_v1_224.txt'
 
 objects_detection_model = '/opt/vilib/detect.tflite'
 objects_detection_labels = '/opt/vilib/coco_labels.txt'
+objects_detection_filter = {'threshold': 0.4, 'classes': None, 'max_detections': None, 'nms_iou': None}
+
+# detectors camera() can run, in the default order, with the flag that switches each one on
+PIPELINE_STAGES = (
+    ('gesture_calibrate', 'calibrate_flag'),
+    ('traffic_detect', 'ts_flag'),
+    ('color_detect_func', 'cdf_flag'),
+    ('human_detect_func', 'hdf_flag'),
+    ('gesture_recognition', 'gs_flag'),
+    ('qrcode_detect_func', 'qr_flag'),
+    ('object_detect_fuc', 'odf_flag'),
+    ('image_classify_fuc', 'icf_flag'),
+    ('hands_detect_fuc', 'gdf_flag'),
+    ('pose_detect_fuc', 'pdf_flag'),
+)
+
+# switches saved by a session recording and set again by its replay
+REPLAY_CONTROL_KEYS = tuple(flag for _, flag in PIPELINE_STAGES) + ('color_default',)
 
 # endregion : parameter definition
 
+# region Main : metrics
+# per camera pipeline, labelled with the Vilib instance name
+stage_seconds = metrics.histogram('vilib_stage_seconds', 'Latency of the camera loop stages', ('camera', 'stage'))
+frame_seconds = metrics.histogram('vilib_frame_seconds', 'Processing time of a frame in the camera loop', ('camera',))
+frame_latency_seconds = metrics.histogram('vilib_frame_latency_seconds', 'Time from frame capture to the processed frame being published', ('camera',))
+frames_total = metrics.counter('vilib_frames', 'Frames processed by the camera loop', ('camera',))
+dropped_frames = metrics.counter('vilib_dropped_frames', 'Camera frames replaced by a newer one before processing', ('camera',))
+loop_fps = metrics.gauge('vilib_loop_fps', 'Frames per second of the camera loop', ('camera',))
+encoded_frames = metrics.counter('vilib_encoded_frames', 'Frames encoded for streaming and snapshots', ('format',))
+encoded_cache_hits = metrics.counter('vilib_encoded_cache_hits', 'Encoded frames served from the cache of the current frame', ('format',))
+not_modified = metrics.counter('vilib_not_modified', 'Snapshot requests answered 304 Not Modified', ('format',))
+annotated_frames = metrics.counter('vilib_annotated_frames', 'Frames the overlay was drawn on for an annotated output', ('camera',))
+stream_clients = metrics.gauge('vilib_stream_clients', 'Connected /mjpg stream clients')
+results_clients = metrics.gauge('vilib_results_clients', 'Connected /results stream clients')
+
+def queue_depth_metrics():
+    lines = ['# HELP vilib_queue_depth Items waiting in the vilib queues',
+            '# TYPE vilib_queue_depth gauge']
+    for camera, pipeline in list(Vilib.instances.items()):
+        lines.append('vilib_queue_depth{camera="%s",queue="still"} %d'%(camera, pipeline.still_queue.qsize()))
+        for name, worker in (('hands_worker', pipeline.hands_worker), ('pose_worker', pipeline.pose_worker)):
+            if worker != None:
+                lines.append('vilib_queue_depth{camera="%s",queue="%s"} %d'%(camera, name, int(worker.busy)))
+    for model, depth in inference_pool.queue_depths().items():
+        lines.append('vilib_queue_depth{queue="inference_%s"} %d'%(model, depth))
+    return lines
+
+def model_invoke_metrics():
+    lines = ['# HELP vilib_model_invoke_seconds Invoke time of the tflite models',
+            '# TYPE vilib_model_invoke_seconds summary']
+    for name, model in list(model_registry.models.items()):
+        lines.append('vilib_model_invoke_seconds_sum{model="%s"} %s'%(name, model.invoke_time))
+        lines.append('vilib_model_invoke_seconds_count{model="%s"} %d'%(name, model.invoke_count))
+    lines.extend(['# HELP vilib_inference_batches_total Invokes of the inference pool, a batch serves one or more requests',
+                  '# TYPE vilib_inference_batches_total counter'])
+    batch_stats = inference_pool.batch_stats()
+    for name, (requests, batches) in batch_stats.items():
+        lines.append('vilib_inference_batches_total{model="%s"} %d'%(name, batches))
+    lines.extend(['# HELP vilib_inference_requests_total Requests served by the inference pool',
+                  '# TYPE vilib_inference_requests_total counter'])
+    for name, (requests, batches) in batch_stats.items():
+        lines.append('vilib_inference_requests_total{model="%s"} %d'%(name, requests))
+    return lines
+
+def cache_metrics():
+    lines = ['# HELP vilib_cache_lookups_total Lookups of the detector result caches',
+            '# TYPE vilib_cache_lookups_total counter']
+    for camera, pipeline in list(Vilib.instances.items()):
+        for name, cache in (('traffic_sign', pipeline.traffic_cache), ('image_classification', pipeline.classify_cache),
+                            ('gesture', pipeline.gesture_cache)):
+            if cache != None:
+                lines.append('vilib_cache_lookups_total{camera="%s",cache="%s",result="hit"} %d'%(camera, name, cache.hits))
+                lines.append('vilib_cache_lookups_total{camera="%s",cache="%s",result="miss"} %d'%(camera, name, cache.misses))
+    return lines
+
+metrics.add_collector(queue_depth_metrics)
+metrics.add_collector(model_invoke_metrics)
+metrics.add_collector(cache_metrics)
+# endregion : metrics
+
 # region Main : flask
 os.environ['FLASK_ENV'] =  'development'
 app = Flask(__name__)
@@ -107,32 +194,62 @@ def index():
     """Video streaming home page."""
     return render_template('index.html')
 
-def get_frame():
-    return cv2.imencode('.jpg', Vilib.img_array[0])[1].tobytes()
+# the routes serve the default camera, ?camera=<name> selects another Vilib instance
+def request_pipeline():
+    pipeline = Vilib.instances.get(request.args.get('camera', 'default'))
+    if pipeline is None:
+        abort(404)
+    return pipeline
+
+# ?raw=1 serves the frame without the annotations of the detectors
+def request_raw():
+    return request.args.get('raw', '0') not in ('0', 'false', '')
+
+def get_frame(pipeline, raw=False):
+    return pipeline.outputs.encoded('.jpg', raw)[0]
 
 
-def get_qrcode_pictrue():
-    return cv2.imencode('.jpg', Vilib.img_array[1])[1].tobytes()
+def get_qrcode_pictrue(pipeline):
+    return cv2.imencode('.jpg', pipeline.img_array[1])[1].tobytes()
 
-def get_png_frame():
-    return cv2.imencode('.png', Vilib.img_array[0])[1].tobytes()
+def get_png_frame(pipeline, raw=False):
+    return pipeline.outputs.encoded('.png', raw)[0]
+
+def snapshot(pipeline, ext, mimetype, raw=False):
+    """Response of the current frame, 304 Not Modified when the client has it already (If-None-Match)."""
+    # the etag of the current frame is known without encoding it
+    etag = pipeline.outputs.etag(ext, raw)
+    if etag in request.headers.get('If-None-Match', ''):
+        not_modified.labels(ext.lstrip('.')).inc()
+        response = Response(status=304)
+    else:
+        data, etag = pipeline.outputs.encoded(ext, raw)
+        response = Response(data, mimetype=mimetype)
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers.add("Access-Control-Allow-Origin", "*")
+    return response
 
-def gen():
+def gen(pipeline, raw=False):
     """Video streaming generator function."""
-    while True:  
-        # start_time = time.time()
-        frame = get_frame()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-        time.sleep(0.03)
-        # end_time = time.time() - start_time
-        # print('flask fps:%s'%int(1/end_time))
+    stream_clients.inc()
+    try:
+        while True:  
+            # start_time = time.time()
+            frame = get_frame(pipeline, raw)
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+            time.sleep(0.03)
+            # end_time = time.time() - start_time
+            # print('flask fps:%s'%int(1/end_time))
+    finally:
+        stream_clients.dec()
 
 @app.route('/mjpg')   ## video
 def video_feed():
     # from camera import Camera
     """Video streaming route. Put this in the src attribute of an img tag."""
-    response = Response(gen(),
+    response = Response(gen(request_pipeline(), request_raw()),
                     mimetype='multipart/x-mixed-replace; boundary=frame') 
     response.headers.add("Access-Control-Allow-Origin", "*")
     return response
@@ -141,25 +258,88 @@ def video_feed():
 def video_feed_jpg():
     # from camera import Camera
     """Video streaming route. Put this in the src attribute of an img tag."""
-    response = Response(get_frame(), mimetype="image/jpeg")
-    response.headers.add("Access-Control-Allow-Origin", "*")
-    return response
+    return snapshot(request_pipeline(), '.jpg', "image/jpeg", request_raw())
 
 @app.route('/mjpg.png')  # png
 def video_feed_png():
     # from camera import Camera
     """Video streaming route. Put this in the src attribute of an img tag."""
-    response = Response(get_png_frame(), mimetype="image/png")
+    return snapshot(request_pipeline(), '.png', "image/png", request_raw())
+
+
+def gen_results(pipeline, fields=None, max_rate=None, on_change=False):
+    """Results streaming generator function, server-sent events."""
+    results_clients.inc()
+    try:
+        for event in pipeline.results_channel.events(fields, max_rate, on_change):
+            yield event
+    finally:
+        results_clients.dec()
+
+@app.route('/results')  # detection results, server-sent events
+def results_feed():
+    """JSON of the detection results per frame, for an EventSource.
+
+    ?fields=color,objects.boxes selects detectors and their fields, ?max_rate=5
+    sends at most 5 frames a second, ?on_change=1 only the frames whose results changed.
+    """
+    try:
+        max_rate = float(request.args.get('max_rate', 0)) or None
+    except ValueError:
+        abort(400)
+    on_change = request.args.get('on_change', '0') not in ('0', 'false', '')
+    response = Response(gen_results(request_pipeline(), request.args.get('fields'), max_rate, on_change),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
     response.headers.add("Access-Control-Allow-Origin", "*")
     return response
 
 
+@app.route('/trace.json')  # chrome trace / perfetto
+def trace_feed():
+    """Spans recorded since Vilib.trace_start(), open the file in ui.perfetto.dev."""
+    response = Response(json.dumps(tracer.chrome_trace()), mimetype="application/json")
+    response.headers.add("Access-Control-Allow-Origin", "*")
+    return response
+
+@app.route('/metrics')  # prometheus
+def metrics_feed():
+    """Camera loop metrics in the Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 def web_camera_start():
     try:
         app.run(host='0.0.0.0', port=9000, threaded=True, debug=False)
     except Exception as e:
         print(e)
 
+# one flask server for all the cameras
+flask_thread = None
+flask_lock = threading.Lock()
+
+def web_display_start(camera='default'):
+    global flask_thread
+    if flask_thread != None and flask_thread.is_alive():
+        return
+    with flask_lock:
+        if flask_thread != None and flask_thread.is_alive():
+            return
+        print('Starting network video streaming ...')
+        wlan0,eth0 = getIP()
+        if wlan0 != None:
+            ip = wlan0     
+        else:
+            ip = eth0
+        if camera == 'default':
+            print('\nRunning on: http://%s:9000/mjpg\n'%ip)
+        else:
+            print('\nRunning on: http://%s:9000/mjpg?camera=%s\n'%(ip, camera))
+        flask_thread = threading.Thread(name='flask_thread',target=web_camera_start)
+        flask_thread.setDaemon(True)
+        flask_thread.start()
+
 # endregion : flask
 
 # 滤镜
@@ -225,12 +405,74 @@ def add_text_to_image(name, text_1):
 
 
 
+class pipelinemethod():
+    '''
+    Method of a Vilib camera pipeline. Called on an instance it runs on that
+    pipeline, called on the class (Vilib.camera_start(), the API before
+    instances) it runs on the default pipeline.
+    '''
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            obj = cls.default()
+        return types.MethodType(self.func, obj)
+
 
 class Vilib(object): 
+    '''
+    A camera pipeline: frame source, detector switches, results and outputs.
+
+    Vilib() and the class itself are the default pipeline on the PiCamera, its
+    state is the class-level detect_obj_parameter / outputs. Vilib(name, source)
+    creates (or returns) another pipeline with state of its own, source is a
+    cv2.VideoCapture device index or url, or an object with read(),
+    capture_still() and close(). All pipelines share the tflite models of
+    model_registry, inference runs through inference_pool, which batches the
+    requests of different cameras.
+
+        front = Vilib('front', source=0)
+        back = Vilib('back', source=2)
+        front.camera_start()
+        back.camera_start()
+        back.color_detect('red')
+    '''
+    instances = {}      # name: pipeline
+    instances_lock = threading.Lock()
 
     flask_process = None
     camera_thread = None
 
+    def __new__(cls, name='default', source=None):
+        with cls.instances_lock:
+            self = cls.instances.get(name)
+            if self is None:
+                self = object.__new__(cls)
+                self.name = name
+                self.source = source
+                if name != 'default':
+                    self.detect_obj_parameter = copy.deepcopy(cls.initial_parameters)
+                    self.outputs = FrameOutputs(cls.rt_img, annotated_frames.labels(name),
+                                                encoded_frames, encoded_cache_hits)
+                    self.img_array = ImageArray(self.outputs, cls.rt_img)
+                    self.results_channel = ResultsChannel()
+                    self.still_queue = queue.Queue()
+                    self.rec_video_set = dict(cls.rec_video_set)
+                    self.plugins = {}
+                    self.overlay = Overlay()
+                    self.overlay_texts = {}
+                cls.instances[name] = self
+        return self
+
+    @classmethod
+    def default(cls):
+        pipeline = cls.instances.get('default')
+        if pipeline is None:
+            pipeline = cls('default')
+        return pipeline
+
 # set parameters
 
     # 读取人脸识别模型
@@ -239,6 +481,13 @@ class Vilib(object):
 
     video_source = 0
 
+    # stages, capture resolution and rate of the camera loop, see pipeline_config()
+    pipeline = load_config({}, PIPELINE_STAGES)
+    plugins = {}    # name: PluginStage, see stage_register()
+    # annotations of the frame in the camera loop, the detectors do not draw into the frame
+    overlay = Overlay()
+    overlay_texts = {}      # name: text item, see overlay_text_add()
+
     # 用于寻找手势识别的肤色的区域的模板图片，可以通过手势识别的校准功能更改图片
     try:
         roi = cv2.imread("/opt/vilib/cali.jpg")
@@ -249,7 +498,6 @@ class Vilib(object):
     # 创建共享字典，提供外部接口动态修改，以及返回字典内容
     # detect_obj_parameter = Manager().dict()
     detect_obj_parameter = {}
-    img_array = Manager().list(range(2))
 
     # 默认的颜色识别颜色为红色
     detect_obj_parameter['color_default'] = 'red'
@@ -297,6 +545,13 @@ class Vilib(object):
     detect_obj_parameter['object_h'] = 0
     detect_obj_parameter['object_t'] = 'None'      # object label
     detect_obj_parameter['object_n'] = 0
+    detect_obj_parameter['object_boxes'] = np.zeros((0,4), np.float32)     # relative [ymin, xmin, ymax, xmax], by score
+    detect_obj_parameter['object_classes'] = np.zeros(0, np.int32)
+    detect_obj_parameter['object_scores'] = np.zeros(0, np.float32)
+
+    # image_classification_parameter
+    detect_obj_parameter['image_classify_t'] = 'None'     # label of the highest score
+    detect_obj_parameter['image_classify_acc'] = 0
 
     # detect_switch
     detect_obj_parameter['hdf_flag'] = False
@@ -323,10 +578,12 @@ class Vilib(object):
     detect_obj_parameter['qr_w'] = 0
     detect_obj_parameter['qr_h'] = 0
 
-    # hands 
+    # hands, float32 array (hands x 21 x [x,y,z]) or None
     detect_obj_parameter['hands_joints'] = None
-    # pose
+    detect_obj_parameter['hands_joints_age'] = None     # seconds since the frame of hands_joints was captured
+    # pose, float32 array (33 x [x,y,z,visibility]) or None
     detect_obj_parameter['body_joints'] = None
+    detect_obj_parameter['body_joints_age'] = None
 
     # picture
     detect_obj_parameter['picture_flag'] = False
@@ -350,239 +607,236 @@ class Vilib(object):
     detect_obj_parameter['change_setting_val'] = 0
 
     detect_obj_parameter['photo_button_flag'] = False
+    detect_obj_parameter['still_resolution'] = None     # None: stills at the video resolution
+    still_queue = queue.Queue()     # (path, watermark, done event) of the stills to take
     detect_obj_parameter['content_length'] = 0
     detect_obj_parameter['content_num'] = 0
-    detect_obj_parameter['process_content_1'] = []
-    detect_obj_parameter['process_si'] = []
+    detect_obj_parameter['process_content_1'] = []     # [text, org, color, scale], see overlay_text_add()
     # detect_obj_parameter['process_dict'] = {}
 
     detect_obj_parameter['watermark_flag'] = True
     detect_obj_parameter['camera_flip'] = False
     detect_obj_parameter['watermark'] = "Shot by Picar-x"
 
+    frame_id = 0        # id of the last captured frame
+    frame_timestamp = None  # capture time (time.time()) of the frame
+    img_frame_id = 0    # id of the last published frame
+
     rt_img = np.ones((320,240),np.uint8)
     front_view_img = np.zeros((240,320,3), np.uint8)
     # 使用白色填充图片区域,默认为黑色
     # front_view_img.fill(255)       
-    img_array[0] = rt_img
-    img_array[1] = rt_img
+    # raw and annotated frame of the camera loop, img_array is the API before them
+    outputs = FrameOutputs(rt_img, annotated_frames.labels('default'), encoded_frames, encoded_cache_hits)
+    img_array = ImageArray(outputs, rt_img)
+    # detection results of the published frames, for the /results stream
+    results_channel = ResultsChannel()
     vi_img = np.ones((320,240),np.uint8)  
 
 # 通过两个参数Shift_left，Shift_right修改
-    @staticmethod
-    def photo_effect(shirt_way = 'Shift_left'):
+    @pipelinemethod
+    def photo_effect(self, shirt_way = 'Shift_left'):
         print(shirt_way)
         shirt_way = str(shirt_way)
         if shirt_way == 'Shift_left':
-            Vilib.detect_obj_parameter['eff'] += 1
-            if Vilib.detect_obj_parameter['eff'] >= len(EFFECTS):
-                Vilib.detect_obj_parameter['eff'] = 0
+            self.detect_obj_parameter['eff'] += 1
+            if self.detect_obj_parameter['eff'] >= len(EFFECTS):
+                self.detect_obj_parameter['eff'] = 0
         elif shirt_way == 'Shift_right':
-            Vilib.detect_obj_parameter['eff'] -= 1
-            if Vilib.detect_obj_parameter['eff'] < 0:
-                Vilib.detect_obj_parameter['eff'] = len(EFFECTS) - 1
+            self.detect_obj_parameter['eff'] -= 1
+            if self.detect_obj_parameter['eff'] < 0:
+                self.detect_obj_parameter['eff'] = len(EFFECTS) - 1
         else:
             raise Exception("parameter error!")
 
 
-    @staticmethod
-    def video_flag(flag):
+    @pipelinemethod
+    def video_flag(self, flag):
         # global button_motion
-        Vilib.detect_obj_parameter['video_flag'] = flag
+        self.detect_obj_parameter['video_flag'] = flag
 
 
     # @staticmethod
     # def watermark(watermark = "Shot by Picar-x"):
     #     # global button_motion
     #     watermark = str(watermark)
-    #     Vilib.detect_obj_parameter['watermark_flag'] = True
-    #     Vilib.detect_obj_parameter['watermark'] = watermark
+    #     self.detect_obj_parameter['watermark_flag'] = True
+    #     self.detect_obj_parameter['watermark'] = watermark
 
-    @staticmethod
-    def show_setting(flag):
+    @pipelinemethod
+    def show_setting(self, flag):
         # global button_motion
 
-        Vilib.detect_obj_parameter['setting_flag'] = flag
+        self.detect_obj_parameter['setting_flag'] = flag
         # button_motion = 'free'
 
-    @staticmethod
-    def change_setting_type_val(setting_type,setting_val):
+    @pipelinemethod
+    def change_setting_type_val(self, setting_type,setting_val):
         # global button_motion
         if setting_type == 'resolution':
-            Vilib.detect_obj_parameter['setting_resolution'] = setting_val
+            self.detect_obj_parameter['setting_resolution'] = setting_val
         else:
-            Vilib.detect_obj_parameter['change_setting_type'] = setting_type
-            Vilib.detect_obj_parameter['change_setting_val'] = setting_val
-            Vilib.detect_obj_parameter['change_setting_flag'] = True
+            self.detect_obj_parameter['change_setting_type'] = setting_type
+            self.detect_obj_parameter['change_setting_val'] = setting_val
+            self.detect_obj_parameter['change_setting_flag'] = True
 
 
-    @staticmethod
-    def shuttle_button():
-        Vilib.detect_obj_parameter['photo_button_flag']  = True
+    @pipelinemethod
+    def shuttle_button(self):
+        self.detect_obj_parameter['photo_button_flag']  = True
         
 
-    @staticmethod
-    def make_qrcode_picture(data):
-        Vilib.img_array = qrcode.make(data=data)
+    @pipelinemethod
+    def make_qrcode_picture(self, data):
+        self.img_array = qrcode.make(data=data)
 
 
 # 返回检测到的颜色的坐标，大小，数量
-    @staticmethod
-    def color_detect_object(obj_parameter):
+    @pipelinemethod
+    def color_detect_object(self, obj_parameter):
         if obj_parameter == 'x':       
-            return int(Vilib.detect_obj_parameter['color_x']/214.0)-1
+            return int(self.detect_obj_parameter['color_x']/214.0)-1
         elif obj_parameter == 'y':
-            return -1*(int(Vilib.detect_obj_parameter['color_y']/160.2)-1) #max_size_object_coordinate_y
+            return -1*(int(self.detect_obj_parameter['color_y']/160.2)-1) #max_size_object_coordinate_y
         elif obj_parameter == 'width':
-            return Vilib.detect_obj_parameter['color_w']   #objects_max_width
+            return self.detect_obj_parameter['color_w']   #objects_max_width
         elif obj_parameter == 'height':
-            return Vilib.detect_obj_parameter['color_h']   #objects_max_height
+            return self.detect_obj_parameter['color_h']   #objects_max_height
         elif obj_parameter == 'number':      
-            return Vilib.detect_obj_parameter['color_n']   #objects_count
+            return self.detect_obj_parameter['color_n']   #objects_count
         return None
 
 # 返回检测到的人脸的坐标，大小，数量
-    @staticmethod
-    def human_detect_object(obj_parameter):
+    @pipelinemethod
+    def human_detect_object(self, obj_parameter):
         if obj_parameter == 'x':
-            return int(Vilib.detect_obj_parameter['human_x']/214.0)-1
+            return int(self.detect_obj_parameter['human_x']/214.0)-1
         elif obj_parameter == 'y':
-            return -1*(int(Vilib.detect_obj_parameter['human_y']/160.2)-1) #max_size_object_coordinate_y
+            return -1*(int(self.detect_obj_parameter['human_y']/160.2)-1) #max_size_object_coordinate_y
         elif obj_parameter == 'width':
-            return Vilib.detect_obj_parameter['human_w']   #objects_max_width
+            return self.detect_obj_parameter['human_w']   #objects_max_width
         elif obj_parameter == 'height':
-            return Vilib.detect_obj_parameter['human_h']   #objects_max_height
+            return self.detect_obj_parameter['human_h']   #objects_max_height
         elif obj_parameter == 'number':      
-            return Vilib.detect_obj_parameter['human_n']   #objects_count
+            return self.detect_obj_parameter['human_n']   #objects_count
         return None
 
 # 返回检测到的交通标志的坐标，大小，类型，准确度
-    @staticmethod
-    def traffic_sign_detect_object(obj_parameter):
+    @pipelinemethod
+    def traffic_sign_detect_object(self, obj_parameter):
         if obj_parameter == 'x':
-            return int(Vilib.detect_obj_parameter['traffic_sign_x']/214.0)-1
+            return int(self.detect_obj_parameter['traffic_sign_x']/214.0)-1
         elif obj_parameter == 'y':
-            return -1*(int(Vilib.detect_obj_parameter['traffic_sign_y']/160.2)-1) #max_size_object_coordinate_y
+            return -1*(int(self.detect_obj_parameter['traffic_sign_y']/160.2)-1) #max_size_object_coordinate_y
         elif obj_parameter == 'width':
-            return Vilib.detect_obj_parameter['traffic_sign_w']   #objects_max_width
+            return self.detect_obj_parameter['traffic_sign_w']   #objects_max_width
         elif obj_parameter == 'height':
-            return Vilib.detect_obj_parameter['traffic_sign_h']   #objects_max_height
+            return self.detect_obj_parameter['traffic_sign_h']   #objects_max_height
         elif obj_parameter == 'number':      
-            return Vilib.detect_obj_parameter['traffic_sign_n']   #objects_count
+            return self.detect_obj_parameter['traffic_sign_n']   #objects_count
         elif obj_parameter == 'type':      
-            return Vilib.detect_obj_parameter['traffic_sign_t']   #objects_type
+            return self.detect_obj_parameter['traffic_sign_t']   #objects_type
         elif obj_parameter == 'accuracy':      
-            return Vilib.detect_obj_parameter['traffic_sign_acc']   #objects_type
+            return self.detect_obj_parameter['traffic_sign_acc']   #objects_type
         return 'none'
 
 # 返回检测到的手势的坐标，大小，类型，准确度
-    @staticmethod
-    def gesture_detect_object(obj_parameter):
+    @pipelinemethod
+    def gesture_detect_object(self, obj_parameter):
         if obj_parameter == 'x':
-            return int(Vilib.detect_obj_parameter['gesture_x']/214.0)-1
+            return int(self.detect_obj_parameter['gesture_x']/214.0)-1
         elif obj_parameter == 'y':
-            return -1*(int(Vilib.detect_obj_parameter['gesture_y']/160.2)-1) #max_size_object_coordinate_y
+            return -1*(int(self.detect_obj_parameter['gesture_y']/160.2)-1) #max_size_object_coordinate_y
         elif obj_parameter == 'width':
-            return Vilib.detect_obj_parameter['gesture_w']   #objects_max_width
+            return self.detect_obj_parameter['gesture_w']   #objects_max_width
         elif obj_parameter == 'height':
-            return Vilib.detect_obj_parameter['gesture_h']   #objects_max_height
+            return self.detect_obj_parameter['gesture_h']   #objects_max_height
         elif obj_parameter == 'type':      
-            return Vilib.detect_obj_parameter['gesture_t']   #objects_type
+            return self.detect_obj_parameter['gesture_t']   #objects_type
         elif obj_parameter == 'accuracy':      
-            return Vilib.detect_obj_parameter['gesture_acc']   #objects_type
+            return self.detect_obj_parameter['gesture_acc']   #objects_type
         return 'none'
 
 # 返回检测到的二维码的坐标，大小，类型，准确度
-    @staticmethod
-    def qrcode_detect_object(obj_parameter = 'data'):
+    @pipelinemethod
+    def qrcode_detect_object(self, obj_parameter = 'data'):
         if obj_parameter == 'x':
-            return int(Vilib.detect_obj_parameter['qr_x']/214.0)-1
+            return int(self.detect_obj_parameter['qr_x']/214.0)-1
         elif obj_parameter == 'y':
-            return -1*(int(Vilib.detect_obj_parameter['qr_y']/160.2)-1) #max_size_object_coordinate_y
+            return -1*(int(self.detect_obj_parameter['qr_y']/160.2)-1) #max_size_object_coordinate_y
         elif obj_parameter == 'width':
-            return Vilib.detect_obj_parameter['qr_w']   #objects_max_width
+            return self.detect_obj_parameter['qr_w']   #objects_max_width
         elif obj_parameter == 'height':
-            return Vilib.detect_obj_parameter['qr_h']   #objects_max_height
+            return self.detect_obj_parameter['qr_h']   #objects_max_height
         elif obj_parameter == 'data':      
-            return Vilib.detect_obj_parameter['qr_data']   #objects_count
+            return self.detect_obj_parameter['qr_data']   #objects_count
         return 'none'
 
 
 # 设置要检测的颜色
-    @staticmethod
-    def detect_color_name(color_name):
+    @pipelinemethod
+    def detect_color_name(self, color_name):
         if color_name == 'close':
-            Vilib.detect_obj_parameter['cdf_flag']  = False
+            self.detect_obj_parameter['cdf_flag']  = False
         else:
-            Vilib.detect_obj_parameter['color_default'] = color_name
-            Vilib.detect_obj_parameter['lower_color'] = np.array([min(Vilib.color_dict[Vilib.detect_obj_parameter['color_default']]), 60, 60])  
-            Vilib.detect_obj_parameter['upper_color'] = np.array([max(Vilib.color_dict[Vilib.detect_obj_parameter['color_default']]), 255, 255])
-            Vilib.detect_obj_parameter['cdf_flag']  = True
+            self.detect_obj_parameter['color_default'] = color_name
+            self.detect_obj_parameter['lower_color'] = np.array([min(self.color_dict[self.detect_obj_parameter['color_default']]), 60, 60])  
+            self.detect_obj_parameter['upper_color'] = np.array([max(self.color_dict[self.detect_obj_parameter['color_default']]), 255, 255])
+            self.detect_obj_parameter['cdf_flag']  = True
 
 # function switch
     # 人脸检测开关    
-    @staticmethod
-    def human_detect_switch(flag=False):
-        Vilib.detect_obj_parameter['hdf_flag'] = flag
+    @pipelinemethod
+    def human_detect_switch(self, flag=False):
+        self.detect_obj_parameter['hdf_flag'] = flag
 
     # 颜色检测开关
-    @staticmethod
-    def color_detect_switch(flag=False):
-        Vilib.detect_obj_parameter['cdf_flag']  = flag
+    @pipelinemethod
+    def color_detect_switch(self, flag=False):
+        self.detect_obj_parameter['cdf_flag']  = flag
 
     # 手势检测开关
-    @staticmethod
-    def gesture_detect_switch(flag=False):
-        Vilib.detect_obj_parameter['gs_flag']  = flag
+    @pipelinemethod
+    def gesture_detect_switch(self, flag=False):
+        self.detect_obj_parameter['gs_flag']  = flag
 
     # 交通标志检测开关
-    @staticmethod
-    def traffic_sign_detect_switch(flag=False):
-        Vilib.detect_obj_parameter['ts_flag']  = flag
+    @pipelinemethod
+    def traffic_sign_detect_switch(self, flag=False):
+        self.detect_obj_parameter['ts_flag']  = flag
 
     # 手势检测开关
-    @staticmethod
-    def gesture_calibrate_switch(flag=False):
-        Vilib.detect_obj_parameter['calibrate_flag']  = flag
+    @pipelinemethod
+    def gesture_calibrate_switch(self, flag=False):
+        self.detect_obj_parameter['calibrate_flag']  = flag
 
     # 目标检测开关
-    @staticmethod
-    def object_follow_switch(flag=False):
-        Vilib.detect_obj_parameter['object_follow_flag'] = flag
+    @pipelinemethod
+    def object_follow_switch(self, flag=False):
+        self.detect_obj_parameter['object_follow_flag'] = flag
 
     # 二维码检测开关
-    @staticmethod
-    def qrcode_detect_switch(flag=False):
-        Vilib.detect_obj_parameter['qr_flag']  = flag
+    @pipelinemethod
+    def qrcode_detect_switch(self, flag=False):
+        self.detect_obj_parameter['qr_flag']  = flag
 
 # camera()
-    @staticmethod
-    def camera_clone():
-        Vilib.camera()     
+    @pipelinemethod
+    def camera_clone(self):
+        self.camera()     
 
-    @staticmethod
-    def camera():
+    @pipelinemethod
+    def camera(self):
         global effect
-        flask_thread = None
-        camera = PiCamera()
-        camera.resolution = (640, 480)
-        camera.image_effect = EFFECTS[Vilib.detect_obj_parameter['eff']]
-        camera.framerate = 24
-        camera.rotation = 0
-        # camera.rotation = 180   
-        camera.brightness = 50    #(0 to 100)
-        camera.sharpness = 0      #(-100 to 100)
-        camera.contrast = 0       #(-100 to 100)
-        camera.saturation = 0     #(-100 to 100)
-        camera.iso = 0            #(automatic)(100 to 800)
-        camera.exposure_compensation = 0   #(-25 to 25)
-        camera.exposure_mode = 'auto'
-        camera.meter_mode = 'average'
-        camera.awb_mode = 'auto'
-        camera.hflip = Vilib.detect_obj_parameter['camera_hflip']
-        camera.vflip = Vilib.detect_obj_parameter['camera_vflip']
-        camera.crop = (0.0, 0.0, 1.0, 1.0)
-        rawCapture = PiRGBArray(camera, size=camera.resolution)  
+        source = self.open_source()
+        camera = source.camera      # None unless the source is a PiCamera
+        # capture runs on its own thread, the loop below always takes the newest frame
+        capture = CaptureThread(source, tracer, name='capture_%s'%self.name).start()
+        window_name = 'Picamera' if self.name == 'default' else self.name
+        # a replay source sets the recorded switches frame by frame
+        apply_changes = getattr(source, 'apply_changes', None)
+        # the recorded capture times of a replay say nothing about the latency of this run
+        own_timestamps = hasattr(source, 'frame_timestamp')
         last_e ='none'
         camera_val = 0
         last_show_content_list = []
@@ -594,176 +848,303 @@ class Vilib(object):
         end_time = 0
         # camera.framerate = 10
         # 
+        plan = self.stage_plan()
+        processed = 0
+        # frame ids and capture times start over, results cached by an earlier session are stale
+        for cache in (self.traffic_cache, self.classify_cache, self.gesture_cache):
+            if cache != None:
+                cache.clear()
+        wait_seconds = stage_seconds.labels(self.name, 'wait')
+        camera_frame_seconds = frame_seconds.labels(self.name)
+        camera_frame_latency_seconds = frame_latency_seconds.labels(self.name)
+        camera_frames_total = frames_total.labels(self.name)
+        camera_dropped_frames = dropped_frames.labels(self.name)
+        camera_loop_fps = loop_fps.labels(self.name)
+        fps_meter = FpsMeter()
+        frame_id = 0
+        sequence = 0        # of the capture slot, frame_id unless the source has its own ids
         try:
             while True:
-                for frame in camera.capture_continuous(rawCapture, format="bgr",use_video_port=True):# use_video_port=True
-                    
-                    start_time = time.time()
-                    img = frame.array
-
-                    img = Vilib.gesture_calibrate(img)
-                    img = Vilib.traffic_detect(img)
-                    img = Vilib.color_detect_func(img)
-                    img = Vilib.human_detect_func(img)
-                    img = Vilib.gesture_recognition(img)
-                    img = Vilib.qrcode_detect_func(img)
-                    # img = Vilib.face_detect_func(img)
-                    # img = Vilib.face_recognition_func(img)
-                    img = Vilib.object_detect_fuc(img) 
-                    img = Vilib.image_classify_fuc(img)
-                    img = Vilib.hands_detect_fuc(img)
-                    img = Vilib.pose_detect_fuc(img)
-
-                    # change_camera_setting
-                    if Vilib.detect_obj_parameter['change_setting_flag'] == True:
-                        Vilib.detect_obj_parameter['change_setting_flag'] = False
-
-                        change_setting_cmd = "camera." + Vilib.detect_obj_parameter['change_setting_type'] + '=' + str(Vilib.detect_obj_parameter['change_setting_val'])
-                        print(change_setting_cmd)
-                        exec(change_setting_cmd)
-
-                        change_type_dict[Vilib.detect_obj_parameter['change_setting_type']] = Vilib.detect_obj_parameter['change_setting_val']
-                    if Vilib.detect_obj_parameter['content_num'] != 0:
-
-                        for i in range(Vilib.detect_obj_parameter['content_num']):
-                            exec("Vilib.detect_obj_parameter['process_si'] = Vilib.detect_obj_parameter['process_content_" + str(i+1) + "'" + "]")
-                            cv2.putText(img, str(Vilib.detect_obj_parameter['process_si'][0]),Vilib.detect_obj_parameter['process_si'][1],cv2.FONT_HERSHEY_SIMPLEX,Vilib.detect_obj_parameter['process_si'][3],Vilib.detect_obj_parameter['process_si'][2],2)
-                    
-                    if Vilib.detect_obj_parameter['setting_flag'] == True:
-                        setting_type = Camera_SETTING[Vilib.detect_obj_parameter['setting']]
-                        if setting_type == "resolution":
-                            Vilib.detect_obj_parameter['setting_val'] = Vilib.detect_obj_parameter['setting_resolution']
-
-                            change_type_dict["resolution"] = list(Vilib.detect_obj_parameter['setting_resolution'])
-                            cv2.putText(img, 'resolution:' + str(Vilib.detect_obj_parameter['setting_resolution']),(10,20),cv2.FONT_HERSHEY_SIMPLEX,0.6,(255,255,255),2)
-                        elif setting_type == "shutter_speed":
-                            change_type_dict["shutter_speed"] = Vilib.detect_obj_parameter['change_setting_val']
-                            cv2.putText(img, 'shutter_speed:' + str(Vilib.detect_obj_parameter['change_setting_val']),(10,20),cv2.FONT_HERSHEY_SIMPLEX,0.6,(255,255,255),2)
-                        else:
-                            cmd_text = "Vilib.detect_obj_parameter['setting_val'] = camera." + Camera_SETTING[Vilib.detect_obj_parameter['setting']]
-                            # print('mennu:',Ras_Cam.detect_obj_parameter['setting_val'])
-                            exec(cmd_text)
-                            cv2.putText(img, setting_type + ': ' + str(Vilib.detect_obj_parameter['setting_val']),(10,20),cv2.FONT_HERSHEY_SIMPLEX,0.6,(255,255,255),2)
-
-
-                    e = EFFECTS[Vilib.detect_obj_parameter['eff']]
-                    
-                    
-                    if last_e != e:
-                        camera.image_effect = e
-                    last_e = e
-                    if last_e != 'none':
-                        cv2.putText(img, str(last_e),(0,15),cv2.FONT_HERSHEY_SIMPLEX,0.6,(204,209,72),2)
-
-                        
-                    if Vilib.detect_obj_parameter['photo_button_flag'] == True:
-                        camera.close()
+                wait_start = time.perf_counter()
+                img, new_sequence, timestamp = capture.read(sequence)
+                if img is None:
+                    if not capture.is_alive():
+                        break
+                    if self.detect_obj_parameter['camera_start_flag'] == False:
                         break
-                     
-                    if  Vilib.detect_obj_parameter['imshow_flag'] == True:
-                        try:      
-                            cv2.imshow("Picamera",img)
+                    continue
+                start_time = time.perf_counter()
+                if sequence > 0 and new_sequence - sequence > 1:
+                    camera_dropped_frames.inc(new_sequence - sequence - 1)
+                sequence = frame_id = new_sequence
+                if apply_changes != None:
+                    # a replay hands out the frame ids of the recording
+                    frame_id = apply_changes(self, timestamp)
+                if self.session_recorder != None:
+                    self.session_recorder.add(frame_id, timestamp, img, self.detect_obj_parameter)
+                wait_seconds.observe(start_time - wait_start)
+                tracer.record('wait', wait_start, start_time, frame_id)
+
+                # only the switched-on stages of the configuration run
+                if plan.config is not self.pipeline:
+                    plan = self.stage_plan()
+                processed += 1
+                img, overlay = self.process_frame(plan, img, frame_id, timestamp, processed)
+
+                # change_camera_setting
+                if self.detect_obj_parameter['change_setting_flag'] == True and camera != None:
+                    self.detect_obj_parameter['change_setting_flag'] = False
+
+                    change_setting_cmd = "camera." + self.detect_obj_parameter['change_setting_type'] + '=' + str(self.detect_obj_parameter['change_setting_val'])
+                    print(change_setting_cmd)
+                    exec(change_setting_cmd)
+
+                    change_type_dict[self.detect_obj_parameter['change_setting_type']] = self.detect_obj_parameter['change_setting_val']
+                # text items of overlay_text_add(), then the process_content_N items, [text, org, color, scale]
+                for item in list(self.overlay_texts.values()):
+                    overlay.text(item['text'], item['org'], item['scale'], item['color'], item['thickness'])
+                for i in range(self.detect_obj_parameter['content_num']):
+                    text, org, color, scale = self.detect_obj_parameter['process_content_%d'%(i+1)][:4]
+                    overlay.text(text, org, scale, color)
+
+                if self.detect_obj_parameter['setting_flag'] == True:
+                    setting_type = Camera_SETTING[self.detect_obj_parameter['setting']]
+                    if setting_type == "resolution":
+                        self.detect_obj_parameter['setting_val'] = self.detect_obj_parameter['setting_resolution']
+
+                        change_type_dict["resolution"] = list(self.detect_obj_parameter['setting_resolution'])
+                        overlay.text('resolution:' + str(self.detect_obj_parameter['setting_resolution']),(10,20),0.6,(255,255,255))
+                    elif setting_type == "shutter_speed":
+                        change_type_dict["shutter_speed"] = self.detect_obj_parameter['change_setting_val']
+                        overlay.text('shutter_speed:' + str(self.detect_obj_parameter['change_setting_val']),(10,20),0.6,(255,255,255))
+                    elif camera != None:
+                        self.detect_obj_parameter['setting_val'] = getattr(camera, setting_type)
+                        overlay.text(setting_type + ': ' + str(self.detect_obj_parameter['setting_val']),(10,20),0.6,(255,255,255))
+
+
+                e = EFFECTS[self.detect_obj_parameter['eff']]
+                
+                
+                if last_e != e and camera != None:
+                    camera.image_effect = e
+                last_e = e
+                if last_e != 'none':
+                    overlay.text(str(last_e),(0,15),0.6,(204,209,72))
+
+                # still capture, the video stream keeps running
+                if self.detect_obj_parameter['photo_button_flag'] == True:
+                    self.detect_obj_parameter['photo_button_flag'] = False
+                    picture_time = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+                    self.detect_obj_parameter['picture_path'] = Default_Pictures_Path + picture_time + '.jpg'
+                    self.still_queue.put((self.detect_obj_parameter['picture_path'], self.detect_obj_parameter['watermark_flag'], None))
+                while not self.still_queue.empty():
+                    still_path, watermark, done = self.still_queue.get()
+                    # taken on the capture thread, saving a full resolution jpg takes a while, do it off both threads
+                    capture.request_still(lambda still, args=(still_path, watermark, done): self.save_still_async(still, *args))
+
+                # the annotated frame is only rendered when an output asks for it
+                with tracer.span('publish', frame_id):
+                    # the controllers waiting for the results first
+                    if self.result_publisher != None:
+                        self.result_publisher.publish(frame_id, timestamp, self.detect_obj_parameter)
+                    self.outputs.publish(frame_id, img, overlay)
+                    self.img_frame_id = frame_id
+                    if self.detection_log != None:
+                        self.detection_log.log(frame_id, timestamp, self.detect_obj_parameter)
+                    self.results_channel.publish(frame_id, timestamp, (img.shape[1], img.shape[0]),
+                                                 self.detect_obj_parameter, self.plugins.values())
+
+                if  self.detect_obj_parameter['imshow_flag'] == True:
+                    try:      
+                        with tracer.span('imshow', frame_id):
+                            cv2.imshow(window_name,self.outputs.annotated())
                             cv2.waitKey(1) # 1 ms
-                            if cv2.getWindowProperty('Picamera', cv2.WND_PROP_VISIBLE) == 0:
-                                # cv2.destroyAllWindows()
-                                cv2.destroyWindow('Picamera')
-                                Vilib.detect_obj_parameter['imshow_flag'] = False
-                                Vilib.detect_obj_parameter['camera_start_flag'] = False
-                        except Exception as e: 
-                            print(e)
-                            print('imshow faileed, maybe this environment does not have "display" ')
-
-                    if Vilib.detect_obj_parameter['camera_start_flag'] == False:
-                        break    
-
-                    # web_display
-                    if Vilib.detect_obj_parameter['web_display_flag'] == True:
-                        if flask_thread == None or flask_thread.is_alive() == False:
-                            print('Starting network video streaming ...')
-                            wlan0,eth0 = getIP()
-                            if wlan0 != None:
-                                ip = wlan0     
-                            else:
-                                ip = eth0
-                            print('\nRunning on: http://%s:9000/mjpg\n'%ip)
-                            flask_thread = threading.Thread(name='flask_thread',target=web_camera_start)
-                            flask_thread.setDaemon(True)
-                            flask_thread.start()
-                    elif Vilib.detect_obj_parameter['web_display_flag'] == False:
-                        if flask_thread != None and flask_thread.is_alive():
-                            flask_thread.join(timeout=0.2)
-
-                    Vilib.img_array[0] = img
-                    rawCapture.truncate(0)
-                    end_time = time.time()
-                    end_time = end_time - start_time
-
-                if Vilib.detect_obj_parameter['camera_start_flag'] == False:
-                    break
-
-                # picture_time = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-                # Vilib.detect_obj_parameter['picture_path'] = Default_Pictures_Path + picture_time + '.jpg'
-
-                # a_t = "sudo raspistill -t 250  -w 2592 -h 1944 -vf  -rot %s -ifx %s -o %s " %( 
-                #     str(change_type_dict['rotation']),
-                #     str(EFFECTS[Vilib.detect_obj_parameter['eff']]),
-                #     Vilib.detect_obj_parameter['picture_path'],
-                #     ) 
-                # run_command(a_t)
-
-                # if Vilib.detect_obj_parameter['watermark_flag'] == True:
-                #     add_text_to_image(Vilib.detect_obj_parameter['picture_path'],Vilib.detect_obj_parameter['watermark'])
-
-                #init again
-                camera = PiCamera()
-                camera.resolution = (640,480)
-                camera.hflip = Vilib.detect_obj_parameter['camera_hflip']
-                camera.vflip = Vilib.detect_obj_parameter['camera_vflip']
-                # camera.rotation = Vilib.detect_obj_parameter['camera_rot']
-                camera.image_effect = e
-                rawCapture = PiRGBArray(camera, size=camera.resolution) 
-                Vilib.detect_obj_parameter['photo_button_flag'] = False
+                        if cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) == 0:
+                            # cv2.destroyAllWindows()
+                            cv2.destroyWindow(window_name)
+                            self.detect_obj_parameter['imshow_flag'] = False
+                            self.detect_obj_parameter['camera_start_flag'] = False
+                    except Exception as e: 
+                        print(e)
+                        print('imshow faileed, maybe this environment does not have "display" ')
+
+                if self.detect_obj_parameter['camera_start_flag'] == False:
+                    break    
+
+                # web_display
+                if self.detect_obj_parameter['web_display_flag'] == True:
+                    web_display_start(self.name)
+
+                end_time = time.perf_counter()
+                end_time = end_time - start_time
+                camera_frame_seconds.observe(end_time)
+                if not own_timestamps:
+                    camera_frame_latency_seconds.observe(time.time() - timestamp)
+                camera_frames_total.inc()
+                camera_loop_fps.set(fps_meter.tick())
 
         except KeyboardInterrupt:
             pass       
         finally:
             print('camera close')
-            camera.close()
-            cv2.destroyAllWindows()
+            capture.stop()
+            source.close()
+            if self.detect_obj_parameter['imshow_flag'] == True:
+                try:
+                    cv2.destroyWindow(window_name)
+                except cv2.error:
+                    pass
+
+    @pipelinemethod
+    def known_stages(self):
+        return PIPELINE_STAGES + tuple((name, plugin.flag) for name, plugin in self.plugins.items())
+
+    @pipelinemethod
+    def stage_plan(self):
+        functions = {name: getattr(self, name) for name, _ in PIPELINE_STAGES}
+        functions.update(self.plugins)
+        histograms = {name: stage_seconds.labels(self.name, name) for name, _ in self.known_stages()}
+        return StagePlan(self.pipeline, functions, histograms)
+
+    @pipelinemethod
+    def process_frame(self, plan, img, frame_id, timestamp, count):
+        # runs the stages of plan (a stage_plan()) on the count-th frame, as the camera loop does,
+        # returns (img, overlay of the frame)
+        self.frame_id = frame_id
+        self.frame_timestamp = timestamp
+        overlay = self.overlay = Overlay()
+        img = plan.run(img, StageContext(self.name, frame_id, timestamp, self.detect_obj_parameter, overlay), count)
+        return img, overlay
+
+    @pipelinemethod
+    def pipeline_config(self, config):
+        # config: dict, .yaml or .json file, see vilib/pipeline.py
+        # stage order and rates apply at once, resolution and framerate at the next camera_start()
+        # registered plugin stages may be listed too
+        self.pipeline = load_config(config, self.known_stages())
+
+# overlay text, drawn on the annotated output of every frame
+    @pipelinemethod
+    def overlay_text_add(self, name, text, org, color=(255,255,255), scale=1.0, thickness=2):
+        # org: left end of the baseline as in cv2.putText, color BGR
+        # the text is rasterized once, again only when text, color, scale or thickness change
+        self.overlay_texts[name] = {'text': str(text), 'org': tuple(org), 'color': tuple(color),
+                                    'scale': scale, 'thickness': thickness}
+
+    @pipelinemethod
+    def overlay_text_update(self, name, **changes):
+        # e.g. overlay_text_update('speed', text='12 cm/s')
+        item = dict(self.overlay_texts[name])
+        item.update(changes)
+        self.overlay_text_add(name, **item)
+
+    @pipelinemethod
+    def overlay_text_remove(self, name):
+        self.overlay_texts.pop(name, None)
+
+# plugin stages
+    @pipelinemethod
+    def stage_register(self, name, function, parallel=False, every=1):
+        # function(frame, context) -> result, frame is a read-only view of the camera frame,
+        # context a StageContext; the result is kept in detect_obj_parameter['<name>_result']
+        # the stage is appended to the pipeline and switched on, see stage_switch()
+        if name in dict(PIPELINE_STAGES):
+            raise ValueError('%s is a built-in stage'%name)
+        plugin = PluginStage(name, function, parallel=parallel)
+        self.plugins[name] = plugin
+        self.detect_obj_parameter[plugin.result_key] = None
+        self.detect_obj_parameter[plugin.flag] = True
+        stages = [stage for stage in self.pipeline['stages'] if stage['name'] != name]
+        stages.append({'name': name, 'flag': plugin.flag, 'every': every})
+        self.pipeline = dict(self.pipeline, stages=stages)
+        return plugin
+
+    @pipelinemethod
+    def stage_unregister(self, name):
+        plugin = self.plugins.pop(name)
+        self.pipeline = dict(self.pipeline, stages=[stage for stage in self.pipeline['stages'] if stage['name'] != name])
+        # the keys stay, a running camera loop may still read them for this frame
+        self.detect_obj_parameter[plugin.flag] = False
+        self.detect_obj_parameter[plugin.result_key] = None
+
+    @pipelinemethod
+    def stage_switch(self, name, flag=False):
+        self.detect_obj_parameter[self.plugins[name].flag] = flag
+
+    @pipelinemethod
+    def open_source(self):
+        if self.source is None:
+            return PiCameraSource(resolution=self.pipeline['resolution'],
+                                  framerate=self.pipeline['framerate'],
+                                  still_resolution=self.detect_obj_parameter['still_resolution'],
+                                  vflip=self.detect_obj_parameter['camera_vflip'],
+                                  hflip=self.detect_obj_parameter['camera_hflip'],
+                                  effect=EFFECTS[self.detect_obj_parameter['eff']])
+        if isinstance(self.source, (int, str)):
+            return VideoCaptureSource(self.source,
+                                      resolution=self.pipeline['resolution'],
+                                      framerate=self.pipeline['framerate'],
+                                      vflip=self.detect_obj_parameter['camera_vflip'],
+                                      hflip=self.detect_obj_parameter['camera_hflip'])
+        return self.source
+
+    # 保存全分辨率照片
+    @pipelinemethod
+    def save_still_async(self, img, path, watermark=False, done=None):
+        still_thread = threading.Thread(name='still_save', target=self.save_still, args=(img, path, watermark, done))
+        still_thread.setDaemon(True)
+        still_thread.start()
+
+    @pipelinemethod
+    def save_still(self, img, path, watermark=False, done=None):
+        try:
+            if img is None:
+                # the still port failed, the capture thread printed why
+                print('Still save failed: no still taken')
+                return
+            os.makedirs(os.path.dirname(path), mode=0o777, exist_ok=True)
+            cv2.imwrite(path, img)
+            if watermark == True:
+                add_text_to_image(path, self.detect_obj_parameter['watermark'])
+        except Exception as e:
+            print('Still save failed: %s'%e)
+        finally:
+            if done != None:
+                done.set()
 
 # 手势校准接口
-    @staticmethod
-    def gesture_calibrate(img):
-        if Vilib.detect_obj_parameter['calibrate_flag'] == True:
+    @pipelinemethod
+    def gesture_calibrate(self, img):
+        if self.detect_obj_parameter['calibrate_flag'] == True:
             cv2.imwrite('/opt/vilib/cali.jpg', img[190:290,270:370])
-            cv2.rectangle(img,(270,190),(370,290),(255,255,255),2)
+            self.overlay.rectangle((270,190),(370,290),(255,255,255),2)
 
         return img
 
 # 添加水印的控制开关
-    @staticmethod
-    def get_picture(process_picture):
-        Vilib.detect_obj_parameter['picture_flag'] = True
-        Vilib.detect_obj_parameter['process_picture'] = process_picture
-        Vilib.detect_obj_parameter['picture_path'] = Default_Pictures_Path + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S') + '.jpg'
+    @pipelinemethod
+    def get_picture(self, process_picture):
+        self.detect_obj_parameter['picture_flag'] = True
+        self.detect_obj_parameter['process_picture'] = process_picture
+        self.detect_obj_parameter['picture_path'] = Default_Pictures_Path + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S') + '.jpg'
 
 # # 拍照控制接口
 #     @staticmethod
 #     def take_photo(img):
 #         if img is not None:
-#             cv2.imwrite(Vilib.detect_obj_parameter['picture_path'], img)
-#             Vilib.detect_obj_parameter['picture_flag'] = False
+#             cv2.imwrite(self.detect_obj_parameter['picture_path'], img)
+#             self.detect_obj_parameter['picture_flag'] = False
 
 
-    @staticmethod
-    def cnt_area(cnt):
+    @pipelinemethod
+    def cnt_area(self, cnt):
         x,y,w,h = cv2.boundingRect(cnt)
         return w*h
 
 
 # 交通标志检测函数，传入值依此是摄像头读取到图像，交通标志的坐标，长宽
-    @staticmethod
-    def traffic_predict(input_img,x,y,w,h):
+    @pipelinemethod
+    def traffic_predict(self, input_img,x,y,w,h):
 
         x1 = int(x)
         x2 = int(x + w)
@@ -771,32 +1152,18 @@ class Vilib(object):
         y2 = int(y + h)
 
         new_img = input_img[y1:y2,x1:x2]
-        new_img = (new_img / 255.0)   
-        new_img = (new_img - 0.5) * 2.0
+        # 调整为识别模型的要求的96x96的图像大小, 直接写入模型的输入, 检测
+        result, = inference_pool.run('traffic_sign', traffic_sign_model_path, new_img, **traffic_sign_normalize)   #获取模型返回的数据
 
-        resize_img = cv2.resize(new_img, (96,96), interpolation=cv2.INTER_LINEAR)   #调整为识别模型的要求的96x96的图像大小
-        flatten_img = np.reshape(resize_img, (96,96,3))
-        im5 = np.expand_dims(flatten_img,axis = 0)
-
-    # Perform the actual detection by running the model with the image as input
-        image_np_expanded = im5.astype('float32') # 类型也要满足要求
-
-        interpreter_1.set_tensor(input_details_2[0]['index'],image_np_expanded)  #放入图像到模型中
-        interpreter_1.invoke()        #检测
-        output_data_2 = interpreter_1.get_tensor(output_details_2[0]['index'])   #获取模型返回的数据
-
-    #     # 出来的结果去掉没用的维度   np.where(result==np.max(result)))[0][0]
-        result = np.squeeze(output_data_2)
         result_accuracy =  round(np.max(result),2)     #获取准确度
-        ges_class = np.where(result==np.max(result))[0][0]   #获取类型
-
+        ges_class = np.argmax(result)   #获取类型
 
         return result_accuracy,ges_class
 
 
 ### 手势识别的流程和上面交通标志一致
-    @staticmethod
-    def gesture_predict(input_img,x,y,w,h):
+    @pipelinemethod
+    def gesture_predict(self, input_img,x,y,w,h):
 
         x1 = int(x)
         x2 = int(x + w)
@@ -814,37 +1181,76 @@ class Vilib(object):
 
 
         new_img = input_img[y1:y2,x1:x2]
-        new_img = (new_img / 255.0)
-        new_img = (new_img - 0.5) * 2.0
+        if self.gesture_cache is None:
+            self.gesture_cache = PerceptualCache(**classification_cache)
+        result = self.gesture_cache.get(new_img, lambda: inference_pool.run('gesture', gesture_model_path, new_img, **gesture_normalize)[0],
+                                        self.frame_timestamp)
 
-        resize_img = cv2.resize(new_img, (96,96), interpolation=cv2.INTER_LINEAR)
-        flatten_img = np.reshape(resize_img, (96,96,3))
-        im5 = np.expand_dims(flatten_img,axis = 0)
-
-    # Perform the actual detection by running the model with the image as input
-        image_np_expanded = im5.astype('float32') # 类型也要满足要求
-
-        interpreter_2.set_tensor(input_details_2[0]['index'],image_np_expanded)
-        interpreter_2.invoke()
-        output_data_2 = interpreter_2.get_tensor(output_details_2[0]['index'])
-
-    #     # 出来的结果去掉没用的维度   np.where(result==np.max(result)))[0][0]
-        result = np.squeeze(output_data_2)
         result_accuracy =  round(np.max(result),2)
-        ges_class = np.where(result==np.max(result))[0][0]
-
+        ges_class = np.argmax(result)
 
         return result_accuracy,ges_class
 
 
+# 交通标志候选区域的筛选, 形状不像交通标志的区域不送进模型
+    @pipelinemethod
+    def traffic_sign_plausible(self, contour, w, h):
+        aspect = w / h
+        if aspect < traffic_sign_filter['min_aspect'] or aspect > traffic_sign_filter['max_aspect']:
+            return False
+        # signs are filled discs, octagons or rings, their outer contour covers most of the box
+        return cv2.contourArea(contour) >= traffic_sign_filter['min_fill'] * w * h
+
+# 交通标志候选区域的识别, 返回 (类型, 准确度, [(圆心 x, 圆心 y, 半径)] 相对区域左上角) 或 None
+    @pipelinemethod
+    def traffic_sign_region(self, img, hsv, x, y, w, h):
+        acc_val, traffic_type = self.traffic_predict(img,x,y,w,h)
+        # print(traffic_type,acc_val)
+        acc_val = round(acc_val*100)
+        if acc_val < 75:
+            return None
+        if traffic_type == 1 or traffic_type == 2 or traffic_type == 3:
+            simple_gray = cv2.cvtColor(img[y:y+h,x:x+w], cv2.COLOR_BGR2GRAY)
+            # new_mask_blue = cv2.inRange(hsv[y:y+h,x:x+w],(92,70,50), (118,255,255))
+            circles = cv2.HoughCircles(simple_gray,cv2.HOUGH_GRADIENT,1,32,\
+            param1=140,param2=70,minRadius=int(w/4.0),maxRadius=max(w,h))
+            if circles is None:
+                return None
+            return traffic_type, acc_val, [(int(c[0]), int(c[1]), int(c[2])) for c in circles[0,:]]
+        elif traffic_type == 0:
+            # small_hsv = cv2.cvtColor(resize_img, cv2.COLOR_BGR2HSV)
+            red_mask_1 = cv2.inRange(hsv[y:y+h,x:x+w],(0,50,20), (4,255,255))           # 3.inRange()：介于lower/upper之间的为白色，其余黑色
+            red_mask_2 = cv2.inRange(hsv[y:y+h,x:x+w],(163,50,20), (180,255,255))
+            red_mask_all = cv2.bitwise_or(red_mask_1,red_mask_2)
+
+            open_img = cv2.morphologyEx(red_mask_all, cv2.MORPH_OPEN,self.kernel_5,iterations=1)              #开运算  
+            open_img = cv2.dilate(open_img, self.kernel_5,iterations=5) 
+            red_contours, hierarchy = findContours(open_img) 
+            if len(red_contours) >= 1:
+                return traffic_type, acc_val, []
+        return None
+
+    # RegionCache of the traffic sign candidates, created on first use from traffic_sign_cache
+    traffic_cache = None
+    @pipelinemethod
+    def traffic_detect_set_cache(self, max_age=15, position_tolerance=0.15, size_tolerance=0.15, max_difference=8.0):
+        # max_age: frames a classified region is reused for, 0 classifies every frame
+        # the other pipelines keep the defaults of traffic_sign_cache
+        config = dict(traffic_sign_cache, max_age=max_age, position_tolerance=position_tolerance,
+                      size_tolerance=size_tolerance, max_difference=max_difference)
+        self.traffic_cache = RegionCache(**config)
+
 # 交通标志可能存在区域的检测
-    @staticmethod
-    def traffic_detect(img):
+    @pipelinemethod
+    def traffic_detect(self, img):
 
-        if Vilib.detect_obj_parameter['ts_flag']  == True:
+        if self.detect_obj_parameter['ts_flag']  == True:
+            if self.traffic_cache is None:
+                self.traffic_cache = RegionCache(**traffic_sign_cache)
+            traffic_cache = self.traffic_cache
 
             hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)              # 2.从BGR转换到HSV
-            cv2.circle(img, (160,120), 1, (255,255,255), -1)
+            self.overlay.circle((160,120), 1, (255,255,255), -1)
 
             ### red
             mask_red_1 = cv2.inRange(hsv,(157,20,20), (180,255,255))
@@ -857,125 +1263,84 @@ class Vilib(object):
             mask_all = cv2.bitwise_or(mask_red_1, mask_blue)
             mask_all = cv2.bitwise_or(mask_red_2, mask_all)
 
-            open_img = cv2.morphologyEx(mask_all, cv2.MORPH_OPEN,Vilib.kernel_5,iterations=1)              #开运算 
+            open_img = cv2.morphologyEx(mask_all, cv2.MORPH_OPEN,self.kernel_5,iterations=1)              #开运算 
             contours, hierarchy = findContours(open_img)
-            contours = sorted(contours,key = Vilib.cnt_area, reverse=False)
+            contours = sorted(contours,key = self.cnt_area, reverse=False)
             traffic_n = len(contours)
             max_area = 0
             traffic_sign_num = 0
 
             if traffic_n > 0: 
-                for i in contours:    # 遍历所有的轮廓
-                    x,y,w,h = cv2.boundingRect(i)      # 将轮廓分解为识别对象的左上角坐标和宽、高
+                for contour in contours:    # 遍历所有的轮廓
+                    x,y,w,h = cv2.boundingRect(contour)      # 将轮廓分解为识别对象的左上角坐标和宽、高
 
                     # 在图像上画上矩形（图片、左上角坐标、右下角坐标、颜色、线条宽度）
-                    if w > 32 and h > 32: 
-                        acc_val, traffic_type = Vilib.traffic_predict(img,x,y,w,h)
-                        # print(traffic_type,acc_val)
-                        acc_val = round(acc_val*100)
-                        if acc_val >= 75:   
-                            if traffic_type == 1 or traffic_type == 2 or traffic_type == 3:
-                                simple_gray = cv2.cvtColor(img[y:y+h,x:x+w], cv2.COLOR_BGR2GRAY)
-                                # new_mask_blue = cv2.inRange(hsv[y:y+h,x:x+w],(92,70,50), (118,255,255))
-                                circles = cv2.HoughCircles(simple_gray,cv2.HOUGH_GRADIENT,1,32,\
-                                param1=140,param2=70,minRadius=int(w/4.0),maxRadius=max(w,h))
-                               
-                                if circles is not None:
-                                    for i in circles[0,:]:
-                                    # cv2.rectangle(img,(x,y),(x+w,y+h),(0,255,0),2) 
-                                        traffic_sign_coor = (int(x+i[0]),int(y+i[1]))
-                                        cv2.circle(img,traffic_sign_coor,i[2],(255,0,255),2)
-                                        cv2.putText(img,str(traffic_dict[traffic_type]) +': ' + str(round(acc_val)),(int(x+i[0]-i[2]),int(y+i[1]-i[2])), cv2.FONT_HERSHEY_SIMPLEX, 1,(255,0,255),2)#加减10是调整字符位置
-                                        if w * h > max_area:
-                                            max_area = w * h
-                                            max_obj_x = x
-                                            max_obj_y = y
-                                            max_obj_w = w
-                                            max_obj_h = h
-                                            max_obj_t = traffic_type
-                                            max_obj_acc = acc_val
-                                            traffic_sign_num += 1
-
-                            elif traffic_type == 0:
-                                # small_hsv = cv2.cvtColor(resize_img, cv2.COLOR_BGR2HSV)
-                                red_mask_1 = cv2.inRange(hsv[y:y+h,x:x+w],(0,50,20), (4,255,255))           # 3.inRange()：介于lower/upper之间的为白色，其余黑色
-                                red_mask_2 = cv2.inRange(hsv[y:y+h,x:x+w],(163,50,20), (180,255,255))
-                                red_mask_all = cv2.bitwise_or(red_mask_1,red_mask_2)
-
-                                        
-                                # circles = np.uint16(np.around(circles))
-
-                                # ret, new_binary = cv2.threshold(simple_gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
-                                new_binary = cv2.GaussianBlur(red_mask_all, (5, 5), 0)
-
-                                open_img = cv2.morphologyEx(red_mask_all, cv2.MORPH_OPEN,Vilib.kernel_5,iterations=1)              #开运算  
-                                open_img = cv2.dilate(open_img, Vilib.kernel_5,iterations=5) 
-                                blue_contours, hierarchy = findContours(open_img) 
-                                contours_count = len(blue_contours)
-                                if contours_count >=1:
-                                # print("contours:",contours_count)
-                                    blue_contours = sorted(blue_contours,key = Vilib.cnt_area, reverse=True)
-                                
-                                    epsilon = 0.025 * cv2.arcLength(blue_contours[0], True)
-                                    approx = cv2.approxPolyDP(blue_contours[0], epsilon, True)
-
-                                #     # 分析几何形状
-                                    corners = len(approx)
-
-                                    if corners >= 0:
-                                        traffic_sign_coor = (int(x+w/2),int(y+h/2))
-                                        cv2.rectangle(img,(x,y),(x+w,y+h),(255,0,255),2)
-                                        cv2.putText(img,str(traffic_dict[traffic_type]) +': ' + str(round(acc_val)),(x,y), cv2.FONT_HERSHEY_SIMPLEX, 1,(255,0,255),2)#加减10是调整字符位置
-                                        if w * h > max_area:
-                                            max_area = w * h
-                                            max_obj_x = x
-                                            max_obj_y = y
-                                            max_obj_w = w
-                                            max_obj_h = h
-                                            max_obj_t = traffic_type
-                                            max_obj_acc = acc_val
-                                            traffic_sign_num += 1
+                    if w > 32 and h > 32 and self.traffic_sign_plausible(contour, w, h):
+                        # a region classified a few frames ago, at about the same place and looking the same, is not classified again
+                        sign = traffic_cache.get((x,y,w,h), img[y:y+h,x:x+w], self.frame_id,
+                                                 lambda: self.traffic_sign_region(img, hsv, x, y, w, h))
+                        if sign is None:
+                            continue
+                        traffic_type, acc_val, circles = sign
+                        label = str(traffic_dict[traffic_type]) +': ' + str(round(acc_val))
+                        if len(circles) > 0:
+                            for cx, cy, radius in circles:
+                                traffic_sign_coor = (x+cx, y+cy)
+                                self.overlay.circle(traffic_sign_coor,radius,(255,0,255),2)
+                                self.overlay.putText(label,(x+cx-radius,y+cy-radius), cv2.FONT_HERSHEY_SIMPLEX, 1,(255,0,255),2)#加减10是调整字符位置
+                        else:
+                            self.overlay.rectangle((x,y),(x+w,y+h),(255,0,255),2)
+                            self.overlay.putText(label,(x,y), cv2.FONT_HERSHEY_SIMPLEX, 1,(255,0,255),2)#加减10是调整字符位置
+                        if w * h > max_area:
+                            max_area = w * h
+                            max_obj_x = x
+                            max_obj_y = y
+                            max_obj_w = w
+                            max_obj_h = h
+                            max_obj_t = traffic_type
+                            max_obj_acc = acc_val
+                            traffic_sign_num += 1
 
                                         
                 # print("traffic_sign_num:",traffic_sign_num)         
                 if traffic_sign_num > 0:
 
-                    Vilib.detect_obj_parameter['traffic_sign_x'] = int(max_obj_x + max_obj_w/2)
-                    Vilib.detect_obj_parameter['traffic_sign_y'] = int(max_obj_y + max_obj_h/2)
-                    Vilib.detect_obj_parameter['traffic_sign_w'] = max_obj_w
-                    Vilib.detect_obj_parameter['traffic_sign_h'] = max_obj_h
+                    self.detect_obj_parameter['traffic_sign_x'] = int(max_obj_x + max_obj_w/2)
+                    self.detect_obj_parameter['traffic_sign_y'] = int(max_obj_y + max_obj_h/2)
+                    self.detect_obj_parameter['traffic_sign_w'] = max_obj_w
+                    self.detect_obj_parameter['traffic_sign_h'] = max_obj_h
                     # print("traffic_sign_type:",)
-                    Vilib.detect_obj_parameter['traffic_sign_t'] = traffic_dict[max_obj_t]
-                    Vilib.detect_obj_parameter['traffic_sign_acc'] = max_obj_acc
+                    self.detect_obj_parameter['traffic_sign_t'] = traffic_dict[max_obj_t]
+                    self.detect_obj_parameter['traffic_sign_acc'] = max_obj_acc
                 else:
-                    Vilib.detect_obj_parameter['traffic_sign_x'] = 320
-                    Vilib.detect_obj_parameter['traffic_sign_y'] = 240
-                    Vilib.detect_obj_parameter['traffic_sign_w'] = 0
-                    Vilib.detect_obj_parameter['traffic_sign_h'] = 0
-                    Vilib.detect_obj_parameter['traffic_sign_t'] = 'none'
-                    Vilib.detect_obj_parameter['traffic_sign_acc'] = 0
+                    self.detect_obj_parameter['traffic_sign_x'] = 320
+                    self.detect_obj_parameter['traffic_sign_y'] = 240
+                    self.detect_obj_parameter['traffic_sign_w'] = 0
+                    self.detect_obj_parameter['traffic_sign_h'] = 0
+                    self.detect_obj_parameter['traffic_sign_t'] = 'none'
+                    self.detect_obj_parameter['traffic_sign_acc'] = 0
 
         else:
-            Vilib.detect_obj_parameter['traffic_sign_x'] = 320
-            Vilib.detect_obj_parameter['traffic_sign_y'] = 240
-            Vilib.detect_obj_parameter['traffic_sign_w'] = 0
-            Vilib.detect_obj_parameter['traffic_sign_h'] = 0
-            Vilib.detect_obj_parameter['traffic_sign_t'] = 'none'
-            Vilib.detect_obj_parameter['traffic_sign_acc'] = 0
+            self.detect_obj_parameter['traffic_sign_x'] = 320
+            self.detect_obj_parameter['traffic_sign_y'] = 240
+            self.detect_obj_parameter['traffic_sign_w'] = 0
+            self.detect_obj_parameter['traffic_sign_h'] = 0
+            self.detect_obj_parameter['traffic_sign_t'] = 'none'
+            self.detect_obj_parameter['traffic_sign_acc'] = 0
 
         return img
 
 
 # 手掌肤色的区域检测，把图像的区域给手势识别接口做手势识别
-    @staticmethod
-    def gesture_recognition(img):
-        if Vilib.detect_obj_parameter['gs_flag'] == True:
+    @pipelinemethod
+    def gesture_recognition(self, img):
+        if self.detect_obj_parameter['gs_flag'] == True:
 
     ###肤色部分
 
             target_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
             # 首先对样本图像计算2D直方图
-            roi_hsv_hist = cv2.calcHist([Vilib.roi_hsv], [0, 1], None, [180, 256], [0, 180, 0, 255])
+            roi_hsv_hist = cv2.calcHist([self.roi_hsv], [0, 1], None, [180, 256], [0, 180, 0, 255])
             # 对得到的样本2D直方图进行归一化
             # 这样可以方便显示，归一化后的直方图就变成0-255之间的数了
             # cv2.NORM_MINMAX表示对数组所有值进行转换，线性映射到最大最小值之间
@@ -987,113 +1352,113 @@ class Vilib(object):
             disc = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
             dst = cv2.filter2D(dst, -1, disc,dst)
             ret, thresh = cv2.threshold(dst, 1, 255, 0)
-            dilate = cv2.dilate(thresh, Vilib.kernel_5, iterations=3)
+            dilate = cv2.dilate(thresh, self.kernel_5, iterations=3)
                 # 注意由于原图是三通道BGR图像，因此在进行位运算之前，先要把thresh转成三通道
             # thresh = cv2.merge((dilate, dilate, dilate))
                 # 对原图与二值化后的阈值图像进行位运算，得到结果
             # res = cv2.bitwise_and(img, thresh)
             # ycrcb=cv2.cvtColor(img,cv2.COLOR_BGR2YCR_CB)
             # cr_skin = cv2.inRange(ycrcb, (85,124,121), (111,131,128))
-            # open_img = cv2.morphologyEx(cr_skin, cv2.MORPH_OPEN,Vilib.kernel_5,iterations=1)
+            # open_img = cv2.morphologyEx(cr_skin, cv2.MORPH_OPEN,self.kernel_5,iterations=1)
 
             contours, hierarchy = findContours(dilate)
             ges_num = len(contours)
             is_ges = False
             if ges_num > 0:
-                contours = sorted(contours,key = Vilib.cnt_area, reverse=True)
+                contours = sorted(contours,key = self.cnt_area, reverse=True)
                 # for i in range(0,len(contours)):    #遍历所有的轮廓
                 x,y,w,h = cv2.boundingRect(contours[0])      #将轮廓分解为识别对象的左上角坐标和宽、高
                 gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) 
-                faces = Vilib.face_cascade.detectMultiScale(gray[y:y+h,x:x+w], 1.3, 2)
+                faces = self.face_cascade.detectMultiScale(gray[y:y+h,x:x+w], 1.3, 2)
             # print(len(faces))
                 face_len = len(faces)
 
                 # 在图像上画上矩形（图片、左上角坐标、右下角坐标、颜色、线条宽度）
                 if w >= 60 and h >= 60 and face_len == 0:
-                    # acc_val,ges_type = Vilib.gesture_predict(img,x-2.2*w,y-2.8*h,4.4*w,5.6*h) 
-                    acc_val,ges_type = Vilib.gesture_predict(img,x-0.1*w,y-0.2*h,1.1*w,1.2*h) 
+                    # acc_val,ges_type = self.gesture_predict(img,x-2.2*w,y-2.8*h,4.4*w,5.6*h) 
+                    acc_val,ges_type = self.gesture_predict(img,x-0.1*w,y-0.2*h,1.1*w,1.2*h) 
 
                     acc_val = round(acc_val*100,3)
                     if acc_val >= 75:
                         # print(x,y,w,h)
-                        cv2.rectangle(img,(int(x-0.1*w),int(y-0.2*h)),(int(x+1.1*w), int(y+1.2*h)),(0,125,0),2, cv2.LINE_AA)
-                        cv2.rectangle(img,(0,0),(125,27),(204,209,72),-1, cv2.LINE_AA)
-                        cv2.putText(img,ges_dict[ges_type]+': '+str(acc_val) + '%',(0,17),cv2.FONT_HERSHEY_SIMPLEX,0.6,(255,255,255),2)  ##(0,97,240)
-
-                        Vilib.detect_obj_parameter['gesture_x'] = int(x + w/2)
-                        Vilib.detect_obj_parameter['gesture_y'] = int(y + h/2)
-                        Vilib.detect_obj_parameter['gesture_w'] = w
-                        Vilib.detect_obj_parameter['gesture_h'] = h
-                        Vilib.detect_obj_parameter['gesture_t'] = ges_dict[ges_type]
-                        Vilib.detect_obj_parameter['gesture_acc'] = acc_val
+                        self.overlay.rectangle((int(x-0.1*w),int(y-0.2*h)),(int(x+1.1*w), int(y+1.2*h)),(0,125,0),2, cv2.LINE_AA)
+                        self.overlay.rectangle((0,0),(125,27),(204,209,72),-1, cv2.LINE_AA)
+                        self.overlay.putText(ges_dict[ges_type]+': '+str(acc_val) + '%',(0,17),cv2.FONT_HERSHEY_SIMPLEX,0.6,(255,255,255),2)  ##(0,97,240)
+
+                        self.detect_obj_parameter['gesture_x'] = int(x + w/2)
+                        self.detect_obj_parameter['gesture_y'] = int(y + h/2)
+                        self.detect_obj_parameter['gesture_w'] = w
+                        self.detect_obj_parameter['gesture_h'] = h
+                        self.detect_obj_parameter['gesture_t'] = ges_dict[ges_type]
+                        self.detect_obj_parameter['gesture_acc'] = acc_val
                         is_ges = True
           
             if is_ges == False:  
-                Vilib.detect_obj_parameter['gesture_x'] = 320
-                Vilib.detect_obj_parameter['gesture_y'] = 240
-                Vilib.detect_obj_parameter['gesture_w'] = 0
-                Vilib.detect_obj_parameter['gesture_h'] = 0
-                Vilib.detect_obj_parameter['gesture_t'] = 'none'
-                Vilib.detect_obj_parameter['gesture_acc'] = 0
+                self.detect_obj_parameter['gesture_x'] = 320
+                self.detect_obj_parameter['gesture_y'] = 240
+                self.detect_obj_parameter['gesture_w'] = 0
+                self.detect_obj_parameter['gesture_h'] = 0
+                self.detect_obj_parameter['gesture_t'] = 'none'
+                self.detect_obj_parameter['gesture_acc'] = 0
 
         return img
 
 
 # 人脸检测
-    @staticmethod
-    def human_detect_func(img):
-        if Vilib.detect_obj_parameter['hdf_flag'] == True:
+    @pipelinemethod
+    def human_detect_func(self, img):
+        if self.detect_obj_parameter['hdf_flag'] == True:
             resize_img = cv2.resize(img, (320,240), interpolation=cv2.INTER_LINEAR)            # 2.从BGR转换到RAY
             gray = cv2.cvtColor(resize_img, cv2.COLOR_BGR2GRAY) 
-            faces = Vilib.face_cascade.detectMultiScale(gray, 1.3, 2)
+            faces = self.face_cascade.detectMultiScale(gray, 1.3, 2)
             # print(len(faces))
-            Vilib.detect_obj_parameter['human_n'] = len(faces)
+            self.detect_obj_parameter['human_n'] = len(faces)
             max_area = 0
-            if Vilib.detect_obj_parameter['human_n'] > 0:
+            if self.detect_obj_parameter['human_n'] > 0:
                 for (x,y,w,h) in faces:
                     x = x*2
                     y = y*2
                     w = w*2
                     h = h*2
-                    cv2.rectangle(img,(x,y),(x+w,y+h),(255,0,0),2)
+                    self.overlay.rectangle((x,y),(x+w,y+h),(255,0,0),2)
                     object_area = w*h
                     if object_area > max_area: 
                         object_area = max_area
-                        Vilib.detect_obj_parameter['human_x'] = int(x + w/2)
-                        Vilib.detect_obj_parameter['human_y'] = int(y + h/2)
-                        Vilib.detect_obj_parameter['human_w'] = w
-                        Vilib.detect_obj_parameter['human_h'] = h
+                        self.detect_obj_parameter['human_x'] = int(x + w/2)
+                        self.detect_obj_parameter['human_y'] = int(y + h/2)
+                        self.detect_obj_parameter['human_w'] = w
+                        self.detect_obj_parameter['human_h'] = h
             else:
-                Vilib.detect_obj_parameter['human_x'] = 320
-                Vilib.detect_obj_parameter['human_y'] = 240
-                Vilib.detect_obj_parameter['human_w'] = 0
-                Vilib.detect_obj_parameter['human_h'] = 0
-                Vilib.detect_obj_parameter['human_n'] = 0
+                self.detect_obj_parameter['human_x'] = 320
+                self.detect_obj_parameter['human_y'] = 240
+                self.detect_obj_parameter['human_w'] = 0
+                self.detect_obj_parameter['human_h'] = 0
+                self.detect_obj_parameter['human_n'] = 0
             return img
         else:
             return img
 
 # 颜色识别
 
-    @staticmethod
-    def color_detect_func(img):
+    @pipelinemethod
+    def color_detect_func(self, img):
 
         # 蓝色的范围，不同光照条件下不一样，可灵活调整   H：色度，S：饱和度 v:明度
-        if Vilib.detect_obj_parameter['cdf_flag']  == True:
+        if self.detect_obj_parameter['cdf_flag']  == True:
             resize_img = cv2.resize(img, (160,120), interpolation=cv2.INTER_LINEAR)
             hsv = cv2.cvtColor(resize_img, cv2.COLOR_BGR2HSV)              # 2.从BGR转换到HSV
-            color_type = Vilib.detect_obj_parameter['color_default']
-            mask = cv2.inRange(hsv,np.array([min(Vilib.color_dict[color_type]), 60, 60]), np.array([max(Vilib.color_dict[color_type]), 255, 255]) )           # 3.inRange()：介于lower/upper之间的为白色，其余黑色
+            color_type = self.detect_obj_parameter['color_default']
+            mask = cv2.inRange(hsv,np.array([min(self.color_dict[color_type]), 60, 60]), np.array([max(self.color_dict[color_type]), 255, 255]) )           # 3.inRange()：介于lower/upper之间的为白色，其余黑色
             if color_type == 'red':
                  mask_2 = cv2.inRange(hsv, (167,0,0), (180,255,255))
                  mask = cv2.bitwise_or(mask, mask_2)
 
-            open_img = cv2.morphologyEx(mask, cv2.MORPH_OPEN,Vilib.kernel_5,iterations=1)              #开运算  
+            open_img = cv2.morphologyEx(mask, cv2.MORPH_OPEN,self.kernel_5,iterations=1)              #开运算  
             ####在binary中发现轮廓，轮廓按照面积从小到大排列
             contours, hierarchy = findContours(open_img)      
-            Vilib.detect_obj_parameter['color_n'] = len(contours)
+            self.detect_obj_parameter['color_n'] = len(contours)
             max_area = 0
-            if Vilib.detect_obj_parameter['color_n'] > 0: 
+            if self.detect_obj_parameter['color_n'] > 0: 
                 for i in contours:    #遍历所有的轮廓
                     x,y,w,h = cv2.boundingRect(i)      #将轮廓分解为识别对象的左上角坐标和宽、高
                     # 在图像上画上矩形（图片、左上角坐标、右下角坐标、颜色、线条宽度）
@@ -1102,32 +1467,32 @@ class Vilib(object):
                         y = y*4
                         w = w*4
                         h = h*4
-                        cv2.rectangle(img,(x,y),(x+w,y+h),(0,255,0),2)
+                        self.overlay.rectangle((x,y),(x+w,y+h),(0,255,0),2)
                         # 给识别对象写上标号
-                        cv2.putText(img,color_type,(x,y), cv2.FONT_HERSHEY_SIMPLEX, 1,(0,0,255),2)#加减10是调整字符位置
+                        self.overlay.putText(color_type,(x,y), cv2.FONT_HERSHEY_SIMPLEX, 1,(0,0,255),2)#加减10是调整字符位置
  
                         object_area = w*h
                         if object_area > max_area: 
                             max_area = object_area
-                            Vilib.detect_obj_parameter['color_x'] = int(x + w/2)
-                            Vilib.detect_obj_parameter['color_y'] = int(y + h/2)
-                            Vilib.detect_obj_parameter['color_w'] = w
-                            Vilib.detect_obj_parameter['color_h'] = h
+                            self.detect_obj_parameter['color_x'] = int(x + w/2)
+                            self.detect_obj_parameter['color_y'] = int(y + h/2)
+                            self.detect_obj_parameter['color_w'] = w
+                            self.detect_obj_parameter['color_h'] = h
                             # print()
             else:
-                Vilib.detect_obj_parameter['color_x'] = 320
-                Vilib.detect_obj_parameter['color_y'] = 240
-                Vilib.detect_obj_parameter['color_w'] = 0
-                Vilib.detect_obj_parameter['color_h'] = 0
-                Vilib.detect_obj_parameter['color_n'] = 0
+                self.detect_obj_parameter['color_x'] = 320
+                self.detect_obj_parameter['color_y'] = 240
+                self.detect_obj_parameter['color_w'] = 0
+                self.detect_obj_parameter['color_h'] = 0
+                self.detect_obj_parameter['color_n'] = 0
             return img
         else:
             return img
 
 # 二维码识别
-    @staticmethod
-    def qrcode_detect_func(img):
-        if Vilib.detect_obj_parameter['qr_flag']  == True:
+    @pipelinemethod
+    def qrcode_detect_func(self, img):
+        if self.detect_obj_parameter['qr_flag']  == True:
             barcodes = pyzbar.decode(img)
             # 循环检测到的条形码
             if len(barcodes) > 0:
@@ -1135,7 +1500,7 @@ class Vilib(object):
                     # 提取条形码的边界框的位置
                     # 画出图像中条形码的边界框
                     (x, y, w, h) = barcode.rect
-                    cv2.rectangle(img, (x, y), (x + w, y + h), (0, 0, 255), 2)
+                    self.overlay.rectangle((x, y), (x + w, y + h), (0, 0, 255), 2)
 
                     # 条形码数据为字节对象，所以如果我们想在输出图像上
                     # 画出来，就需要先将它转换成字符串
@@ -1146,50 +1511,50 @@ class Vilib(object):
                     # text = "{} ({})".format(barcodeData, barcodeType)
                     text = "{}".format(barcodeData)
                     if len(text) > 0:
-                        Vilib.detect_obj_parameter['qr_data'] = text
-                        Vilib.detect_obj_parameter['qr_h'] = h
-                        Vilib.detect_obj_parameter['qr_w'] = w
-                        Vilib.detect_obj_parameter['qr_x'] = x 
-                        Vilib.detect_obj_parameter['qr_y'] = y
-                    # print("Vilib.qr_date:%s"%Vilib.qr_date)
-                    cv2.putText(img, text, (x - 20, y - 10), cv2.FONT_HERSHEY_SIMPLEX,
+                        self.detect_obj_parameter['qr_data'] = text
+                        self.detect_obj_parameter['qr_h'] = h
+                        self.detect_obj_parameter['qr_w'] = w
+                        self.detect_obj_parameter['qr_x'] = x 
+                        self.detect_obj_parameter['qr_y'] = y
+                    # print("self.qr_date:%s"%self.qr_date)
+                    self.overlay.putText(text, (x - 20, y - 10), cv2.FONT_HERSHEY_SIMPLEX,
                                 0.5, (0, 0, 255), 2)
             else:
-                Vilib.detect_obj_parameter['qr_data'] = "None"
-                Vilib.detect_obj_parameter['qr_x'] = 320
-                Vilib.detect_obj_parameter['qr_y'] = 240
-                Vilib.detect_obj_parameter['qr_w'] = 0
-                Vilib.detect_obj_parameter['qr_h'] = 0
+                self.detect_obj_parameter['qr_data'] = "None"
+                self.detect_obj_parameter['qr_x'] = 320
+                self.detect_obj_parameter['qr_y'] = 240
+                self.detect_obj_parameter['qr_w'] = 0
+                self.detect_obj_parameter['qr_h'] = 0
             return img
         else:
             return img
 
 # 颜色识别 2
-    @staticmethod
-    def new_color_detect_func(img,color):
-        Vilib.detect_color_name(color)
+    @pipelinemethod
+    def new_color_detect_func(self, img,color):
+        self.detect_color_name(color)
 
         # 蓝色的范围，不同光照条件下不一样，可灵活调整   H：色度，S：饱和度 v:明度
-        if Vilib.detect_obj_parameter['cdf_flag']  == True:
+        if self.detect_obj_parameter['cdf_flag']  == True:
             resize_img = cv2.resize(img, (160,120), interpolation=cv2.INTER_LINEAR)
             hsv = cv2.cvtColor(resize_img, cv2.COLOR_BGR2HSV)              # 2.从BGR转换到HSV
-            # print(Vilib.lower_color)
-            color_type = Vilib.detect_obj_parameter['color_default']
+            # print(self.lower_color)
+            color_type = self.detect_obj_parameter['color_default']
             
-            mask = cv2.inRange(hsv,np.array([min(Vilib.color_dict[color_type]), 60, 60]), np.array([max(Vilib.color_dict[color_type]), 255, 255]) )           # 3.inRange()：介于lower/upper之间的为白色，其余黑色
+            mask = cv2.inRange(hsv,np.array([min(self.color_dict[color_type]), 60, 60]), np.array([max(self.color_dict[color_type]), 255, 255]) )           # 3.inRange()：介于lower/upper之间的为白色，其余黑色
             if color_type == 'red':
                  mask_2 = cv2.inRange(hsv, (167,0,0), (180,255,255))
                  mask = cv2.bitwise_or(mask, mask_2)
 
-            open_img = cv2.morphologyEx(mask, cv2.MORPH_OPEN,Vilib.kernel_5,iterations=1)              #开运算  
+            open_img = cv2.morphologyEx(mask, cv2.MORPH_OPEN,self.kernel_5,iterations=1)              #开运算  
 
             ####在binary中发现轮廓，轮廓按照面积从小到大排列
             contours, hierarchy = cv2.findContours(open_img)      
 
-            Vilib.detect_obj_parameter['color_n'] = len(contours)
+            self.detect_obj_parameter['color_n'] = len(contours)
             max_area = 0
 
-            if Vilib.detect_obj_parameter['color_n'] > 0: 
+            if self.detect_obj_parameter['color_n'] > 0: 
                 for i in contours:    #遍历所有的轮廓
                     x,y,w,h = cv2.boundingRect(i)      #将轮廓分解为识别对象的左上角坐标和宽、高
 
@@ -1206,77 +1571,87 @@ class Vilib(object):
                         object_area = w*h
                         if object_area > max_area: 
                             max_area = object_area
-                            Vilib.detect_obj_parameter['color_x'] = int(x + w/2)
-                            Vilib.detect_obj_parameter['color_y'] = int(y + h/2)
-                            Vilib.detect_obj_parameter['color_w'] = w
-                            Vilib.detect_obj_parameter['color_h'] = h
+                            self.detect_obj_parameter['color_x'] = int(x + w/2)
+                            self.detect_obj_parameter['color_y'] = int(y + h/2)
+                            self.detect_obj_parameter['color_w'] = w
+                            self.detect_obj_parameter['color_h'] = h
                             # print()
             else:
-                Vilib.detect_obj_parameter['color_x'] = 320
-                Vilib.detect_obj_parameter['color_y'] = 240
-                Vilib.detect_obj_parameter['color_w'] = 0
-                Vilib.detect_obj_parameter['color_h'] = 0
-                Vilib.detect_obj_parameter['color_n'] = 0
+                self.detect_obj_parameter['color_x'] = 320
+                self.detect_obj_parameter['color_y'] = 240
+                self.detect_obj_parameter['color_w'] = 0
+                self.detect_obj_parameter['color_h'] = 0
+                self.detect_obj_parameter['color_n'] = 0
             return img
         else:
             return img
 
 
 # 开启摄像头
-    @staticmethod
-    def camera_start(vflip=False, hflip=False):
-        Vilib.detect_obj_parameter['camera_vflip'] = vflip
-        Vilib.detect_obj_parameter['camera_hflip'] = hflip       
-        Vilib.detect_obj_parameter['camera_start_flag'] = True
-        Vilib.camera_thread = threading.Thread(target=Vilib.camera_clone, name="camera_satrt")
-        Vilib.camera_thread.start()
+    @pipelinemethod
+    def camera_start(self, vflip=False, hflip=False, still_resolution=None):
+        # still_resolution: e.g. (2592,1944) for full resolution photos, the video stays 640x480
+        self.detect_obj_parameter['camera_vflip'] = vflip
+        self.detect_obj_parameter['camera_hflip'] = hflip       
+        self.detect_obj_parameter['still_resolution'] = still_resolution
+        self.detect_obj_parameter['camera_start_flag'] = True
+        self.camera_thread = threading.Thread(target=self.camera_clone, name="camera_satrt")
+        self.camera_thread.start()
 
 # 关闭摄像头
-    @staticmethod
-    def camera_close(): 
-        if Vilib.camera_thread != None:
-            Vilib.detect_obj_parameter['camera_start_flag'] = False
+    @pipelinemethod
+    def camera_close(self): 
+        if self.camera_thread != None:
+            self.detect_obj_parameter['camera_start_flag'] = False
             time.sleep(0.1)
 
 # 开启摄像头网络传输
-    @staticmethod
-    def camera_flask():           
-        Vilib.detect_obj_parameter['web_display_flag'] = True
+    @pipelinemethod
+    def camera_flask(self):           
+        self.detect_obj_parameter['web_display_flag'] = True
 
 # close flask
-    @staticmethod
-    def web_display_close(): 
-        Vilib.detect_obj_parameter['web_display_flag'] = False
+    @pipelinemethod
+    def web_display_close(self): 
+        self.detect_obj_parameter['web_display_flag'] = False
 
 
 # 1. 显示在树莓派桌面，在浏览器输入蜘蛛的IP地址可以看到画面
-    @staticmethod
-    def display(local=True,web=True):
+    @pipelinemethod
+    def display(self, local=True,web=True):
         # cheack camera thread is_alive
-        if Vilib.camera_thread != None and Vilib.camera_thread.is_alive():
+        if self.camera_thread != None and self.camera_thread.is_alive():
             # check gui
             if local == True:
                 # if os.path.exists('/usr/share/xsessions/'):
                 #     os.environ['XAUTHORITY'] = '%s/.Xauthority'%user_home
                 #     os.environ['DISPLAY'] = ':0.0'
-                #     Vilib.detect_obj_parameter['imshow_flag'] = True  
+                #     self.detect_obj_parameter['imshow_flag'] = True  
                 #     print("imshow start ...")   
                 if 'DISPLAY' in os.environ.keys():
-                    Vilib.detect_obj_parameter['imshow_flag'] = True  
+                    self.detect_obj_parameter['imshow_flag'] = True  
                     print("imshow start ...")
                 else:
-                    Vilib.detect_obj_parameter['imshow_flag'] = False 
+                    self.detect_obj_parameter['imshow_flag'] = False 
                     print("local display failed, because there is no gui.") 
     
             # web video
             if web == True:
-                Vilib.detect_obj_parameter['web_display_flag'] = True 
+                self.detect_obj_parameter['web_display_flag'] = True 
         else:
             print('Error: Please execute < camera_start() > first.')
 
 # 2. 拍照保存
-    @staticmethod
-    def take_photo(photo_name,path=Default_Pictures_Path):
+    @pipelinemethod
+    def take_photo(self, photo_name,path=Default_Pictures_Path,still=False,timeout=5,raw=False):
+        # still=True saves a still from the still port (still_resolution of camera_start),
+        # otherwise the current video frame, raw=True without the annotations
+        if still == True:
+            done = threading.Event()
+            self.still_queue.put((path + '/' + photo_name + '.jpg', False, done))
+            if not done.wait(timeout):
+                print('Photo save failed .. ')
+            return
         # check path
         while not os.path.exists(path):
             # print('Path does not exist. Creating path now ... ')
@@ -1285,12 +1660,13 @@ class Vilib(object):
                         exist_ok=True
             )
             time.sleep(0.01) 
-        # save photo
-        img =  Vilib.img_array[0]      
+        # save photo, the jpg the web stream encoded of the frame if there is one
+        img =  self.outputs.get(raw)
         for _ in range(5):
             if img is  not None:
-                cv2.imwrite(path + '/' + photo_name +'.jpg',img )
-                Vilib.detect_obj_parameter['picture_flag'] = False
+                with open(path + '/' + photo_name +'.jpg', 'wb') as f:
+                    f.write(self.outputs.encoded('.jpg', raw)[0])
+                self.detect_obj_parameter['picture_flag'] = False
                 # print('The photo is saved as '+path+'/'+photo_name+'.jpg')
                 break
             else:
@@ -1308,6 +1684,7 @@ class Vilib(object):
     rec_video_set["fps"] = 20.0
     rec_video_set["framesize"] = (640,480)
     rec_video_set["isColor"] = True
+    rec_video_set["raw"] = False        # True records the frames without the annotations
 
     rec_video_set["name"] = "default"
     rec_video_set["path"] = Default_Videos_Path
@@ -1315,155 +1692,395 @@ class Vilib(object):
     rec_video_set["start_flag"] = False
     rec_video_set["stop_flag"] =  False   
 
-    @staticmethod
-    def rec_video_work():
-        while not os.path.exists(Vilib.rec_video_set["path"]):
+    @pipelinemethod
+    def rec_video_work(self):
+        while not os.path.exists(self.rec_video_set["path"]):
             # print('Path does not exist. Creating path now ... ')
-            os.makedirs(name=Vilib.rec_video_set["path"],
+            os.makedirs(name=self.rec_video_set["path"],
                         mode=0o777,
                         exist_ok=True
             )
             time.sleep(0.01)
-        video_out = cv2.VideoWriter(Vilib.rec_video_set["path"]+'/'+Vilib.rec_video_set["name"]+'.avi',
-                                    Vilib.rec_video_set["fourcc"], Vilib.rec_video_set["fps"], 
-                                    Vilib.rec_video_set["framesize"], Vilib.rec_video_set["isColor"])
+        video_out = cv2.VideoWriter(self.rec_video_set["path"]+'/'+self.rec_video_set["name"]+'.avi',
+                                    self.rec_video_set["fourcc"], self.rec_video_set["fps"], 
+                                    self.rec_video_set["framesize"], self.rec_video_set["isColor"])
     
         while True:          
-            if Vilib.rec_video_set["start_flag"] == True:
-                video_out.write(Vilib.img_array[0])          
-            if Vilib.rec_video_set["stop_flag"] == True:
+            if self.rec_video_set["start_flag"] == True:
+                video_out.write(self.outputs.get(self.rec_video_set["raw"]))
+            if self.rec_video_set["stop_flag"] == True:
                 video_out.release() # note need to release the video writer
-                Vilib.rec_video_set["start_flag"] == False
+                self.rec_video_set["start_flag"] == False
                 break
 
 
     rec_thread = None
-    @staticmethod
-    def rec_video_run():
-        if Vilib.rec_thread != None:
-            Vilib.rec_video_stop()
-        Vilib.rec_video_set["stop_flag"] = False
-        Vilib.rec_thread = threading.Thread(name='rec_video', target=Vilib.rec_video_work)
-        Vilib.rec_thread.setDaemon(True)
-        Vilib.rec_thread.start()
-
-    @staticmethod
-    def rec_video_start():
-        Vilib.rec_video_set["start_flag"] = True 
-        Vilib.rec_video_set["stop_flag"] = False
-
-    @staticmethod
-    def rec_video_pause():
-        Vilib.rec_video_set["start_flag"] = False
-
-    @staticmethod
-    def rec_video_stop():
-        Vilib.rec_video_set["start_flag"] == False
-        Vilib.rec_video_set["stop_flag"] = True
-        if Vilib.rec_thread != None:
-            Vilib.rec_thread.join(3)
-            Vilib.rec_thread = None 
+    @pipelinemethod
+    def rec_video_run(self):
+        if self.rec_thread != None:
+            self.rec_video_stop()
+        self.rec_video_set["stop_flag"] = False
+        self.rec_thread = threading.Thread(name='rec_video', target=self.rec_video_work)
+        self.rec_thread.setDaemon(True)
+        self.rec_thread.start()
+
+    @pipelinemethod
+    def rec_video_start(self):
+        self.rec_video_set["start_flag"] = True 
+        self.rec_video_set["stop_flag"] = False
+
+    @pipelinemethod
+    def rec_video_pause(self):
+        self.rec_video_set["start_flag"] = False
+
+    @pipelinemethod
+    def rec_video_stop(self):
+        self.rec_video_set["start_flag"] == False
+        self.rec_video_set["stop_flag"] = True
+        if self.rec_thread != None:
+            self.rec_thread.join(3)
+            self.rec_thread = None 
 
                         
 # 4.颜色识别 
-    @staticmethod 
-    def color_detect(color="red"):
-        Vilib.detect_color_name(color)
-        #Vilib.color_detect_switch(True)
+    @pipelinemethod
+    def color_detect(self, color="red"):
+        self.detect_color_name(color)
+        #self.color_detect_switch(True)
     
 # 5.人脸检测
-    @staticmethod   
-    def face_detect_switch(flag=False):
-        Vilib.human_detect_switch(flag)
+    @pipelinemethod
+    def face_detect_switch(self, flag=False):
+        self.human_detect_switch(flag)
 
 
 # 二维码  # 
-    @staticmethod
-    def qr_coder_reader():
-        #Vilib.qrcode_detect_switch(True)
-        text = Vilib.detect_obj_parameter['qr_data']
+    @pipelinemethod
+    def qr_coder_reader(self):
+        #self.qrcode_detect_switch(True)
+        text = self.detect_obj_parameter['qr_data']
         return text
 
 # objects detection
-    @staticmethod
-    def object_detect_switch(flag=False):
-        Vilib.detect_obj_parameter['odf_flag'] = flag
+    @pipelinemethod
+    def object_detect_switch(self, flag=False):
+        self.detect_obj_parameter['odf_flag'] = flag
 
-    @staticmethod
-    def object_detect_set_model(path):
+    @pipelinemethod
+    def object_detect_set_model(self, path):
         global objects_detection_model
         if not os.path.exists(path):
             raise ValueError('incorrect model path ')    
         objects_detection_model = path
 
-    @staticmethod
-    def object_detect_set_labels(path):
+    @pipelinemethod
+    def object_detect_set_labels(self, path):
         global objects_detection_labels
         if not os.path.exists(path):
             raise ValueError('incorrect labels path ')    
         objects_detection_labels = path
 
-    @staticmethod
-    def object_detect_fuc(img):
-        if Vilib.detect_obj_parameter['odf_flag'] == True:
+    # filter of the detected objects, objects_detection_filter until set, classes resolved to class ids
+    objects_filter = None
+    @pipelinemethod
+    def object_detect_set_filter(self, threshold=0.4, classes=None, max_detections=None, nms_iou=None):
+        # classes: allow-list of label names or class ids, None for all classes,
+        #   resolved with the current labels (object_detect_set_labels() first),
+        #   raises ValueError for a name or id that is not in them
+        # nms_iou: IoU threshold of the cross-class NMS, None to disable it
+        from .objects_detection import load_labels_cached, class_ids_of
+        labels = load_labels_cached(objects_detection_labels) if os.path.exists(objects_detection_labels) else {}
+        self.objects_filter = {'threshold': threshold, 'classes': class_ids_of(classes, labels),
+                               'max_detections': max_detections, 'nms_iou': nms_iou}
+
+    @pipelinemethod
+    def object_detect_fuc(self, img):
+        if self.detect_obj_parameter['odf_flag'] == True:
             # print('detect_objects starting')
-            from .objects_detection import detect_objects
-            img = detect_objects(image=img,model=objects_detection_model,labels=objects_detection_labels)   
+            from .objects_detection import detect, put_text
+            objects_filter = self.objects_filter if self.objects_filter != None else objects_detection_filter
+            results, labels = detect(image=img,model=objects_detection_model,labels=objects_detection_labels,**objects_filter)
+            boxes, class_ids, scores = results
+            self.detect_obj_parameter['object_boxes'] = boxes
+            self.detect_obj_parameter['object_classes'] = class_ids
+            self.detect_obj_parameter['object_scores'] = scores
+            self.detect_obj_parameter['object_n'] = len(scores)
+            if len(scores) > 0:
+                height, width = img.shape[:2]
+                ymin, xmin, ymax, xmax = boxes[0]   # highest score
+                self.detect_obj_parameter['object_x'] = int((xmin + xmax) / 2 * width)
+                self.detect_obj_parameter['object_y'] = int((ymin + ymax) / 2 * height)
+                self.detect_obj_parameter['object_w'] = int((xmax - xmin) * width)
+                self.detect_obj_parameter['object_h'] = int((ymax - ymin) * height)
+                self.detect_obj_parameter['object_t'] = labels[int(class_ids[0])]
+                put_text(img,results,labels,width,height,overlay=self.overlay)
+            else:
+                self.detect_obj_parameter['object_x'] = 320
+                self.detect_obj_parameter['object_y'] = 240
+                self.detect_obj_parameter['object_w'] = 0
+                self.detect_obj_parameter['object_h'] = 0
+                self.detect_obj_parameter['object_t'] = 'None'
         return img   
       
+# binary detection log
+    detection_log = None
+    @pipelinemethod
+    def detection_log_start(self, path=None, detectors=None, max_bytes=64*1024*1024):
+        # logs the results of the switched-on detectors every frame, read it back with
+        # vilib.detection_log.load_session(path)
+        from .detection_log import DetectionLog
+        if path == None:
+            path = Default_Logs_Path + self.name + '_' + datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        self.detection_log_stop()
+        self.detection_log = DetectionLog(path, detectors, max_bytes)
+        return path
+
+    @pipelinemethod
+    def detection_log_stop(self):
+        if self.detection_log != None:
+            self.detection_log.close()
+            self.detection_log = None
+
+# binary result datagrams
+    result_publisher = None
+    @pipelinemethod
+    def result_publisher_start(self, endpoints=(('127.0.0.1', 5005),), detectors=None):
+        # sends the results of the switched-on detectors every frame to the endpoints,
+        # (host, port) for UDP or the path of a Unix datagram socket, see
+        # vilib.result_datagrams for the packet layout and parse_packet()
+        from .result_datagrams import ResultPublisher
+        self.result_publisher_stop()
+        self.result_publisher = ResultPublisher(endpoints, detectors)
+
+    @pipelinemethod
+    def result_publisher_stop(self):
+        if self.result_publisher != None:
+            publisher, self.result_publisher = self.result_publisher, None
+            publisher.close()
+
+# session recording and replay
+    session_recorder = None
+    @pipelinemethod
+    def session_record_start(self, path=None, results=True, fourcc='FFV1'):
+        # records the processed frames, their timestamps and the switch changes,
+        # replay it with vilib.replay.replay_session(path)
+        # fourcc: codec of the video, lossless by default, raises ValueError if OpenCV cannot write it
+        from .replay import SessionRecorder
+        if path == None:
+            path = Default_Logs_Path + 'session_' + self.name + '_' + datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        self.session_record_stop()
+        self.session_recorder = SessionRecorder(path, REPLAY_CONTROL_KEYS, fourcc=fourcc)
+        if results == True:
+            self.detection_log_start(os.path.join(path, 'results'))
+        return path
+
+    @pipelinemethod
+    def session_record_stop(self):
+        if self.session_recorder != None:
+            recorder = self.session_recorder
+            self.session_recorder = None
+            recorder.close()
+            if self.detection_log != None and self.detection_log.path == os.path.join(recorder.path, 'results'):
+                self.detection_log_stop()
+
+    @pipelinemethod
+    def replay_set(self, key, value):
+        # sets a recorded switch, detectors with models of their own are switched properly
+        if key == 'gdf_flag':
+            if value != self.detect_obj_parameter['gdf_flag']:
+                self.hands_detect_switch(value)
+        elif key == 'pdf_flag':
+            if value != self.detect_obj_parameter['pdf_flag']:
+                self.pose_detect_switch(value)
+        elif key == 'color_default':
+            flag = self.detect_obj_parameter['cdf_flag']
+            self.detect_color_name(value)
+            self.detect_obj_parameter['cdf_flag'] = flag
+        else:
+            self.detect_obj_parameter[key] = value
+
+# per-frame span tracing
+    @pipelinemethod
+    def trace_start(self, capacity=20000):
+        # keeps the last `capacity` spans in memory
+        tracer.clear()
+        tracer.start(capacity)
+
+    @pipelinemethod
+    def trace_stop(self):
+        tracer.stop()
+
+    @pipelinemethod
+    def trace_dump(self, path):
+        # Chrome trace JSON, open it in chrome://tracing or ui.perfetto.dev
+        return tracer.dump(path)
+
+# tflite models
+    @pipelinemethod
+    def model_config(self, name, num_threads=None, delegate=None, warmup=1):
+        # name: 'traffic_sign', 'gesture', 'objects_detection' or 'image_classification'
+        # delegate: None, 'xnnpack' or the path of a delegate library
+        # a loaded model is built again with the new options the next time it runs
+        model_registry.configure(name, num_threads=num_threads, delegate=delegate, warmup=warmup)
+
+    @pipelinemethod
+    def inference_config(self, max_batch=4, max_wait=0.0):
+        # shared by all the cameras: up to max_batch queued requests of a model run in one invoke,
+        # max_wait > 0 holds a request that many seconds for requests of the other cameras
+        inference_pool.configure(max_batch, max_wait)
+
+    @pipelinemethod
+    def model_stats(self):
+        # load time, tensor arena size and mean invoke latency of the loaded models
+        return model_registry.stats()
+
 # image classification
-    @staticmethod
-    def image_classify_switch(flag=False):
-        Vilib.detect_obj_parameter['icf_flag'] = flag
+    @pipelinemethod
+    def image_classify_switch(self, flag=False):
+        self.detect_obj_parameter['icf_flag'] = flag
 
-    @staticmethod
-    def image_classify_set_model(path):
+    @pipelinemethod
+    def image_classify_set_model(self, path):
         global image_classification_model
         if not os.path.exists(path):
             raise ValueError('incorrect model path ')          
         image_classification_model = path
 
-    @staticmethod
-    def image_classify_set_labels(path):
+    @pipelinemethod
+    def image_classify_set_labels(self, path):
         global image_classification_labels
         if not os.path.exists(path):
             raise ValueError('incorrect labels path ')  
         image_classification_labels = path
 
-    @staticmethod
-    def image_classify_fuc(img):
-        if Vilib.detect_obj_parameter['icf_flag'] == True:
+    # PerceptualCaches of the image classification and gesture scores, created on first use
+    classify_cache = None
+    gesture_cache = None
+    @pipelinemethod
+    def classification_cache_config(self, max_entries=64, max_distance=4, ttl=2.0):
+        # max_distance: differing bits of the 64 bit hashes still counted as the same image
+        # ttl: seconds of capture time cached scores are reused, 0 classifies every frame
+        # the other pipelines keep the defaults of classification_cache
+        config = dict(classification_cache, max_entries=max_entries, max_distance=max_distance, ttl=ttl)
+        self.classify_cache = PerceptualCache(**config)
+        self.gesture_cache = PerceptualCache(**config)
+
+    @pipelinemethod
+    def cache_stats(self):
+        # {cache: {hits, misses, hit_rate, ...}} of the result caches in use
+        caches = {'image_classification': self.classify_cache, 'gesture': self.gesture_cache}
+        stats = {name: cache.stats() for name, cache in caches.items() if cache != None}
+        if self.traffic_cache != None:
+            stats['traffic_sign'] = {'hits': self.traffic_cache.hits, 'misses': self.traffic_cache.misses,
+                                     'hit_rate': round(self.traffic_cache.hit_rate, 3), 'entries': len(self.traffic_cache.entries)}
+        return stats
+
+    @pipelinemethod
+    def image_classify_fuc(self, img):
+        if self.detect_obj_parameter['icf_flag'] == True:
             # print('classify_image starting')
             from .image_classification import classify_image
-            img = classify_image(image=img,model=image_classification_model,labels=image_classification_labels)   
+            if self.classify_cache is None:
+                self.classify_cache = PerceptualCache(**classification_cache)
+            classify_image(image=img,model=image_classification_model,labels=image_classification_labels,overlay=self.overlay,
+                           cache=self.classify_cache,params=self.detect_obj_parameter,timestamp=self.frame_timestamp)
+        else:
+            self.detect_obj_parameter['image_classify_t'] = 'None'
+            self.detect_obj_parameter['image_classify_acc'] = 0
         return img   
 
 # gesture detection
-    @staticmethod
-    def hands_detect_switch(flag=False):
-        from .hands_detection import DetectHands
-        Vilib.detect_hands = DetectHands()
-        Vilib.detect_obj_parameter['gdf_flag'] = flag
-
-    @staticmethod
-    def hands_detect_fuc(img):
-        if Vilib.detect_obj_parameter['gdf_flag'] == True:
-            img,Vilib.detect_obj_parameter['hands_joints'] =  Vilib.detect_hands.work(image=img)   
+    hands_worker = None
+    @pipelinemethod
+    def hands_detect_switch(self, flag=False, worker=False, max_num_hands=1, model_complexity=None, process_size=None):
+        # worker=True runs mediapipe in a child process, results arrive a few frames late
+        # model_complexity 0 and a smaller process_size (e.g. (320,240)) trade accuracy for frame rate
+        if self.hands_worker != None:
+            self.hands_worker.close()
+            self.hands_worker = None
+        if flag == True:
+            options = dict(max_num_hands=max_num_hands, model_complexity=model_complexity, process_size=process_size)
+            if worker == True:
+                from .mediapipe_worker import MediapipeWorker
+                self.hands_worker = MediapipeWorker('hands', **options)
+            else:
+                from .hands_detection import DetectHands
+                self.detect_hands = DetectHands(**options)
+        self.detect_obj_parameter['gdf_flag'] = flag
+
+    @pipelinemethod
+    def hands_detect_fuc(self, img):
+        if self.detect_obj_parameter['gdf_flag'] == True:
+            if self.hands_worker != None:
+                from .hands_detection import draw_joints
+                self.hands_worker.poll()
+                self.hands_worker.submit(img, self.frame_timestamp)
+                self.detect_obj_parameter['hands_joints'] = self.hands_worker.joints
+                self.detect_obj_parameter['hands_joints_age'] = self.hands_worker.age
+                draw_joints(img, self.hands_worker.joints, overlay=self.overlay)
+            else:
+                from .hands_detection import draw_joints
+                joints = self.detect_hands.detect(img)
+                # a copy, detect() overwrites its buffer with the next frame
+                self.detect_obj_parameter['hands_joints'] = joints.copy() if joints is not None else None
+                self.detect_obj_parameter['hands_joints_age'] = 0
+                draw_joints(img, self.detect_obj_parameter['hands_joints'], overlay=self.overlay)
         return img   
 
+    # hands_joints as [[x,y,z], ...] list, the format before numpy arrays
+    @pipelinemethod
+    def hands_joints_list(self):
+        from .hands_detection import joints_to_list
+        return joints_to_list(self.detect_obj_parameter['hands_joints'])
+
 # pose detection
-    @staticmethod
-    def pose_detect_switch(flag=False):
-        from .pose_detection import DetectPose
-        Vilib.pose_detect = DetectPose()
-        Vilib.detect_obj_parameter['pdf_flag'] = flag
-
-    @staticmethod
-    def pose_detect_fuc(img):
-        if Vilib.detect_obj_parameter['pdf_flag'] == True:
-            img,Vilib.detect_obj_parameter['body_joints'] = Vilib.pose_detect.work(image=img)   
+    pose_worker = None
+    @pipelinemethod
+    def pose_detect_switch(self, flag=False, worker=False, model_complexity=None, process_size=None):
+        # worker=True runs mediapipe in a child process, results arrive a few frames late
+        # model_complexity 0 and a smaller process_size (e.g. (320,240)) trade accuracy for frame rate
+        if self.pose_worker != None:
+            self.pose_worker.close()
+            self.pose_worker = None
+        if flag == True:
+            options = dict(model_complexity=model_complexity, process_size=process_size)
+            if worker == True:
+                from .mediapipe_worker import MediapipeWorker
+                self.pose_worker = MediapipeWorker('pose', **options)
+            else:
+                from .pose_detection import DetectPose
+                self.pose_detect = DetectPose(**options)
+        self.detect_obj_parameter['pdf_flag'] = flag
+
+    @pipelinemethod
+    def pose_detect_fuc(self, img):
+        if self.detect_obj_parameter['pdf_flag'] == True:
+            if self.pose_worker != None:
+                from .pose_detection import draw_joints
+                self.pose_worker.poll()
+                self.pose_worker.submit(img, self.frame_timestamp)
+                self.detect_obj_parameter['body_joints'] = self.pose_worker.joints
+                self.detect_obj_parameter['body_joints_age'] = self.pose_worker.age
+                draw_joints(img, self.pose_worker.joints, overlay=self.overlay)
+            else:
+                from .pose_detection import draw_joints
+                joints = self.pose_detect.detect(img)
+                # a copy, detect() overwrites its buffer with the next frame
+                self.detect_obj_parameter['body_joints'] = joints.copy() if joints is not None else None
+                self.detect_obj_parameter['body_joints_age'] = 0
+                draw_joints(img, self.detect_obj_parameter['body_joints'], overlay=self.overlay)
         return img
 
+    # body_joints as [[x,y,z,visibility], ...] list, the format before numpy arrays
+    @pipelinemethod
+    def body_joints_list(self):
+        from .pose_detection import joints_to_list
+        return joints_to_list(self.detect_obj_parameter['body_joints'])
+
+
+# initial state of the pipelines created after the default one
+Vilib.initial_parameters = copy.deepcopy(Vilib.detect_obj_parameter)
+
 
 if __name__ == '__main__':
     Vilib().camera_start()